@@ -0,0 +1,294 @@
+"""Checkpoints of running Simulations
+
+save() writes the state of a Simulation between two ticks to a compact
+binary file: Persons, their actions, the message heap, the Location
+PersonWakeUp, random generator states and the event list. restore()
+creates a Simulation from such a file without simulating earlier ticks
+again, e.g. to branch several what-if variants from a warm state:
+
+    >>> s.run(until=3600, real_time=False, monitor=False)
+    >>> checkpoint.save(s, 'warm.ckpt')
+    >>> s2 = checkpoint.restore('warm.ckpt')
+    >>> s2.add_monitor(...)
+    >>> s2.run(until=28800, real_time=False, monitor=True)
+
+The geo model is not stored. Nodes and WaySegments are stored as
+references and resolved in the model given to restore(), by default
+the map the Simulation was created with. Monitors are not stored.
+
+Generators (SimPy's process execution methods) cannot be pickled, so
+they are recreated at their current yield: Person.go, ActionScheduler.go,
+PersonSpawner.go and Location.serve are supported, Person classes
+overriding go() are not. LightPersons have no generators and are stored
+with the ActionScheduler.
+Person classes must be importable by pickle."""
+
+import inspect
+import struct
+import types
+import zlib
+from cPickle import Pickler, Unpickler, HIGHEST_PROTOCOL
+from cStringIO import StringIO
+from heapq import heapify
+
+from SimPy import SimulationRT
+from SimPy.SimulationRT import hold
+
+import collide
+import group
+from core import Person, ActionScheduler, PersonSpawner
+from locations import Location
+from geo import osm
+
+__maintainer__ = "B. Henne"
+__contact__ = "henne@dcsec.uni-hannover.de"
+__copyright__ = "(c) 2012, DCSec, Leibniz Universitaet Hannover, Germany"
+__license__ = "GPLv3"
+
+MAGIC = 'MOSPCKPT'  #: first bytes of a checkpoint file
+VERSION = 1         #: version of the checkpoint file format
+
+# what is not pickled with the Simulation's __dict__, but restored separately
+_SIM_EXCLUDE = ('geo', 'monitors', '_timestamps', '_calendar', 'wallclock')
+
+
+class CheckpointException(Exception):
+    """Exception raised if a Simulation cannot be checkpointed or restored."""
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
+
+_PERSON_GO = Person.go.im_func.func_code
+_SCHEDULER_GO = ActionScheduler.go.im_func.func_code
+_SPAWNER_GO = PersonSpawner.go.im_func.func_code
+_LOCATION_SERVE = Location.serve.im_func.func_code
+
+
+def resume_point(proc):
+    """Returns where the process execution method of proc stopped.
+
+    @return: None if proc has no process execution method (anymore), else
+    (kind, data) with kind 'person', 'person_passive', 'scheduler', 'spawner' or 'location'
+    and data True if the generator was started"""
+    gen = proc._nextpoint
+    if gen is None or proc._terminated or gen.gi_frame is None:
+        return None
+    if gen.gi_code is _RESUME_PASSIVE:
+        inner = gen.gi_frame.f_locals.get('go')
+        if inner is None:
+            return 'person', True
+        gen = inner
+    started = gen.gi_frame.f_lasti != -1
+    if gen.gi_code is _PERSON_GO:
+        if started and getattr(proc, '_passivated', False):
+            return 'person_passive', gen.gi_frame.f_locals['sleep']
+        return 'person', started
+    if gen.gi_code is _SCHEDULER_GO:
+        return 'scheduler', started
+    if gen.gi_code is _SPAWNER_GO:
+        return 'spawner', started
+    if gen.gi_code is _LOCATION_SERVE:
+        return 'location', started
+    raise CheckpointException('cannot checkpoint process %s executing %s' % (proc.name, gen.gi_code.co_name))
+
+
+def resume(proc, point):
+    """Sets a new process execution method of proc continuing at point, see resume_point()."""
+    kind, data = point
+    if kind == 'person':
+        proc._nextpoint = _primed_go(proc) if data else proc.go()
+    elif kind == 'person_passive':
+        proc._nextpoint = _resume_passive(proc, data)
+    elif kind == 'scheduler':
+        # the loop of go() continues at its beginning after 'yield hold' or 'yield passivate'
+        proc._nextpoint = proc.go()
+    elif kind == 'spawner':
+        # go() continues with spawns[next_spawn] at its beginning
+        proc._nextpoint = proc.go()
+    elif kind == 'location':
+        # the loop of serve() continues at its beginning after 'yield hold' or 'yield passivate'
+        proc._nextpoint = proc.serve()
+
+
+def _primed_go(person):
+    """Returns a new Person.go() generator that stopped at the 'yield hold' of its loop."""
+    duration = person._duration
+    go = person.go()
+    go.next()
+    person._duration = duration
+    return go
+
+
+def _resume_passive(person, sleep):
+    """Continues Person.go() after 'yield passivate' once the Person is reactivated."""
+    person._passivated = False
+    sleep = person._next_sleep(sleep)
+    yield hold, person, max(sleep, 1)
+    go = _primed_go(person)
+    for command in go:
+        yield command
+
+_RESUME_PASSIVE = _resume_passive.func_code
+
+
+def event_notices(sim):
+    """Returns all uncancelled event notices [at, sortpr, process, cancelled] of sim in order of execution."""
+    if hasattr(sim, '_calendar'):
+        recs = [rec for bucket in sim._calendar.itervalues() for rec in bucket]
+    else:
+        recs = list(sim._timestamps)
+    return sorted((rec for rec in recs if not rec[3]), key=lambda rec: (rec[0], rec[1]))
+
+
+def _class_functions(classes):
+    """Maps id of functions and action classes defined in classes to (class, name)."""
+    re = {}
+    for cls in classes:
+        for c in inspect.getmro(cls):
+            for name, obj in c.__dict__.iteritems():
+                if isinstance(obj, types.FunctionType):
+                    re.setdefault(id(obj), ('function', c, name))
+                    action = getattr(obj, 'action', None)
+                    if isinstance(action, type):
+                        re.setdefault(id(action), ('action', c, name))
+    return re
+
+
+def _importable(obj):
+    """Can pickle store obj by reference?"""
+    module = inspect.getmodule(obj)
+    return module is not None and getattr(module, obj.__name__, None) is obj
+
+
+def _processes(sim):
+    """Returns all Persons, Locations and the ActionScheduler of sim. LightPersons are no processes."""
+    procs = set([sim.person_alarm_clock, sim.action_scheduler])
+    procs.update(p for p in sim.persons if isinstance(p, SimulationRT.Process))
+    procs.update(p for p in sim.removed_persons.itervalues() if isinstance(p, SimulationRT.Process))
+    procs.update(rec[2] for rec in event_notices(sim))
+    return procs
+
+
+def save(sim, path):
+    """Writes a checkpoint of sim to path.
+
+    Must be called between ticks, i.e. not by a process of sim.
+    @param sim: a mosp.core.Simulation
+    @param path: path of checkpoint file
+    @raise CheckpointException: sim cannot be checkpointed"""
+    if sim.person_state is not None:
+        raise CheckpointException('checkpoints of Simulations with person_state are not supported')
+    if sim.condQ:
+        raise CheckpointException('checkpoints of processes waiting with waituntil are not supported')
+    geo = sim.geo
+    procs = _processes(sim)
+    refs = {id(sim): ('sim',), id(geo): ('geo',)}
+    for key, node in geo.nodes.iteritems():
+        refs[id(node)] = ('node', key)
+    ways = [o for o in geo.obj if isinstance(o, collide.Line) and hasattr(o, 'persons')]
+    for way in ways:
+        refs[id(way)] = ('way', way.id)
+    funcs = _class_functions(set(type(p) for p in procs))
+
+    def persistent_id(obj):
+        ref = refs.get(id(obj))
+        if ref is not None:
+            return ref
+        if isinstance(obj, types.GeneratorType):
+            return ('generator',)
+        if isinstance(obj, types.MethodType):
+            if obj.im_self is None:
+                return ('method', obj.im_class, obj.im_func.__name__)
+            return ('method', obj.im_self, obj.im_func.__name__)
+        if isinstance(obj, (types.FunctionType, type)) and id(obj) in funcs:
+            if not _importable(obj):
+                return funcs[id(obj)]
+        return None
+
+    state = dict((k, v) for k, v in sim.__dict__.iteritems() if k not in _SIM_EXCLUDE)
+    payload = {
+        'sim': state,
+        'processes': [(proc, resume_point(proc)) for proc in procs],
+        'events': [(rec[0], rec[2]) for rec in event_notices(sim)],
+        'ways': [(way, way.persons) for way in ways if way.persons],
+        }
+    header = {'version': VERSION, 'sim_class': type(sim), 'tick': sim.now(),
+              'map': geo.path, 'grid_size': geo.grid_size}
+    data = StringIO()
+    Pickler(data, HIGHEST_PROTOCOL).dump(header)
+    pickler = Pickler(data, HIGHEST_PROTOCOL)
+    pickler.persistent_id = persistent_id
+    pickler.dump(payload)
+    f = open(path, 'wb')
+    f.write(MAGIC + struct.pack('!I', VERSION) + zlib.compress(data.getvalue()))
+    f.close()
+
+
+def restore(path, geo=None, allow_dup=True):
+    """Creates a Simulation from a checkpoint.
+
+    The Simulation continues at the tick of the checkpoint. Monitors must be added again.
+    @param path: path of checkpoint file written by save()
+    @param geo: geo model, by default an OSMModel of the map the Simulation was created with
+    @param allow_dup: allow multiple Simulations, see Simulation.__init__
+    @return: the restored Simulation"""
+    f = open(path, 'rb')
+    magic = f.read(len(MAGIC) + 4)
+    if magic[:len(MAGIC)] != MAGIC or struct.unpack('!I', magic[len(MAGIC):])[0] != VERSION:
+        raise CheckpointException('%s is no checkpoint of version %s' % (path, VERSION))
+    data = StringIO(zlib.decompress(f.read()))
+    f.close()
+    header = Unpickler(data).load()
+    assert allow_dup or osm.GLOBAL_SIM is None
+    if geo is None:
+        geo = osm.OSMModel(header['map'], grid_size=header['grid_size'])
+    cls = header['sim_class']
+    sim = cls.__new__(cls)
+    SimulationRT.SimulationRT.__init__(sim)
+    geo.initialize(sim)
+    ways = dict((o.id, o) for o in geo.obj if isinstance(o, collide.Line) and hasattr(o, 'persons'))
+
+    def persistent_load(ref):
+        kind = ref[0]
+        if kind == 'sim':
+            return sim
+        if kind == 'geo':
+            return geo
+        if kind == 'node':
+            return geo.nodes[ref[1]]
+        if kind == 'way':
+            return ways[ref[1]]
+        if kind == 'generator':
+            return None
+        if kind == 'method':
+            return getattr(ref[1], ref[2])
+        if kind == 'function':
+            return ref[1].__dict__[ref[2]]
+        if kind == 'action':
+            return ref[1].__dict__[ref[2]].action
+        raise CheckpointException('unknown reference %r' % (ref,))
+
+    unpickler = Unpickler(data)
+    unpickler.persistent_load = persistent_load
+    payload = unpickler.load()
+
+    sim.__dict__.update(payload['sim'])
+    sim.geo = geo
+    sim.monitors = []
+    osm.GLOBAL_SIM = sim
+    group.Message.sim = sim
+    heapify(sim.messages)
+    for way, persons in payload['ways']:
+        way.persons = persons
+    for proc, point in payload['processes']:
+        proc.sim = sim
+        proc._rec = None
+        proc._nextTime = None
+    for proc, point in payload['processes']:
+        if point is not None:
+            resume(proc, point)
+    for at, proc in payload['events']:
+        sim._post(proc, at)
+    return sim
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 """Classes and algorithms for collision detection."""
 
-from math import sqrt
+from math import cos, floor, radians, sin, sqrt
+from collections import OrderedDict
+import hashlib
 import os
 import struct
 
@@ -10,6 +12,13 @@ __contact__ = "henne@dcsec.uni-hannover.de"
 __copyright__ = "(c) 2010-2011, DCSec, Leibniz Universitaet Hannover, Germany"
 __license__ = "GPLv3"
 
+GRID_CACHE_MAGIC = 'MOSPGRID'   #: first bytes of a grid cache file
+GRID_CACHE_VERSION = 2          #: version of the grid cache file format
+GRID_CACHE_HEADER = struct.Struct('<8sI20siqqqqIIIQ')
+"""grid cache header: magic, version, content hash, grid_size, start_x, start_y, end_x, end_y,
+columns, rows, number of objects, number of items. It is followed by the
+little endian arrays index (int64, cells + 1), items (int32) and object ids (uint32)."""
+
 
 class World(object):
     """A set of all walkable elements in the simulated world, e. g. streets and
@@ -28,6 +37,9 @@ class World(object):
         self.obj = set()
         self.free_obj = set()
         self.grid = {}
+        self.polygon_cells_cache = OrderedDict()    #: maps id of a Polygon to (Polygon, inside, boundary) in order of use, see polygon_cells()
+        self.polygon_cells_cache_size = 64          #: maximum number of Polygons in polygon_cells_cache
+        self.grid_index = None      #: flat grid: objects of cell c are grid_objects[grid_items[grid_index[c]:grid_index[c+1]]], see calculate_grid_arrays()
 
     def add(self, obj):
         """Adds an object to the world."""
@@ -37,73 +49,327 @@ class World(object):
         """Updates an object of the world."""
         self.obj.update(items)
 
+    def calculate_bounds(self):
+        """Sets the grid boundaries start_x, start_y, end_x, end_y from the objects of the World if not done before."""
+        if hasattr(self, 'start_x'):
+            return
+        # calculate grid boundary coordinates (min|max)*
+        min_x = min_y = float('inf')
+        max_x = max_y = 0
+        for obj in self.obj:
+            for point in obj.get_points():
+                min_x = min(min_x, point[0])
+                max_x = max(max_x, point[0])
+                min_y = min(min_y, point[1])
+                max_y = max(max_y, point[1])
+        # calculate grid boundary min/max coordinates as (start|end)*
+        self.start_x = int(min_x) / self.grid_size * self.grid_size
+        self.start_y = int(min_y) / self.grid_size * self.grid_size
+        self.end_x = int(max_x) / self.grid_size * self.grid_size
+        self.end_y = int(max_y) / self.grid_size * self.grid_size
+
     def calculate_grid(self, cache_base_path=None):
         """Calculates the collision grid of the World.
         
         This method must be called after all world objects have been
         added to the World. It calculate which objects are in which grid segment.
-        Calculation is done by colliding each object with each grid segment.
+        Calculation is done by colliding each object with each grid segment
+        it may cross, see grid_segments_of().
         Determining a grid grid segment by coordinates is done by integer maths.
         A grid segment is represented by its west and south border, e.g.
         grid_size=50, p=(127.9; 33.2) => segment is x=100, y=0."""
-        # setup boundaries if not done before
-        if not hasattr(self, 'start_x'):
-            # calculate grid boundary coordinates (min|max)*
-            min_x = min_y = float('inf')
-            max_x = max_y = 0
-            for obj in self.obj:
-                for point in obj.get_points():
-                    min_x = min(min_x, point[0])
-                    max_x = max(max_x, point[0])
-                    min_y = min(min_y, point[1])
-                    max_y = max(max_y, point[1])
-            # calculate grid boundary min/max coordinates as (start|end)*
-            self.start_x = int(min_x) / self.grid_size * self.grid_size
-            self.start_y = int(min_y) / self.grid_size * self.grid_size
-            self.end_x = int(max_x) / self.grid_size * self.grid_size
-            self.end_y = int(max_y) / self.grid_size * self.grid_size
+        self.calculate_bounds()
+        self.polygon_cells_cache.clear()
 
         # setup grid cache path
         cache_path = None
         if cache_base_path:
-            cache_path = cache_base_path + '.grid' + str(self.grid_size)
+            cache_path = '%s.grid%d.v%d' % (cache_base_path, self.grid_size, GRID_CACHE_VERSION)
         
         # load grid from cache file if possible
-        if cache_path and os.path.exists(cache_path):
-            objs = {}
-            for obj in self.obj:
-                objs[obj.id] = obj
-            rect_data_fmt = struct.Struct('!III')
-            id_fmt = struct.Struct('!I')
-            cache = open(cache_path)
-            data = cache.read(rect_data_fmt.size)
-            while data:
-                x, y, count = rect_data_fmt.unpack(data)
-                self.grid.setdefault(x, {})
-                rect = set()
-                for i in xrange(count):
-                    rect.add(objs[id_fmt.unpack(cache.read(id_fmt.size))[0]])
-                self.grid[x][y] = rect
-                data = cache.read(rect_data_fmt.size)
+        if cache_path and os.path.exists(cache_path) and self.load_grid_cache(cache_path):
+            return
         # if not cached, build collision grid from scratch
+        grid_size = self.grid_size
+        self.grid = {}
+        for x in xrange(self.start_x, self.end_x + 1, grid_size):
+            self.grid[x] = {}
+            for y in xrange(self.start_y, self.end_y + 1, grid_size):
+                self.grid[x][y] = set()
+        # collide each object with the grid segments it may cross only
+        for obj in self.obj | self.free_obj:
+            for x, y in self.grid_segments_of(obj):
+                if obj.collide_rectangle(x, y, x + grid_size, y + grid_size):
+                    self.grid[x][y].add(obj)
+        self.calculate_grid_arrays()
+        # store grid in cache file
+        if cache_path:
+            self.save_grid_cache(cache_path)
+
+    def _get_grid(self):
+        if self._grid is None:
+            # loaded from cache, build dicts on first use
+            size, cols, rows, index, items = self.grid_levels[0]
+            self._grid = _grid_dict(self, self.grid_objects, index, items)
+        return self._grid
+
+    def _set_grid(self, grid):
+        self._grid = grid
+
+    grid = property(_get_grid, _set_grid, doc="""The collision grid: grid[x][y] is the set of objects in grid segment x, y
+        (west and south border). Used by collide_circle_impl1/2, built on first use if the grid was loaded from cache.""")
+
+    def grid_content_hash(self):
+        """Returns the SHA-1 digest of the ids, types and coordinates of all objects of the World and the grid_size.
+
+        It identifies the content of the grid in a grid cache file."""
+        digest = hashlib.sha1(struct.pack('<i', self.grid_size))
+        for obj in sorted(self.obj | self.free_obj, key=lambda o: o.id):
+            digest.update(struct.pack('<I', obj.id) + type(obj).__name__)
+            for x, y in obj.get_points():
+                digest.update(struct.pack('<dd', x, y))
+        return digest.digest()
+
+    def save_grid_cache(self, path):
+        """Writes the grid to a cache file, see GRID_CACHE_HEADER and load_grid_cache().
+
+        The file is written to a temporary file next to path first and renamed
+        to path, so other Worlds may still have the old file memory-mapped."""
+        if self.grid_index is not None:
+            objects, index, items = self.grid_objects, self.grid_index.tolist(), self.grid_items.tolist()
+        else:
+            objects, index, items = self._grid_csr()
+        cols = (self.end_x - self.start_x) / self.grid_size + 1
+        rows = (self.end_y - self.start_y) / self.grid_size + 1
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        cache = open(tmp_path, 'wb')
+        try:
+            cache.write(GRID_CACHE_HEADER.pack(GRID_CACHE_MAGIC, GRID_CACHE_VERSION, self.grid_content_hash(),
+                                               self.grid_size, self.start_x, self.start_y, self.end_x, self.end_y,
+                                               cols, rows, len(objects), len(items)))
+            cache.write(struct.pack('<%dq' % len(index), *index))
+            cache.write(struct.pack('<%di' % len(items), *items))
+            cache.write(struct.pack('<%dI' % len(objects), *[obj.id for obj in objects]))
+            cache.close()
+            os.rename(tmp_path, path)
+        except Exception:
+            cache.close()
+            os.remove(tmp_path)
+            raise
+
+    def load_grid_cache(self, path):
+        """Loads the grid from a cache file written by save_grid_cache().
+
+        The file is used only if its header matches the World: format
+        version, content hash (see grid_content_hash()), grid size and
+        bounds. With NumPy, its arrays are memory-mapped and used as flat
+        grid directly, the dicts of World.grid are built on first use only.
+        @return: True if the grid was loaded, False if the file is invalid or outdated"""
+        self.calculate_bounds()
+        cache = open(path, 'rb')
+        header = cache.read(GRID_CACHE_HEADER.size)
+        if len(header) < GRID_CACHE_HEADER.size:
+            cache.close()
+            return False
+        magic, version, content, grid_size, start_x, start_y, end_x, end_y, cols, rows, n_objects, n_items = GRID_CACHE_HEADER.unpack(header)
+        if ((magic, version, grid_size, start_x, start_y, end_x, end_y) !=
+                (GRID_CACHE_MAGIC, GRID_CACHE_VERSION, self.grid_size, self.start_x, self.start_y, self.end_x, self.end_y)
+                or content != self.grid_content_hash()):
+            cache.close()
+            return False
+        n_index = cols * rows + 1
+        offset = GRID_CACHE_HEADER.size
+        objs = dict((obj.id, obj) for obj in self.obj | self.free_obj)
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        if numpy is None:
+            index = struct.unpack('<%dq' % n_index, cache.read(8 * n_index))
+            items = struct.unpack('<%di' % n_items, cache.read(4 * n_items))
+            ids = struct.unpack('<%dI' % n_objects, cache.read(4 * n_objects))
+            cache.close()
+            objects = [objs[i] for i in ids]
+            self.grid = _grid_dict(self, objects, index, items)
+            return True
+        cache.close()
+        index = _map_array(path, '<i8', offset, n_index)
+        offset += 8 * n_index
+        items = _map_array(path, '<i4', offset, n_items)
+        offset += 4 * n_items
+        ids = _map_array(path, '<u4', offset, n_objects)
+        objects = [objs[i] for i in ids.tolist()]
+        self._set_grid_arrays(objects, index, items)
+        self._grid = None
+        return True
+
+    def grid_segments_of(self, obj):
+        """Yields the west and south border x, y of all grid segments obj may collide with.
+
+        Lines are rasterized column by column: in each grid column crossed
+        by the Line, the grid segments between the lowest and the highest y
+        of the Line in that column are yielded. Points yield the grid segments
+        containing them. Columns and rows are widened by a small margin, so
+        segments touched at their borders and segments found by the integer
+        arithmetic of Line.collide_rectangle() for int coordinates are
+        included, too. Thus colliding obj with the yielded segments gives the
+        same grid as colliding it with all segments, at a cost proportional
+        to the length of the Line. For other objects all segments are yielded."""
+        grid_size = self.grid_size
+        start_x, start_y = self.start_x, self.start_y
+        last_col = (self.end_x - start_x) / grid_size
+        last_row = (self.end_y - start_y) / grid_size
+
+        def cells(low, high, start, last):
+            """Returns the range of grid columns/rows overlapping low..high."""
+            return xrange(max(int(floor((low - start) / float(grid_size))), 0),
+                          min(int(floor((high - start) / float(grid_size))), last) + 1)
+
+        if isinstance(obj, Line):
+            x0, y0, x1, y1 = obj.x_start, obj.y_start, obj.x_end, obj.y_end
+            if x0 > x1:
+                x0, y0, x1, y1 = x1, y1, x0, y0
+            if all(isinstance(v, float) for v in (x0, y0, x1, y1)):
+                margin = 1e-6
+            else:
+                # integer divisions of Line.collide_rectangle() move each clipped point by up to 1, at most 4 clips
+                margin = 4
+            for col in cells(x0 - margin, x1 + margin, start_x, last_col):
+                # part of the Line inside this column widened by margin
+                x = start_x + col * grid_size
+                a = min(max(x - margin, x0), x1)
+                b = min(max(x + grid_size + margin, x0), x1)
+                if x0 == x1:
+                    y_a, y_b = y0, y1
+                else:
+                    y_a = y0 + (y1 - y0) * (a - x0) / float(x1 - x0)
+                    y_b = y0 + (y1 - y0) * (b - x0) / float(x1 - x0)
+                for row in cells(min(y_a, y_b) - margin, max(y_a, y_b) + margin, start_y, last_row):
+                    yield x, start_y + row * grid_size
+        elif isinstance(obj, Point):
+            for col in cells(obj.x - 1e-6, obj.x + 1e-6, start_x, last_col):
+                for row in cells(obj.y - 1e-6, obj.y + 1e-6, start_y, last_row):
+                    yield start_x + col * grid_size, start_y + row * grid_size
         else:
-            # for each grid segment x,y
-            for x in xrange(self.start_x, self.end_x + 1, self.grid_size):
-                self.grid[x] = {}
-                for y in xrange(self.start_y, self.end_y + 1, self.grid_size):
-                    # collide world with grid segment and get all objects contained in segment
-                    rect = self.collide_rectangle(x, y, x + self.grid_size, y + self.grid_size)
-                    self.grid[x][y] = rect
-            # store grid in cache file
-            if cache_path:
-                cache = open(cache_path, 'w')
-                for x in self.grid:
-                    for y in self.grid[x]:
-                        data = ''
-                        for obj in self.grid[x][y]:
-                            data += struct.pack('!I', obj.id)
-                        cache.write(struct.pack('!III', x, y, len(self.grid[x][y])) + data)
-                cache.close()
+            for x in xrange(start_x, self.end_x + 1, grid_size):
+                for y in xrange(start_y, self.end_y + 1, grid_size):
+                    yield x, y
+
+    def calculate_grid_arrays(self):
+        """Builds the flat, array-backed copy of the collision grid used by collide_circle_impl3.
+
+        Cells are numbered by column, cell x, y has number
+        (x - start_x) / grid_size * grid_rows + (y - start_y) / grid_size.
+        The indexes of its objects in grid_objects are stored in
+        grid_items[grid_index[cell]:grid_index[cell + 1]] (compressed sparse rows).
+        Lines and Points are stored as segments in the columns of grid_segments:
+        x_start, y_start, x_end, y_end, x_end - x_start, y_end - y_start and squared length
+        (1 for Points and Lines of length 0).
+        Other objects are marked in grid_custom and collided by their collide_circle().
+        grid_levels holds this grid as level 0, coarser levels for larger
+        radii are added on demand by collide_circle_indexes().
+        Requires NumPy, without NumPy grid_index stays None."""
+        try:
+            import numpy
+        except ImportError:
+            self.grid_index = None
+            return
+        self._set_grid_arrays(*self._grid_csr())
+
+    def _grid_csr(self):
+        """Returns World.grid as (objects, index, items) lists in the cell numbering of calculate_grid_arrays()."""
+        grid_size = self.grid_size
+        rows = (self.end_y - self.start_y) / grid_size + 1
+        objects = []
+        numbers = {}
+        counts = [0] * ((self.end_x - self.start_x) / grid_size * rows + rows + 1)
+        cells = {}
+        for x, column in self.grid.iteritems():
+            for y, rect in column.iteritems():
+                cell = (x - self.start_x) / grid_size * rows + (y - self.start_y) / grid_size
+                items = []
+                for obj in rect:
+                    i = numbers.get(id(obj))
+                    if i is None:
+                        i = numbers[id(obj)] = len(objects)
+                        objects.append(obj)
+                    items.append(i)
+                items.sort()
+                counts[cell + 1] = len(items)
+                cells[cell] = items
+        index = [0]
+        items = []
+        for cell in xrange(len(counts) - 1):
+            items.extend(cells.get(cell, ()))
+            index.append(len(items))
+        return objects, index, items
+
+    def _set_grid_arrays(self, objects, index, items):
+        """Sets the flat grid of objects, index and items (sequences or NumPy arrays), see calculate_grid_arrays()."""
+        import numpy
+        grid_size = self.grid_size
+        self.grid_cols = (self.end_x - self.start_x) / grid_size + 1    #: number of grid columns (x)
+        self.grid_rows = (self.end_y - self.start_y) / grid_size + 1    #: number of grid rows (y)
+        index = numpy.asarray(index, dtype=numpy.int64)
+        items = numpy.asarray(items, dtype=numpy.int32)
+        counts = numpy.diff(index)
+        segments = numpy.zeros((len(objects), 7))
+        custom = numpy.zeros(len(objects), dtype=bool)
+        for i, obj in enumerate(objects):
+            if isinstance(obj, Line):
+                x1 = obj.x_end - obj.x_start
+                y1 = obj.y_end - obj.y_start
+                # same arithmetic as Line.closest_to_point, squared length 1 instead of 0 gives t = 0
+                segments[i] = obj.x_start, obj.y_start, obj.x_end, obj.y_end, x1, y1, float(x1 ** 2 + y1 ** 2) or 1.0
+            elif isinstance(obj, Point):
+                segments[i] = obj.x, obj.y, obj.x, obj.y, 0, 0, 1
+            else:
+                custom[i] = True
+        self.grid_objects = objects     #: objects of the flat grid
+        self.grid_items = items
+        self.grid_segments = segments
+        self.grid_custom = custom if custom.any() else None
+        self.grid_index = index
+        # list copies for small candidate sets are built on first use, see grid_levels
+        self._grid_levels = None
+        self._grid_segment_list_cache = None
+        self._grid_buffer = numpy.zeros(9 * int(counts.max()) if len(counts) else 0, dtype=numpy.int32)
+
+    def _get_grid_levels(self):
+        if self._grid_levels is None:
+            self._grid_levels = [(self.grid_size, self.grid_cols, self.grid_rows, self.grid_index.tolist(), self.grid_items.tolist())]
+        return self._grid_levels
+
+    grid_levels = property(_get_grid_levels, doc="""(cell size, columns, rows, index list, items list) of each level of the flat grid.
+        Level 0 holds list copies of grid_index and grid_items, used by collide_circle_indexes() for small candidate sets.
+        It is built on first use, so a memory-mapped grid cache is not copied at load_grid_cache().""")
+
+    def _get_grid_segment_list(self):
+        if self._grid_segment_list_cache is None:
+            custom = self.grid_custom.tolist() if self.grid_custom is not None else [False] * len(self.grid_objects)
+            self._grid_segment_list_cache = [None if c else tuple(seg) for seg, c in zip(self.grid_segments.tolist(), custom)]
+        return self._grid_segment_list_cache
+
+    _grid_segment_list = property(_get_grid_segment_list, doc="List copy of grid_segments, None for custom objects, built on first use.")
+
+    def _add_grid_level(self):
+        """Appends the next coarser level to grid_levels: cells of double size, merging 2 x 2 cells of the last level."""
+        size, cols, rows, index, items = self.grid_levels[-1]
+        new_cols = (cols + 1) / 2
+        new_rows = (rows + 1) / 2
+        new_index = [0]
+        new_items = []
+        for col in xrange(new_cols):
+            for row in xrange(new_rows):
+                merged = set()
+                for c in (2 * col, 2 * col + 1):
+                    for r in (2 * row, 2 * row + 1):
+                        if c < cols and r < rows:
+                            cell = c * rows + r
+                            merged.update(items[index[cell]:index[cell + 1]])
+                new_items.extend(sorted(merged))
+                new_index.append(len(new_items))
+        self.grid_levels.append((2 * size, new_cols, new_rows, new_index, new_items))
 
     def collide_circle_impl0(self, x, y, radius):
         """Checks all registered walkable objects for a collision with a
@@ -255,20 +521,323 @@ class World(object):
                 re2.add(obj)
         return re2
     
+    def collide_circle_indexes(self, x, y, radius):
+        """Returns the indexes in grid_objects of all grid objects colliding with the given circle.
+
+        Selects grid segments like collide_circle_impl2 and gathers their
+        objects from the flat grid. The radius may exceed grid_size: the
+        query uses the finest level of grid_levels whose cells are at least
+        radius wide, so it looks at 3 x 3 cells at most. Less than grid_vectorize_min candidates
+        are collided one by one in plain Python, which is faster than NumPy
+        for few candidates. More candidates are copied into a reused buffer
+        and collided in one vectorized NumPy pass. Free objects are not
+        included. Requires calculate_grid_arrays().
+        @return: list of distinct indexes"""
+        grid_size = self.grid_size
+        levels = self.grid_levels
+        level = 0
+        size, cols, rows, index, items = levels[0]
+        while size < radius and (cols > 1 or rows > 1):
+            level += 1
+            if level == len(levels):
+                self._add_grid_level()
+            size, cols, rows, index, items = levels[level]
+
+        # center of circle is in grid segment r_x (west), r_y (south) of the level
+        col = ((int(x) / grid_size * grid_size - self.start_x) / grid_size) >> level
+        row = ((int(y) / grid_size * grid_size - self.start_y) / grid_size) >> level
+        r_x = self.start_x + col * size
+        r_y = self.start_y + row * size
+
+        if size < radius:
+            # circle is larger than the whole grid
+            cells = [(c, r) for c in xrange(cols) for r in xrange(rows)]
+        else:
+            # determine which boundaries of segment r_x, r_y collide the given circle
+            top = _segment_collides_circle(r_x, r_y, r_x + size, r_y, x, y, radius)
+            left = _segment_collides_circle(r_x, r_y, r_x, r_y + size, x, y, radius)
+            right = _segment_collides_circle(r_x + size, r_y, r_x + size, r_y + size, x, y, radius)
+            bottom = _segment_collides_circle(r_x, r_y + size, r_x + size, r_y + size, x, y, radius)
+            cells = [(col, row)]
+            if top:
+                cells.append((col, row - 1))
+                if left:
+                    cells.append((col - 1, row - 1))
+                if right:
+                    cells.append((col + 1, row - 1))
+            if left:
+                cells.append((col - 1, row))
+            if right:
+                cells.append((col + 1, row))
+            if bottom:
+                cells.append((col, row + 1))
+                if left:
+                    cells.append((col - 1, row + 1))
+                if right:
+                    cells.append((col + 1, row + 1))
+
+        # gather candidates of all concerned grid segments
+        candidates = []
+        for c, r in cells:
+            if 0 <= c < cols and 0 <= r < rows:
+                cell = c * rows + r
+                candidates.extend(items[index[cell]:index[cell + 1]])
+        # objects spanning several grid segments are candidates more than once
+        if len(cells) > 1:
+            candidates = set(candidates)
+
+        if len(candidates) < self.grid_vectorize_min:
+            # closest points of candidate segments, like Line.closest_to_point
+            segments = self._grid_segment_list
+            re = []
+            for i in candidates:
+                seg = segments[i]
+                if seg is None:
+                    if self.grid_objects[i].collide_circle(x, y, radius):
+                        re.append(i)
+                    continue
+                x_start, y_start, x_end, y_end, x1, y1, squared = seg
+                t = ((x - x_start) * x1 + (y - y_start) * y1) / squared
+                if t < 0.0:
+                    close_x, close_y = x_start, y_start
+                elif t > 1.0:
+                    close_x, close_y = x_end, y_end
+                else:
+                    close_x, close_y = x_start + t * x1, y_start + t * y1
+                if sqrt((close_x - x) ** 2 + (close_y - y) ** 2) <= radius:
+                    re.append(i)
+            return re
+
+        import numpy
+        if len(candidates) > len(self._grid_buffer):
+            self._grid_buffer = numpy.zeros(2 * len(candidates), dtype=numpy.int32)
+        buf = self._grid_buffer[:len(candidates)]
+        buf[:] = list(candidates)
+        candidates = buf
+        # closest points of candidate segments, vectorized
+        x_start, y_start, x_end, y_end, x1, y1, squared = self.grid_segments.take(candidates, axis=0).T
+        t = ((x - x_start) * x1 + (y - y_start) * y1) / squared
+        close_x = numpy.where(t < 0.0, x_start, numpy.where(t > 1.0, x_end, x_start + t * x1))
+        close_y = numpy.where(t < 0.0, y_start, numpy.where(t > 1.0, y_end, y_start + t * y1))
+        hit = numpy.sqrt((close_x - x) ** 2 + (close_y - y) ** 2) <= radius
+        if self.grid_custom is not None:
+            objects = self.grid_objects
+            for i in numpy.flatnonzero(self.grid_custom[candidates]):
+                hit[i] = objects[candidates[i]].collide_circle(x, y, radius)
+        return candidates[hit].tolist()
+
+    def collide_circle_impl3(self, x, y, radius):
+        """Checks all registered walkable objects for collision that are
+        in grid segments which collide with the specified circle.
+
+        Same result as collide_circle_impl2, but uses the flat array-backed
+        grid (see calculate_grid_arrays() and collide_circle_indexes()) to
+        collide all candidates in one vectorized pass, and radius may be
+        larger than grid_size. Falls back to collide_circle_impl2 (or
+        collide_circle_impl0 for a radius larger than grid_size) if the
+        flat grid is not available."""
+        if self.grid_index is None:
+            if radius > self.grid_size:
+                return self.collide_circle_impl0(x, y, radius)
+            return self.collide_circle_impl2(x, y, radius)
+        objects = self.grid_objects
+        re = set([objects[i] for i in self.collide_circle_indexes(x, y, radius)])
+        for obj in self.free_obj:
+            if obj.collide_circle(x, y, radius):
+                re.add(obj)
+        return re
+
     # select circle collision implementation, may be overridden by user
-    collide_circle = collide_circle_impl2
+    collide_circle = collide_circle_impl3
+    grid_vectorize_min = 64     #: minimum number of candidates collided by NumPy in collide_circle_indexes()
 
-    # TODO: Is THIS working? It is not, is it?
     def collide_polygon(self, corners):
         """Checks all registered walkable objects for a collision with a given polygon.
-        @status: not implemented"""
-        raise NotImplementedError
+
+        The grid segments are classified by polygon_cells(): objects in
+        segments inside the polygon are returned without further tests,
+        only objects in segments cut by the boundary of the polygon are
+        collided by their collide_polygon(). Objects not in the grid
+        (free_obj) are always collided.
+        @param corners: a Polygon or a list of its corners (x, y)"""
+        polygon = corners if isinstance(corners, Polygon) else Polygon(corners)
+        inside, boundary = self.polygon_cells(polygon)
+        grid = self.grid
         re = set()
-        for obj in self:
-            if obj.collide_circle(corners):
+        for x, y in inside:
+            re.update(grid[x][y])
+        candidates = set()
+        for x, y in boundary:
+            candidates.update(grid[x][y])
+        for obj in (candidates - re) | self.free_obj:
+            if obj.collide_polygon(polygon):
+                re.add(obj)
+        return re
+
+    def polygon_cells(self, polygon):
+        """Classifies the grid segments by their position relative to polygon.
+
+        Segments colliding an edge of the polygon are found by rasterizing
+        the edges, see grid_segments_of(). All other segments are either
+        completely inside or completely outside of the polygon, which is
+        decided by a scanline through the centers of each row of segments.
+        The results of the last polygon_cells_cache_size polygons are kept
+        in polygon_cells_cache, so polygons queried every tick are classified once.
+        @param polygon: a Polygon
+        @return: (inside, boundary), sets of west and south borders x, y of segments
+        completely inside the polygon and of segments colliding its boundary"""
+        cache = self.polygon_cells_cache
+        cached = cache.pop(id(polygon), None)
+        if cached is not None and cached[0] is polygon:
+            cache[id(polygon)] = cached
+            return cached[1], cached[2]
+        grid_size = self.grid_size
+        boundary = set()
+        for edge in polygon.edges():
+            line = Line(*[float(v) for v in edge])
+            for x, y in self.grid_segments_of(line):
+                if line.collide_rectangle(x, y, x + grid_size, y + grid_size):
+                    boundary.add((x, y))
+        inside = set()
+        last_col = (self.end_x - self.start_x) / grid_size
+        for y in xrange(self.start_y, self.end_y + 1, grid_size):
+            center = y + grid_size / 2.0
+            crossings = polygon.crossings(center)
+            for i in xrange(0, len(crossings) - 1, 2):
+                # columns whose centers lie between a pair of crossings
+                first = max(int(floor((crossings[i] - self.start_x) / float(grid_size) - 0.5)) + 1, 0)
+                last = min(int(floor((crossings[i + 1] - self.start_x) / float(grid_size) - 0.5)), last_col)
+                for col in xrange(first, last + 1):
+                    cell = (self.start_x + col * grid_size, y)
+                    if cell not in boundary:
+                        inside.add(cell)
+        cache[id(polygon)] = (polygon, inside, boundary)
+        while len(cache) > self.polygon_cells_cache_size:
+            cache.popitem(last=False)
+        return inside, boundary
+
+    def collide_sector(self, x, y, radius, angle, direction):
+        """Checks all registered walkable objects for a collision with a sector of a circle,
+        e.g. the field of view of a camera or the beam of a directional antenna.
+
+        Only grid segments which may collide with the sector are searched,
+        see sector_cells(). Their objects are collided by
+        Sector.collide_segment(), grid_vectorize_min or more candidates in one
+        vectorized NumPy pass (see collide_sector_indexes()).
+        @param x: x of the center of the circle
+        @param y: y of the center of the circle
+        @param radius: radius of the circle
+        @param angle: central angle of the sector in degrees, 360 or more is the full circle
+        @param direction: angle between the x-axis and the bisector of the sector in degrees, see mosp.geo.utils.pointInSector()
+        @return: set of colliding objects"""
+        sector = Sector(x, y, radius, angle, direction)
+        if self.grid_index is None:
+            grid = self.grid
+            grid_size = self.grid_size
+            candidates = set()
+            for col, row in self.sector_cells(sector):
+                candidates.update(grid[self.start_x + col * grid_size][self.start_y + row * grid_size])
+            re = set([obj for obj in candidates if obj.collide_sector(sector)])
+        else:
+            objects = self.grid_objects
+            re = set([objects[i] for i in self.collide_sector_indexes(sector)])
+        for obj in self.free_obj:
+            if obj.collide_sector(sector):
                 re.add(obj)
         return re
 
+    def sector_cells(self, sector):
+        """Returns the grid segments (column, row) that may collide with sector.
+
+        In each column, only the rows colliding with the circle of sector
+        are considered. A segment is left out if all its corners are outside
+        one half-plane of each wedge of sector. This test is conservative,
+        but much cheaper than Sector.collide_rectangle()."""
+        grid_size = self.grid_size
+        start_x, start_y = self.start_x, self.start_y
+        last_col = (self.end_x - start_x) / grid_size
+        last_row = (self.end_y - start_y) / grid_size
+        x, y, radius = sector.x, sector.y, sector.radius
+        wedges = [wedge for wedge in sector.wedges if wedge]
+        cells = []
+        for col in xrange(max(int(floor((x - radius - start_x) / float(grid_size))), 0),
+                          min(int(floor((x + radius - start_x) / float(grid_size))), last_col) + 1):
+            x_min = start_x + col * grid_size
+            x_max = x_min + grid_size
+            # half height of the circle at the point of the column closest to its center
+            dx = max(x_min - x, 0, x - x_max)
+            h = sqrt(max(radius ** 2 - dx ** 2, 0))
+            for row in xrange(max(int(floor((y - h - start_y) / float(grid_size))), 0),
+                              min(int(floor((y + h - start_y) / float(grid_size))), last_row) + 1):
+                y_min = start_y + row * grid_size
+                y_max = y_min + grid_size
+                for wedge in wedges:
+                    for ux, uy in wedge:
+                        # largest ux * p_y - uy * p_x of all corners p
+                        if ux * ((y_max if ux > 0 else y_min) - y) - uy * ((x_min if uy > 0 else x_max) - x) < 0:
+                            break
+                    else:
+                        cells.append((col, row))
+                        break
+                else:
+                    if not wedges:
+                        cells.append((col, row))
+        return cells
+
+    def collide_sector_indexes(self, sector):
+        """Returns the indexes in grid_objects of all grid objects colliding with sector, see collide_sector().
+
+        Free objects are not included. Requires calculate_grid_arrays().
+        @return: list of distinct indexes"""
+        size, cols, rows, index, items = self.grid_levels[0]
+        candidates = set()
+        for col, row in self.sector_cells(sector):
+            cell = col * rows + row
+            candidates.update(items[index[cell]:index[cell + 1]])
+
+        if len(candidates) < self.grid_vectorize_min:
+            segments = self._grid_segment_list
+            re = []
+            for i in candidates:
+                seg = segments[i]
+                if seg is None:
+                    if self.grid_objects[i].collide_sector(sector):
+                        re.append(i)
+                elif sector.collide_segment(seg[0], seg[1], seg[2], seg[3]):
+                    re.append(i)
+            return re
+
+        import numpy
+        candidates = numpy.fromiter(candidates, dtype=numpy.int32, count=len(candidates))
+        x_start, y_start, x_end, y_end, x1, y1, squared = self.grid_segments.take(candidates, axis=0).T
+        # same arithmetic as Sector.collide_segment, vectorized
+        px = x_start - sector.x
+        py = y_start - sector.y
+        hit = numpy.zeros(len(candidates), dtype=bool)
+        old = numpy.seterr(divide='ignore', invalid='ignore')
+        try:
+            for wedge in sector.wedges:
+                low = numpy.zeros(len(candidates))
+                high = numpy.ones(len(candidates))
+                for ux, uy in wedge:
+                    c0 = ux * py - uy * px
+                    c1 = ux * y1 - uy * x1
+                    t = -c0 / c1
+                    low = numpy.where(c1 > 0, numpy.maximum(low, t), low)
+                    high = numpy.where(c1 < 0, numpy.minimum(high, t), high)
+                    high = numpy.where((c1 == 0) & (c0 < 0), -1.0, high)
+                t = numpy.minimum(numpy.maximum(-(px * x1 + py * y1) / squared, low), high)
+                close_x = px + t * x1
+                close_y = py + t * y1
+                hit |= (low <= high) & (numpy.sqrt(close_x ** 2 + close_y ** 2) <= sector.radius)
+        finally:
+            numpy.seterr(**old)
+        if self.grid_custom is not None:
+            objects = self.grid_objects
+            for i in numpy.flatnonzero(self.grid_custom[candidates]):
+                hit[i] = objects[candidates[i]].collide_sector(sector)
+        return candidates[hit].tolist()
+
     def collide_rectangle(self, x_min, y_min, x_max, y_max):
         """Checks all registered walkable objects for a collision with a given rectangle."""
         re = set()
@@ -278,6 +847,47 @@ class World(object):
         return re
 
 
+def _grid_dict(world, objects, index, items):
+    """Returns the World.grid dicts of a flat grid, see World.calculate_grid_arrays()."""
+    grid_size = world.grid_size
+    rows = (world.end_y - world.start_y) / grid_size + 1
+    grid = {}
+    for x in xrange(world.start_x, world.end_x + 1, grid_size):
+        column = grid[x] = {}
+        cell = (x - world.start_x) / grid_size * rows
+        for y in xrange(world.start_y, world.end_y + 1, grid_size):
+            column[y] = set([objects[i] for i in items[index[cell]:index[cell + 1]]])
+            cell += 1
+    return grid
+
+
+def _map_array(path, dtype, offset, length):
+    """Returns length elements of dtype at offset of file path as read-only memory-mapped NumPy array."""
+    import numpy
+    if length == 0:
+        # empty parts of a file can not be mapped
+        return numpy.zeros(0, dtype=dtype)
+    return numpy.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(length,))
+
+
+def _segment_collides_circle(x_start, y_start, x_end, y_end, x, y, radius):
+    """Line(x_start, y_start, x_end, y_end).collide_circle(x, y, radius) without creating a Line."""
+    x1 = x_end - x_start
+    y1 = y_end - y_start
+    squared_dist = x1 ** 2 + y1 ** 2
+    if squared_dist == 0:
+        close_x, close_y = x_start, y_start
+    else:
+        t = ((x - x_start) * x1 + (y - y_start) * y1) / float(squared_dist)
+        if t < 0.0:
+            close_x, close_y = x_start, y_start
+        elif t > 1.0:
+            close_x, close_y = x_end, y_end
+        else:
+            close_x, close_y = x_start + t * x1, y_start + t * y1
+    return sqrt((close_x - x) ** 2 + (close_y - y) ** 2) <= radius
+
+
 class Rectangle(object):
     """A collidable rectangle. Not fully implemented.
     @status: not completely implemented
@@ -302,7 +912,7 @@ class Rectangle(object):
         @status: not implemented"""
         raise NotImplementedError
 
-    def collide_polygon(corners):
+    def collide_polygon(self, corners):
         """Not implemented! Checks if this rectangle collides with the given polygon.
         @status: not implemented"""
         raise NotImplementedError
@@ -534,27 +1144,230 @@ class Line(object):
 
 
     def collide_polygon(self, corners):
-        """Nothing Implemented! Checks if this line collides with the given polygon.
-        @status: not implemented"""
-        raise NotImplementedErrorss
+        """Checks if this line collides with the given polygon.
+        @param corners: a Polygon or a list of its corners (x, y)"""
+        polygon = corners if isinstance(corners, Polygon) else Polygon(corners)
+        x0, y0, x1, y1 = self.x_start, self.y_start, self.x_end, self.y_end
+        if polygon.contains_point(x0, y0):
+            return True
+        x_min, x_max = min(x0, x1), max(x0, x1)
+        y_min, y_max = min(y0, y1), max(y0, y1)
+        for edge in polygon.edges():
+            if (max(edge[0], edge[2]) < x_min or min(edge[0], edge[2]) > x_max or
+                max(edge[1], edge[3]) < y_min or min(edge[1], edge[3]) > y_max):
+                continue
+            if _segments_intersect(x0, y0, x1, y1, *edge):
+                return True
+        return False
+
+    def collide_sector(self, sector):
+        """Checks if this line collides with the given Sector."""
+        return sector.collide_segment(self.x_start, self.y_start, self.x_end, self.y_end)
 
     def __repr__(self):
         return "<Line (%i,%i) to (%i, %i)>" % (self.x_start, self.y_start, self.x_end, self.y_end)
 
 
 class Polygon(object):
-    """A collidable polygon. Nothing implemented yet.
-    @status: not implemented
-    @author: P. Tute"""
+    """A collidable polygon of one or more closed rings of corners.
+
+    A point is inside if it is inside an odd number of rings (even-odd
+    rule), so further rings may be holes or further parts of the polygon.
+    Points on the boundary are inside.
+    @author: B. Henne"""
+    def __init__(self, *rings):
+        """initializes the collidable polygon.
+
+        Each ring is a sequence of corners (x, y), the last corner
+        is connected to the first one."""
+        self.rings = [[(c[0], c[1]) for c in ring] for ring in rings if len(ring)]
+        self._edges = [ring[i - 1] + ring[i] for ring in self.rings for i in xrange(len(ring))]
+        points = list(self.get_points())
+        self.x_min = min(p[0] for p in points)
+        self.y_min = min(p[1] for p in points)
+        self.x_max = max(p[0] for p in points)
+        self.y_max = max(p[1] for p in points)
+
+    def get_points(self):
+        """Yields the corners (x, y) of all rings."""
+        for ring in self.rings:
+            for corner in ring:
+                yield corner
+
+    def edges(self):
+        """Returns all edges as list of (x_start, y_start, x_end, y_end)."""
+        return self._edges
+
+    def crossings(self, y):
+        """Returns the sorted x coordinates where the horizontal line at y crosses edges.
+
+        Edges are half-open in y, so a pair of crossings encloses the parts of the line inside the polygon."""
+        xs = []
+        for x0, y0, x1, y1 in self.edges():
+            if (y0 <= y < y1) or (y1 <= y < y0):
+                xs.append(x0 + (x1 - x0) * (y - y0) / float(y1 - y0))
+        xs.sort()
+        return xs
+
+    def contains_point(self, x, y):
+        """Checks if the point x, y is inside the polygon or on its boundary."""
+        if not (self.x_min <= x <= self.x_max and self.y_min <= y <= self.y_max):
+            return False
+        inside = False
+        for x0, y0, x1, y1 in self._edges:
+            if (y0 < y and y1 < y) or (y0 > y and y1 > y):
+                continue
+            if _point_on_segment(x, y, x0, y0, x1, y1):
+                return True
+            if (y0 <= y < y1) or (y1 <= y < y0):
+                if x < x0 + (x1 - x0) * (y - y0) / float(y1 - y0):
+                    inside = not inside
+        return inside
+
     def collide_circle(self, x, y, radius):
-        """Checks if this polygon collides with the given circle.
-        @status: not implemented"""
-        raise NotImplementedError
+        """Checks if this polygon collides with the given circle."""
+        if (x + radius < self.x_min or x - radius > self.x_max or
+            y + radius < self.y_min or y - radius > self.y_max):
+            return False
+        if self.contains_point(x, y):
+            return True
+        for edge in self.edges():
+            if _segment_collides_circle(*(edge + (x, y, radius))):
+                return True
+        return False
 
-    def collide_polygon(corners):
+    def collide_rectangle(self, x_min, y_min, x_max, y_max):
+        """Checks if this polygon collides with the given rectangle."""
+        if (x_max < self.x_min or x_min > self.x_max or
+            y_max < self.y_min or y_min > self.y_max):
+            return False
+        if self.contains_point(x_min, y_min):
+            # rectangle inside or cut by the boundary
+            return True
+        for edge in self.edges():
+            if Line(*edge).collide_rectangle(x_min, y_min, x_max, y_max):
+                return True
+        return False
+
+    def collide_polygon(self, corners):
         """Checks if this polygon collides with the given polygon.
-        @status: not implemented"""
-        raise NotImplementedError
+        @param corners: a Polygon or a list of its corners (x, y)"""
+        other = corners if isinstance(corners, Polygon) else Polygon(corners)
+        if (other.x_max < self.x_min or other.x_min > self.x_max or
+            other.y_max < self.y_min or other.y_min > self.y_max):
+            return False
+        if self.contains_point(*other.rings[0][0]) or other.contains_point(*self.rings[0][0]):
+            return True
+        for x0, y0, x1, y1 in self.edges():
+            for edge in other.edges():
+                if _segments_intersect(x0, y0, x1, y1, *edge):
+                    return True
+        return False
+
+    def __repr__(self):
+        return "<Polygon %i corners>" % sum(len(ring) for ring in self.rings)
+
+
+def _point_on_segment(x, y, x0, y0, x1, y1):
+    """Checks if the point x, y is on the segment x0, y0 to x1, y1."""
+    return ((x1 - x0) * (y - y0) == (y1 - y0) * (x - x0) and
+            min(x0, x1) <= x <= max(x0, x1) and min(y0, y1) <= y <= max(y0, y1))
+
+
+def _segments_intersect(ax, ay, bx, by, cx, cy, dx, dy):
+    """Checks if the segments a to b and c to d intersect or touch."""
+    def orientation(px, py, qx, qy, rx, ry):
+        v = (qx - px) * (ry - py) - (qy - py) * (rx - px)
+        return (v > 0) - (v < 0)
+    o1 = orientation(ax, ay, bx, by, cx, cy)
+    o2 = orientation(ax, ay, bx, by, dx, dy)
+    o3 = orientation(cx, cy, dx, dy, ax, ay)
+    o4 = orientation(cx, cy, dx, dy, bx, by)
+    if o1 != o2 and o3 != o4:
+        return True
+    # collinear cases
+    return ((o1 == 0 and _point_on_segment(cx, cy, ax, ay, bx, by)) or
+            (o2 == 0 and _point_on_segment(dx, dy, ax, ay, bx, by)) or
+            (o3 == 0 and _point_on_segment(ax, ay, cx, cy, dx, dy)) or
+            (o4 == 0 and _point_on_segment(bx, by, cx, cy, dx, dy)))
+
+
+class Sector(object):
+    """A sector of a circle, e.g. the field of view of a camera.
+
+    The sector is split into wedges of at most 180 degrees. Each wedge is
+    the intersection of the circle and two half-planes through its center,
+    given by vectors (ux, uy) along their borders: a point p relative to
+    the center is inside a half-plane if ux * p_y - uy * p_x >= 0.
+    Points on the borders are inside. Unlike mosp.geo.utils.pointInSector(),
+    distances are not rounded.
+    @author: B. Henne"""
+    def __init__(self, x, y, radius, angle, direction):
+        """initializes the sector.
+
+        x, y is the center and radius the radius of the circle, angle the central
+        angle and direction the angle between the x-axis and the bisector of
+        the sector, both in degrees. A sector of 360 degrees or more is the full circle."""
+        self.x = x
+        self.y = y
+        self.radius = radius
+        self.angle = angle
+        self.direction = direction
+        if angle >= 360:
+            self.wedges = [()]      #: list of wedges, each a tuple of half-plane vectors (ux, uy), see class documentation
+        else:
+            right = direction - angle / 2.0
+            bounds = [right, right + angle / 2.0, right + angle] if angle > 180 else [right, right + angle]
+            self.wedges = []
+            for a, b in zip(bounds, bounds[1:]):
+                a = radians(a)
+                b = radians(b)
+                # counter-clockwise of the right border, clockwise of the left border
+                self.wedges.append(((cos(a), sin(a)), (-cos(b), -sin(b))))
+
+    def contains_point(self, x, y):
+        """Checks if the point x, y is inside the sector."""
+        return self.collide_segment(x, y, x, y)
+
+    def collide_segment(self, x_start, y_start, x_end, y_end):
+        """Checks if the line segment x_start, y_start to x_end, y_end collides with the sector.
+
+        Clips the segment to each wedge and checks the distance of the
+        closest point of the clipped segment to the center."""
+        px = x_start - self.x
+        py = y_start - self.y
+        x1 = x_end - x_start
+        y1 = y_end - y_start
+        squared = float(x1 ** 2 + y1 ** 2) or 1.0
+        for wedge in self.wedges:
+            low, high = 0.0, 1.0
+            for ux, uy in wedge:
+                c0 = ux * py - uy * px
+                c1 = ux * y1 - uy * x1
+                if c1 > 0:
+                    low = max(low, -c0 / c1)
+                elif c1 < 0:
+                    high = min(high, -c0 / c1)
+                elif c0 < 0:
+                    high = -1.0
+            if low > high:
+                continue
+            t = min(max(-(px * x1 + py * y1) / squared, low), high)
+            if sqrt((px + t * x1) ** 2 + (py + t * y1) ** 2) <= self.radius:
+                return True
+        return False
+
+    def collide_rectangle(self, x_min, y_min, x_max, y_max):
+        """Checks if this sector collides with the given rectangle."""
+        if x_min <= self.x <= x_max and y_min <= self.y <= y_max:
+            return True
+        return (self.collide_segment(x_min, y_min, x_max, y_min) or
+                self.collide_segment(x_max, y_min, x_max, y_max) or
+                self.collide_segment(x_max, y_max, x_min, y_max) or
+                self.collide_segment(x_min, y_max, x_min, y_min))
+
+    def __repr__(self):
+        return "<Sector (%i,%i) r=%s angle=%s direction=%s>" % (self.x, self.y, self.radius, self.angle, self.direction)
 
 
 class Point(object):
@@ -579,10 +1392,15 @@ class Point(object):
         return (x_min <= self.x <= x_max and
                 y_min <= self.y <= y_max)
 
-    def collide_polygon(corners):
+    def collide_polygon(self, corners):
         """Checks if this point collides with the given polygon.
-        @status: not implemented"""
-        raise NotImplementedError
+        @param corners: a Polygon or a list of its corners (x, y)"""
+        polygon = corners if isinstance(corners, Polygon) else Polygon(corners)
+        return polygon.contains_point(self.x, self.y)
+
+    def collide_sector(self, sector):
+        """Checks if this point collides with the given Sector."""
+        return sector.contains_point(self.x, self.y)
 
     def get_points(self):
         """Yields the coordinates (x, y) of the point."""
@@ -18,6 +18,8 @@ from SimPy.SimulationRT import hold, passivate
 from locations import PersonWakeUp
 import group
 import collide
+import light
+import rng
 import monitors
 from geo import utils
 from geo import osm
@@ -37,7 +39,7 @@ class Simulation(SimulationRT.SimulationRT):
     @author: P. Tute
     @author: B. Henne"""
     
-    def __init__(self, geo, start_timestamp=None, rel_speed=None, seed=1, allow_dup=False):
+    def __init__(self, geo, start_timestamp=None, rel_speed=None, seed=1, allow_dup=False, person_state=False, counter_random=False):
         """Initialize the MOSP Simulation.
         
         @param geo: geo model for simulation, a mosp.geo.osm.OSMModel extending the mops.collide.World
@@ -45,6 +47,8 @@ class Simulation(SimulationRT.SimulationRT):
         @param rel_speed: (SimPy) ratio simulation time over wallclock time; example: rel_speed=200 executes 200 units of simulation time in about one second
         @param seed: seed for simulation random generator
         @param allow_dup: allow duplicates? only one or multiple Simulations can be startet at once
+        @param person_state: store movement state of Persons in NumPy arrays (mosp.state.PersonStateStore) for vectorized coordinate calculation - requires NumPy
+        @param counter_random: Persons get counter-based random streams (mosp.rng.CounterRandom) keyed by seed and their id instead of a random.Random each
         """
         SimulationRT.SimulationRT.__init__(self)
         assert allow_dup or osm.GLOBAL_SIM is None
@@ -54,15 +58,67 @@ class Simulation(SimulationRT.SimulationRT):
         self.monitors = []          #: contains all Monitors of the Simulation
         self.rel_speed = rel_speed if rel_speed else 1
         self.start_timestamp = self.start_timestamp if start_timestamp else time.time()
+        self.seed = seed                        #: seed of random and the counter-based random streams
         self.random = random.Random(seed)       #: central simulation-wide random generator
+        self.counter_random = counter_random    #: Persons use mosp.rng.CounterRandom streams?
         self.next_person_id = 0                 #: the next id that will be given to a new person
-        self.persons = group.PersonGroup()      #: stores simulated Persons
+        self.persons = group.PersonRegistry()   #: stores simulated Persons
         self.removed_persons = {}               #: stores removed Persons for later use
         self.person_alarm_clock = PersonWakeUp('Omni-present person wake up alarm', self)   #: central Process for waking up Persons on pause
+        self.action_scheduler = ActionScheduler('Action scheduler', self)   #: central Process executing the actions of all Persons
         self.messages = []      #: stores scheduled Calls of PersonGroups for execution as zombie's infect()
+        self.messages_posted = 0    #: number of Messages created, see group.Message
+        self.person_messages_sent = 0       #: number of messages queued by Person.send(), also orders messages of the same arrival
+        self.person_messages_delivered = 0  #: number of messages removed from mailboxes after Person.receive()
+        self.person_messages_kept = 0       #: number of deliveries where Person.receive() kept the message for the next wakeup
+        self.person_state = None    #: optional mosp.state.PersonStateStore holding movement state of added Persons
+        self.stats = None           #: optional mosp.stats.SimulationStats, see enable_stats()
+        self.person_hash = None     #: optional mosp.spatial.PersonHash used by get_near(), see enable_person_hash()
+        self.encounters = None      #: optional mosp.encounter.EncounterEngine, see enable_encounters()
+        self.spawn_filter = None    #: optional function deciding if a created Person is added, see spawn_person() and mosp.partition
+        if person_state:
+            import state
+            self.person_state = state.PersonStateStore(self)
         group.Message.sim = self
         geo.initialize(self)        # load OSM data, load/calculate routing table and grid
 
+    def enable_stats(self, dump_interval=None, out=None):
+        """Enables phase timers and counters of run(), see mosp.stats.
+        @param dump_interval: write a report line to out every dump_interval ticks, None for no dumps
+        @param out: file for dumps, default is sys.stderr
+        @return: the mosp.stats.SimulationStats, also stored as self.stats"""
+        import stats
+        self.stats = stats.SimulationStats(dump_interval, out)
+        return self.stats
+
+    def enable_person_hash(self, cell_size=20):
+        """Enables the spatial hash of Person positions used by get_near() and get_near_all(), see mosp.spatial.
+        @param cell_size: edge length of the hash cells in meters, best about the common get_near() radius
+        @return: the mosp.spatial.PersonHash, also stored as self.person_hash"""
+        import spatial
+        self.person_hash = spatial.PersonHash(self, cell_size)
+        return self.person_hash
+
+    def enable_encounters(self, radius, engine_class=None, cell_size=50):
+        """Enables the event-driven detection of contacts of Persons, see mosp.encounter.
+        @param radius: Persons in this distance or closer are in contact
+        @param engine_class: subclass of mosp.encounter.EncounterEngine implementing contact_begin() and contact_end()
+        @param cell_size: edge length of the cells sorting the paths of Persons in meters
+        @return: the EncounterEngine, also stored as self.encounters"""
+        import encounter
+        if engine_class is None:
+            engine_class = encounter.EncounterEngine
+        self.encounters = engine_class(self, radius, cell_size)
+        return self.encounters
+
+    def enable_contact_tracker(self, radius, cell_size=50):
+        """Enables the tracking of contact durations of Persons, see mosp.encounter.ContactTracker.
+        @param radius: Persons in this distance or closer are in contact
+        @param cell_size: edge length of the cells sorting the paths of Persons in meters
+        @return: the ContactTracker, also stored as self.encounters, add subscribers by its subscribe()"""
+        import encounter
+        return self.enable_encounters(radius, encounter.ContactTracker, cell_size)
+
     def add_monitor(self, monitor_cls, tick=1, **kwargs):
         """Add a Monitor to Simulation to produce any kind of output.
         @param monitor_cls: the monitor class from mops.monitors
@@ -74,29 +130,213 @@ class Simulation(SimulationRT.SimulationRT):
         self.monitors.append(mon)
         return mon
 
-    def add_persons(self, pers_cls, n=1, monitor=None, args=None):
+    def add_persons(self, pers_cls, n=1, monitor=None, args=None, start=0, interval=0, lazy=False):
         """Add a Person to Simulation.
-        @param pers_cls: the person class (inherited from mosp.core.Person)
+
+        Persons can be activated staggered, the i-th new Person at tick
+        start + i * interval. With lazy=True, Persons are created by a
+        PersonSpawner at their activation tick instead of now. Ids and random
+        seeds are assigned now, so a lazily added Person equals the Person
+        added without lazy. Monitors writing the number of Persons in init()
+        do not know Persons that are created later.
+        @param pers_cls: the person class (inherited from mosp.core.Person or mosp.light.LightPerson)
         @param n: the number of new, added instances of pers_cls
         @param monitor: (list of) monitor(s) the person(s) shall be observed by
         @param args: dictionary of arguments for pers_cls instantiation
+        @param start: tick of activation of the first new Person
+        @param interval: ticks between activation of two new Persons
+        @param lazy: create Persons at their activation tick?
         """
         if not args:
             args = {}
+        if self.person_state is not None and not issubclass(pers_cls, light.LightPerson):
+            pers_cls = self.person_state.person_class(pers_cls)
+        if lazy:
+            spawns = []
+            for i in xrange(n):
+                seed = self.random.randrange(2**24) # must be >> number of persons!
+                spawns.append((start + i * interval, self.next_person_id, seed))
+                self.next_person_id += 1
+            spawner = PersonSpawner('spawner%s' % spawns[0][1] if spawns else 'spawner', self, pers_cls, spawns, monitor, args)
+            self.activate(spawner, spawner.go(), at=start)
+            return
         for i in xrange(n):
             seed = self.random.randrange(2**24) # must be >> number of persons!
-            pers = pers_cls(self.next_person_id, self, random.Random(seed), **args)
+            self.spawn_person(pers_cls, self.next_person_id, seed, monitor, args, start + i * interval)
             self.next_person_id += 1
-            if monitor is not None:
-                if isinstance(monitor, monitors.EmptyMonitor):
-                    # a single monitor
-                    monitor.append(pers)
-                elif hasattr(monitor,'__iter__'):
-                    # an iterable list of monitors
-                    for mon in monitor:
-                        mon.append(pers)
-            self.activate(pers, pers.go(), 0)
-            self.persons.add(pers)
+
+    def create_person(self, pers_cls, id, seed, args):
+        """Creates a Person with its random object without adding it to the Simulation, see spawn_person()."""
+        if issubclass(pers_cls, light.LightPerson):
+            # uses a counter-based random stream, seed is drawn anyway to keep the seeds of other Persons
+            return pers_cls(id, self, **args)
+        elif self.counter_random:
+            return pers_cls(id, self, rng.CounterRandom(self.seed, id), **args)
+        else:
+            return pers_cls(id, self, random.Random(seed), **args)
+
+    def spawn_person(self, pers_cls, id, seed, monitor, args, at):
+        """Creates a Person, adds it to monitors and activates it at tick at, see add_persons().
+
+        If spawn_filter is set and spawn_filter(person, pers_cls, seed, args)
+        returns False, the created Person is not added.
+        @return: the added Person or None"""
+        is_light = issubclass(pers_cls, light.LightPerson)
+        pers = self.create_person(pers_cls, id, seed, args)
+        if self.spawn_filter is not None and not self.spawn_filter(pers, pers_cls, seed, args):
+            return None
+        if monitor is not None:
+            if isinstance(monitor, monitors.EmptyMonitor):
+                # a single monitor
+                monitor.append(pers)
+            elif hasattr(monitor,'__iter__'):
+                # an iterable list of monitors
+                for mon in monitor:
+                    mon.append(pers)
+        if is_light:
+            pers.start(at)
+        else:
+            self.activate(pers, pers.go(), at)
+        self.persons.add(pers)
+        if self.person_hash is not None:
+            self.person_hash.invalidate()
+        if self.encounters is not None:
+            self.encounters.update(pers)
+        return pers
+
+    def coords_of(self, persons):
+        """Returns the current coordinates of some Persons.
+
+        Uses one vectorized calculation for all Persons held in the
+        PersonStateStore, if enabled, instead of one current_coords()
+        call per Person.
+        @param persons: a sequence of Persons
+        @return: list of coordinates (x, y) or None, in the order of persons"""
+        store = self.person_state
+        if store is None:
+            return [p.current_coords() for p in persons]
+        re = [None] * len(persons)
+        stored = []
+        slots = []
+        for i, p in enumerate(persons):
+            if getattr(p, '_state_store', None) is store:
+                stored.append(i)
+                slots.append(p._state_slot)
+            else:
+                re[i] = p.current_coords()
+        if slots:
+            for i, (x, y) in zip(stored, store.coords(slots).tolist()):
+                if x == x:  # not NaN
+                    re[i] = (x, y)
+        return re
+
+    def get_near_all(self, persons, dist, self_included=True):
+        """Returns the Persons near each of some Persons, like calling get_near() of each.
+
+        With a PersonHash (see enable_person_hash()), the coordinates of all
+        persons are calculated at once and the hash is queried directly.
+        @param persons: a sequence of Persons
+        @param dist: lookup radius
+        @param self_included: if True, each Person itself is included in its PersonGroup
+        @return: dict mapping each Person to a PersonGroup of the Persons near it"""
+        person_hash = self.person_hash
+        if person_hash is None:
+            return dict((p, p.get_near(dist, self_included)) for p in persons)
+        persons = list(persons)
+        if self.stats is not None:
+            self.stats.get_near += len(persons)
+        re = {}
+        for p, coords in zip(persons, self.coords_of(persons)):
+            if coords is None:
+                re[p] = group.PersonGroup()
+            else:
+                re[p] = person_hash.get_near(coords[0], coords[1], dist, None if self_included else p)
+        return re
+
+    def proximity_join(self, sources, targets, dist):
+        """Finds all pairs of a source and a target Person in distance dist in one call, see mosp.spatial.join().
+
+        Replaces one get_near() call per source Person, e.g. per infected
+        Person of an infection model.
+        @param sources: sequence of Persons, e.g. a PersonGroup
+        @param targets: sequence of Persons, e.g. a PersonGroup
+        @param dist: maximum distance
+        @return: list of (source, target, distance) sorted by p_id of source and target"""
+        import spatial
+        return spatial.join(self, sources, targets, dist)
+
+    def get_in_polygon(self, polygon):
+        """Returns the Persons inside a polygon, e.g. a district.
+
+        Candidates are the Persons on ways colliding the polygon, see
+        mosp.collide.World.collide_polygon(). Their coordinates are calculated
+        at once and sorted into the grid segments classified by
+        mosp.collide.World.polygon_cells(): Persons in segments inside the
+        polygon are inside, only Persons in segments cut by its boundary are
+        tested exactly. Like get_near() without PersonHash, Persons walking
+        beside a way that does not collide the polygon are not found.
+        @param polygon: a mosp.collide.Polygon, reuse it for repeated queries
+        @rtype: mosp.group.PersonGroup"""
+        geo = self.geo
+        inside, boundary = geo.polygon_cells(polygon)
+        candidates = []
+        for element in geo.collide_polygon(polygon):
+            persons = getattr(element, 'persons', None)
+            if persons is None:
+                persons = (element,)
+            candidates.extend(persons)
+        if self.stats is not None:
+            self.stats.candidates += len(candidates)
+        size = float(geo.grid_size)
+        last_col = (geo.end_x - geo.start_x) / geo.grid_size
+        last_row = (geo.end_y - geo.start_y) / geo.grid_size
+        re = group.PersonGroup()
+        for person, coords in zip(candidates, self.coords_of(candidates)):
+            if coords is None:
+                continue
+            x, y = coords
+            col = int(math.floor((x - geo.start_x) / size))
+            row = int(math.floor((y - geo.start_y) / size))
+            cell = geo.start_x + col * geo.grid_size, geo.start_y + row * geo.grid_size
+            if cell in inside:
+                re.add(person)
+            elif 0 <= col <= last_col and 0 <= row <= last_row and cell not in boundary:
+                # segment completely outside
+                continue
+            elif polygon.contains_point(x, y):
+                re.add(person)
+        return re
+
+    def get_in_sector(self, x, y, radius, angle, direction):
+        """Returns the Persons inside a sector of a circle, e.g. the field of view of a camera.
+
+        Candidates are the Persons in distance radius from the Simulation's
+        PersonHash, if enabled, else the Persons on ways colliding the
+        sector, see mosp.collide.World.collide_sector(). Their coordinates
+        are calculated at once and tested against the sector.
+        @param x: x of the center of the circle
+        @param y: y of the center of the circle
+        @param radius: radius of the circle
+        @param angle: central angle of the sector in degrees
+        @param direction: angle between the x-axis and the bisector of the sector in degrees
+        @rtype: mosp.group.PersonGroup"""
+        sector = collide.Sector(x, y, radius, angle, direction)
+        if self.person_hash is not None:
+            candidates = [person for person, d in self.person_hash.near(x, y, radius)]
+        else:
+            candidates = []
+            for element in self.geo.collide_sector(x, y, radius, angle, direction):
+                persons = getattr(element, 'persons', None)
+                if persons is None:
+                    persons = (element,)
+                candidates.extend(persons)
+            if self.stats is not None:
+                self.stats.candidates += len(candidates)
+        re = group.PersonGroup()
+        for person, coords in zip(candidates, self.coords_of(candidates)):
+            if coords is not None and sector.contains_point(*coords):
+                re.add(person)
+        return re
 
     def get_person(self, id):
         """Find a person by its ID.
@@ -105,11 +345,7 @@ class Simulation(SimulationRT.SimulationRT):
         @return: the person or None, if the ID was not found
 
         """
-        result = self.persons.filter(p_id=id)
-        if len(result) == 1:
-            return result.pop()
-        else:
-            return None
+        return self.persons.get(id)
 
     def del_person(self, person):
         """Remove a person from the simulation.
@@ -123,6 +359,12 @@ class Simulation(SimulationRT.SimulationRT):
         person.stop_actions(True)
         person.remove_from_sim = True
         self.persons.remove(person)
+        if self.person_hash is not None:
+            self.person_hash.invalidate()
+        if self.encounters is not None:
+            self.encounters.remove(person)
+        if self.person_state is not None and getattr(person, '_state_store', None) is self.person_state:
+            self.person_state.release(person)
         
     def readd_person(self, id, changes={}):
         """Add a previously removed person to the simulation again.
@@ -138,6 +380,8 @@ class Simulation(SimulationRT.SimulationRT):
             print self.removed_persons
             return
         person = self.removed_persons[id]
+        if self.person_state is not None and getattr(person, '_state_store', None) is self.person_state:
+            self.person_state.acquire(person)
         person.__dict__.update(changes)
         person.current_way.persons.append(person)
         person.current_coords = person.current_coords_impl
@@ -145,12 +389,30 @@ class Simulation(SimulationRT.SimulationRT):
             a.start()
         person._stopped_actions_for_removal = []
         self.persons.add(person)
+        if self.person_hash is not None:
+            self.person_hash.invalidate()
+        if self.encounters is not None:
+            self.encounters.update(person)
         # Bad hack: unterminate
         person._terminated = False
         person._nextTime = None
         self.activate(person, person.go())
         person.readd_actions()
 
+    def step_tick(self):
+        """Executes all events of the next tick.
+
+        Kernels like mosp.kernel.CalendarQueueKernel override this to
+        execute the events of a tick at once.
+        @return: number of executed events"""
+        tick = self.peek()
+        self.step()
+        events = 1
+        while self._timestamps and not self._stop and self.peek() == tick:
+            self.step()
+            events += 1
+        return events
+
     def run(self, until, real_time, monitor=True):
         """Runs Simulation after setup.
         
@@ -166,6 +428,14 @@ class Simulation(SimulationRT.SimulationRT):
         
         # alarm for person.pause_movement()
         self.activate(self.person_alarm_clock, self.person_alarm_clock.serve(), 0)
+
+        stats = self.stats
+        if stats is not None:
+            clock = time.time
+            if monitor:
+                for mon in self.monitors:
+                    if mon._nextpoint is not None and mon._nextpoint.gi_code is not stats.timed.func_code:
+                        mon._nextpoint = stats.timed(mon._nextpoint)
         
         # based on code from SimPy.SimulationRT.simulate
         self.rtstart = self.wallclock()
@@ -187,6 +457,8 @@ class Simulation(SimulationRT.SimulationRT):
                 #print 'delta (>0, wenn sim zu langsam)', delta
                 #print 'avg_delta', avg_delta
                 if delta < 0:
+                    if stats is not None:
+                        stats.t_sleep -= delta
                     time.sleep(-delta)
 
             if last_event_time != next_event_time:
@@ -204,14 +476,31 @@ class Simulation(SimulationRT.SimulationRT):
                             next_event_time / self.rel_speed - 
                             (self.wallclock() - self.rtstart) 
                             ) 
-                    if delay > 0: time.sleep(delay) 
-
+                    if delay > 0:
+                        if stats is not None:
+                            stats.t_sleep += delay
+                        time.sleep(delay)
+
+                if stats is not None:
+                    if stats.dump_interval and next_event_time >= stats.next_dump:
+                        stats.dump(next_event_time)
+                    t = clock()
+                    messages = len(self.messages)
                 # do communication stuff
                 while self.messages and self.messages[0].time < next_event_time:
                     # execute messages
                     heappop(self.messages)()    # execute __call__() of popped object
+                if stats is not None:
+                    stats.t_messages += clock() - t
+                    stats.messages += messages - len(self.messages)
 
-            self.step()
+            if stats is None:
+                self.step_tick()
+            else:
+                t = clock()
+                stats.events += self.step_tick()
+                stats.t_step += clock() - t
+                stats.ticks += 1
 
         # There are still events in the timestamps list and the simulation
         # has not been manually stopped. This means we have reached the stop
@@ -225,10 +514,11 @@ class Simulation(SimulationRT.SimulationRT):
             return 'SimPy: No activities scheduled'
 
     def __getstate__(self):
-        """Returns Simulation information for pickling using the pickle module."""
-        state = self.__dict__
-        #print 'get state', state
-        del state['sim']
+        """Returns Simulation information for pickling using the pickle module.
+
+        Monitors are not pickled, see mosp.checkpoint for snapshots of running Simulations."""
+        state = self.__dict__.copy()
+        state['monitors'] = []
         return state
 
 
@@ -246,20 +536,140 @@ class DateTime(datetime.datetime):
         return dt
 
 
-class PersonActionBase(SimulationRT.Process):
-    """Base class for Person actions. Every action is an own SimPy Process.
-    @author: F. Ludwig"""
+class ActionScheduler(SimulationRT.Process):
+    """Central SimPy Process executing the actions of all Persons.
+
+    Actions due at the same tick are kept in one bucket and executed in one
+    loop in order of scheduling. So the event list holds one event per tick
+    with due actions instead of one event per running action. The rounds of
+    mosp.light.LightPersons are executed like actions.
+    @author: B. Henne"""
+
+    def __init__(self, name, sim):
+        """Inits the ActionScheduler. It is activated when the first action is scheduled."""
+        SimulationRT.Process.__init__(self, name=name, sim=sim)
+        self.buckets = {}       #: maps tick to list of actions due at this tick
+        self.ticks = []         #: heap of ticks having a bucket
+        self.wakeup = None      #: tick the scheduler is activated for, None if passive
+        self.running = False    #: True while executing actions
+        self.executed = 0       #: number of executed actions
+
+    def schedule(self, action, tick):
+        """Schedules the execution of action at tick."""
+        bucket = self.buckets.get(tick)
+        if bucket is None:
+            bucket = self.buckets[tick] = []
+            heappush(self.ticks, tick)
+        bucket.append(action)
+        if not self.running and (self.wakeup is None or tick < self.wakeup):
+            self.wakeup = tick
+            if self._nextpoint is None:
+                self.sim.activate(self, self.go(), at=tick)
+            else:
+                self.sim.reactivate(self, at=tick)
+
     def go(self):
-        """Person executes action (self.func) every self.every ticks."""
+        """Executes all due actions and sleeps until the next tick having a bucket."""
         while True:
-            yield hold, self, self.every
-            answer = self.func(self.pers)
-            if answer:
-                self.every = answer
+            now = self.sim.now()
+            ticks = self.ticks
+            self.running = True
+            while ticks and ticks[0] <= now:
+                tick = heappop(ticks)
+                for a in self.buckets.pop(tick):
+                    # skip stopped actions and actions restarted for another tick
+                    if a.next_run == tick:
+                        a.execute(tick)
+                        self.executed += 1
+            self.running = False
+            if ticks:
+                self.wakeup = ticks[0]
+                yield hold, self, self.wakeup - now
+            else:
+                self.wakeup = None
+                yield passivate, self
+
+
+class PersonSpawner(SimulationRT.Process):
+    """SimPy Process creating the Persons added by Simulation.add_persons(lazy=True) at their activation tick.
+    @author: B. Henne"""
+
+    def __init__(self, name, sim, pers_cls, spawns, monitor, args):
+        """Inits the PersonSpawner.
+        @param spawns: list of (tick, id, seed) of new Persons sorted by tick"""
+        SimulationRT.Process.__init__(self, name=name, sim=sim)
+        self.pers_cls = pers_cls
+        self.spawns = spawns
+        self.monitor = monitor
+        self.args = args
+        self.next_spawn = 0     #: index of next Person to be created in spawns
+
+    def __getstate__(self):
+        """Returns PersonSpawner information for pickling without monitors, like Simulation.__getstate__."""
+        state = self.__dict__.copy()
+        state['monitor'] = None
+        return state
+
+    def go(self):
+        """Creates the Persons of the current tick and sleeps until the next activation tick."""
+        spawns = self.spawns
+        while self.next_spawn < len(spawns):
+            now = self.sim.now()
+            at, id, seed = spawns[self.next_spawn]
+            if at > now:
+                yield hold, self, at - now
+                continue
+            self.sim.spawn_person(self.pers_cls, id, seed, self.monitor, self.args, now)
+            self.next_spawn += 1
+
+
+class PersonActionBase(object):
+    """Base class for Person actions executed by the Simulation's ActionScheduler.
+    @author: F. Ludwig"""
+
+    next_run = None     #: tick of next execution, None if stopped
+
+    def start(self, at='undefined', delay='undefined'):
+        """Starts the action. Starting a running action does nothing.
+
+        The action is executed first every ticks after the start tick.
+        @param at: start tick
+        @param delay: start action with delay of ticks"""
+        if self.next_run is not None:
+            return
+        now = self.sim.now()
+        if at == 'undefined':
+            at = now
+        if delay == 'undefined':
+            start = max(now, at)
+        else:
+            start = max(now, now + delay)
+        self.next_run = start + self.every
+        self.sim.action_scheduler.schedule(self, self.next_run)
+
+    def stop(self):
+        """Stops the action."""
+        self.next_run = None
+        pass # replaces next logging statement
+        #logging.debug('t=%s action.stop: stopped action %s / %s of person %s' % (self.sim.now(), self.func, self.name, self.pers.id))
+
+    def active(self):
+        """Is the action started?"""
+        return self.next_run is not None
+
+    def execute(self, tick):
+        """Person executes action (self.func) and it is scheduled again in self.every ticks."""
+        answer = self.func(self.pers)
+        if answer:
+            self.every = answer
+        if self.next_run == tick:
+            # not stopped or restarted by func
+            self.next_run = tick + self.every
+            self.sim.action_scheduler.schedule(self, self.next_run)
 
 
 def action(every, start=True):
-    """MOSP action decorator executes an action defined by an method regularly using a PersonAction(SimPy Process).
+    """MOSP action decorator executes an action defined by an method regularly using a PersonAction.
     @param every: action is executed every every ticks
     @param start: start action immediately?
     @author: F. Ludwig"""
@@ -268,26 +678,14 @@ def action(every, start=True):
             """Encapsulates a person's action executes regularly."""
             def __init__(self, pers, sim):
                 """Inits the PersonAction. Starts it if requested."""
-                name = pers.name + '_action_' + str(id(self))
-                SimulationRT.Process.__init__(self, name=name, sim=sim)
+                self.name = pers.name + '_action_' + str(id(self))
+                self.sim = sim
                 self.every = every
                 self.func = func
                 self.pers = pers
                 if start:
                     self.start()
 
-            def start(self, at='undefined', delay='undefined'):
-                """Starts the action.
-                @param at: start tick
-                @param delay: start action with delay of ticks"""
-                self.sim.activate(self, self.go(), at=at, delay=delay)
-                
-            def stop(self):
-                """Stops an action."""
-                self.pers.cancel(self)
-                pass # replaces next logging statement
-                #logging.debug('t=%s action.stop: stopped action %s / %s of person %s' % (self.sim.now(), self.func, self.name, self.pers.id))
-
         func.action = PersonAction
         return func
     return re
@@ -317,6 +715,9 @@ def distN2N(n1, n2):
 
 class Person(SimulationRT.Process, collide.Point):
     """A basic simulated Person."""
+
+    indexed_properties = ()     #: names of attributes indexed for PersonGroup.filter(), see mosp.group.PersonRegistry
+
     def __init__(self, id, sim, random, speed=1.4, **kwargs):
         """Initializes the Person.
         @param id: unique id of a person
@@ -340,7 +741,7 @@ class Person(SimulationRT.Process, collide.Point):
         self._actions = {}              #: stores all actions of the Person
         self._stopped_actions = []      #: stores stopped actions
         self._stopped_actions_for_removal = [] #: stores actions that were stopped when removing the person from the simulation
-        self._messages = []             #: stores callback messages of the Person - calling back must still be implemented (todo)
+        self._messages = []             #: mailbox of the Person, heap of [earliest_arrival, seq, message, sender], see send()
         
         # location information
         self.last_node =  self.get_random_way_node(include_exits=False)  #: node where current walking starts
@@ -362,6 +763,7 @@ class Person(SimulationRT.Process, collide.Point):
         self.passivate_with_stop_actions = False    #: if True, the Person's actions are stopped when Person is passivated
         self.stop_all_actions = False               #: if true: all Person's actions are stopped on next round of go()
         self.remove_from_sim = False                #: if True: Person's event loop will be broken on next round of go() to remove Person from simulation
+        self._passivated = False                    #: True while go() waits at 'yield passivate', see mosp.checkpoint
         
         # properties of the person
         # we use variables with prefix p_ for properties
@@ -376,20 +778,31 @@ class Person(SimulationRT.Process, collide.Point):
                 self._actions[obj] = obj.action(self, sim)
 
     def __getstate__(self):
-        """Returns Person information for pickling using the pickle module."""
-        re = self.__dict__
-        del re['sim']
-        #del re['current_coords']
+        """Returns Person information for pickling using the pickle module.
 
+        Returns a copy of the Person's __dict__ without the Simulation."""
+        re = self.__dict__.copy()
+        del re['sim']
         return re
 
+    def __setstate__(self, state):
+        """Restores a Person pickled using __getstate__. The Person's sim must be set afterwards."""
+        self.__dict__.update(state)
+        if 'current_coords' in state and state['current_coords'] is None:
+            # stopped Person of a checkpoint written before _stopped_coords()
+            self.current_coords = self._stopped_coords
+
+    def _stopped_coords(self):
+        """current_coords of a Person stopped by removal or passivation: the coordinates it stopped at."""
+        return self.last_stop_coords
+
     def get_random_way_node(self, include_exits=True):
         """Returns a random way_node from sim.way_nodes.
         
         Formerly known as get_random_node(). Todo: push to geo model at mosp.geo!
         @param include_exits: if True, also nodes marked as border nodes are regarded"""
         if not include_exits:
-            possible_targets = [n for n in self.sim.geo.way_nodes if 'border' not in n.tags]
+            possible_targets = self.sim.geo.start_nodes
         else:
             possible_targets = self.sim.geo.way_nodes
         return self._random.choice(possible_targets)
@@ -445,6 +858,23 @@ class Person(SimulationRT.Process, collide.Point):
         return (x_min <= selfx <= x_max and
                 y_min <= selfy <= y_max)
 
+    def collide_polygon(self, corners):
+        """Checks if this person collides with the given polygon.
+        Overwrites point.collide_polygon: call current_coords only once"""
+        current_coords = self.current_coords()
+        if current_coords is None:
+            return False
+        polygon = corners if isinstance(corners, collide.Polygon) else collide.Polygon(corners)
+        return polygon.contains_point(*current_coords)
+
+    def collide_sector(self, sector):
+        """Checks if this person collides with the given mosp.collide.Sector.
+        Overwrites point.collide_sector: call current_coords only once"""
+        current_coords = self.current_coords()
+        if current_coords is None:
+            return False
+        return sector.contains_point(*current_coords)
+
     def get_speed(self):
         """property speed: movement speed of the Person."""
         return self._p_speed
@@ -481,8 +911,8 @@ class Person(SimulationRT.Process, collide.Point):
         # v2:
         for attr_name in dir(self.__class__):
             attr = getattr(self.__class__, attr_name)
-            if isinstance(attr, property) and attr_name.startswith('p_'):
-                properties[attr_name] = attr.__get__(self)
+            if isinstance(attr, (property, group.IndexedProperty)) and attr_name.startswith('p_'):
+                properties[attr_name] = attr.__get__(self, self.__class__)
         return properties
 
     def next_target(self):
@@ -526,17 +956,17 @@ class Person(SimulationRT.Process, collide.Point):
             self._duration = 0
         else:
             self._duration = self.calculate_duration()
+        if self.sim.encounters is not None:
+            self.sim.encounters.update(self)
         # the actual go-loop
         while True:
             yield hold, self, max(sleep, 1)
+            if self.sim.stats is not None:
+                self.sim.stats.wakeups += 1
             # handle interrupts, receive messages and think
-            for m in [m for m in self._messages if self.sim.now() >= m[0]]:
-                if self.receive(m[1], m[2]):
-                    self._messages.remove(m)
+            if self._messages and self._messages[0][0] <= self.sim.now():
+                self.deliver_messages()
             if self.interrupted():
-                for callb, args, kwargs in self._messages:
-                    callb(*args, **kwargs)
-                    self._messages.remove((callb, args, kwargs))
                 self.handle_interrupts()
                 self.last_coord = self.current_coords()
                 # this also handles changes in speed due to recalculating self._duration
@@ -551,8 +981,10 @@ class Person(SimulationRT.Process, collide.Point):
                 self.remove_from_sim = False
                 curr = self.current_coords()
                 self.last_stop_coords = [ curr[0] + self._location_offset[0], curr[1] + self._location_offset[1] ]
-                self.current_coords = lambda: self.last_stop_coords
+                self.current_coords = self._stopped_coords
                 self.current_way.persons.remove(self)
+                if self.sim.encounters is not None:
+                    self.sim.encounters.remove(self)
                 return
             # stop all actions if necessary
             if self.stop_all_actions:
@@ -563,34 +995,48 @@ class Person(SimulationRT.Process, collide.Point):
                 self._duration = 0
                 curr = self.current_coords()
                 self.last_stop_coords = [ curr[0] + self._location_offset[0], curr[1] + self._location_offset[1] ]
-                self.current_coords = lambda: self.last_stop_coords
+                self.current_coords = self._stopped_coords
                 if self.passivate_with_stop_actions:
                     self.stop_actions()
+                if self.sim.encounters is not None:
+                    self.sim.encounters.update(self)
+                # marks the resume point for mosp.checkpoint
+                self._passivated = True
                 yield passivate, self
-            # find new self.next_node if necessary
-            if self.need_next_target:
-                self.next_target()
-                self.need_next_target = False
-                self.last_coord = self.target_coord
+                self._passivated = False
+            sleep = self._next_sleep(sleep)
+            if self.sim.encounters is not None:
+                self.sim.encounters.update(self)
+
+    def _next_sleep(self, sleep):
+        """Finds a new next_node if necessary and returns the time until next round of go().
+
+        Last part of a round of go(), after the Person thought and was maybe passivated.
+        @param sleep: the time returned by think()"""
+        # find new self.next_node if necessary
+        if self.need_next_target:
+            self.next_target()
+            self.need_next_target = False
+            self.last_coord = self.target_coord
+            self.target_coord = self.next_target_coord()
+            if self.next_node is not self.last_node:
+                self.current_way.persons.remove(self)
+                self.current_way = self.last_node.ways[self.next_node]
+                self.current_way.persons.append(self)
+                self.road_orthogonal_offset = self.current_way.width  # set width of next road segment - TODO here...
+                # double code here? target_coord must be calculated (again) after next way of user has been set
+                # To Be Refactured
                 self.target_coord = self.next_target_coord()
-                if self.next_node is not self.last_node:
-                    self.current_way.persons.remove(self)
-                    self.current_way = self.last_node.ways[self.next_node]
-                    self.current_way.persons.append(self)
-                    self.road_orthogonal_offset = self.current_way.width  # set width of next road segment - TODO here...
-                    # double code here? target_coord must be calculated (again) after next way of user has been set
-                    # To Be Refactured
-                    self.target_coord = self.next_target_coord()
-                    self._duration = self.calculate_duration()
-                self._start_time = self.sim.now()
-            # determine length of sleep
-            self._duration = max(self.calculate_duration(),
-                                 1)
-            if sleep < 1:
-                sleep = self._duration
-            else:
-                sleep = min(sleep, self._duration)
-            #move
+                self._duration = self.calculate_duration()
+            self._start_time = self.sim.now()
+        # determine length of sleep
+        self._duration = max(self.calculate_duration(),
+                             1)
+        if sleep < 1:
+            sleep = self._duration
+        else:
+            sleep = min(sleep, self._duration)
+        return sleep
 
     def calculate_duration(self):
         """Calculate the time needed for walking to the next node."""
@@ -601,6 +1047,8 @@ class Person(SimulationRT.Process, collide.Point):
         self.passivate = False
         self._location_offset = [0, 0]
         self.current_coords = self.current_coords_impl
+        if self.sim.encounters is not None:
+            self.sim.encounters.update(self)
         self.sim.reactivate(self, at, delay, prior)
         if self.passivate_with_stop_actions:
             self.restart_actions()
@@ -645,7 +1093,7 @@ class Person(SimulationRT.Process, collide.Point):
         """Find out, what caused an interrupt and act accordingly.
 
         This method is called whenever a person is interrupted.
-        This is the place to implement own reactions to interrupts. Calling methods that were send via a send() call is done BEFORE this method is called. Handling pause, stop, removal and change of movement speed is done automatically AFTER this method is called. Removing the corresponding flag (setting it to False) in this method allows for handling these things on your own.
+        This is the place to implement own reactions to interrupts. Messages sent via send() are received BEFORE this method is called. Handling pause, stop, removal and change of movement speed is done automatically AFTER this method is called. Removing the corresponding flag (setting it to False) in this method allows for handling these things on your own.
         @note: This method does nothing per default. Implement it to react to interrupts. If you do not want or need to react to interrupts, ignore this method.
         """
         pass
@@ -665,15 +1113,43 @@ class Person(SimulationRT.Process, collide.Point):
         """  
         if earliest_arrival == None:
             earliest_arrival = self.sim.now() + 1
-        if type(receiver) == group.PersonGroup:
-            for rec in receiver:
-                rec._messages.append([earliest_arrival, message, self])
-                if interrupt:
-                    self.interrupt(rec)
+        if isinstance(receiver, group.PersonGroup):
+            receivers = receiver
         else:
-            receiver._messages.append([earliest_arrival, message, self])
+            receivers = (receiver,)
+        sim = self.sim
+        seq = sim.person_messages_sent
+        for rec in receivers:
+            heappush(rec._messages, [earliest_arrival, seq, message, self])
+            seq += 1
             if interrupt:
                 self.interrupt(rec)
+        sim.person_messages_sent = seq
+
+    def deliver_messages(self):
+        """Calls receive() for all messages of the mailbox whose earliest_arrival has been reached.
+
+        Messages are received in order of earliest_arrival, messages of the same
+        earliest_arrival in order of sending. Only due messages are taken from the
+        mailbox, messages sent while receiving are received at the next wakeup.
+        @return: number of received messages"""
+        mailbox = self._messages
+        now = self.sim.now()
+        due = []
+        while mailbox and mailbox[0][0] <= now:
+            due.append(heappop(mailbox))
+        kept = 0
+        for m in due:
+            if not self.receive(m[2], m[3]):
+                heappush(mailbox, m)
+                kept += 1
+        self.sim.person_messages_delivered += len(due) - kept
+        self.sim.person_messages_kept += kept
+        return len(due)
+
+    def pending_messages(self):
+        """Returns the number of messages in the mailbox, including not yet due ones."""
+        return len(self._messages)
 
     def receive(self, message, sender):
         """Receive a message and handle it.
@@ -722,28 +1198,71 @@ class Person(SimulationRT.Process, collide.Point):
 
     def get_near(self, dist, self_included=True):
         """Returns Persons near this Person.
+
+        Queries the Simulation's PersonHash if enabled (see
+        Simulation.enable_person_hash()), else the Persons on ways colliding the circle.
         @param dist: lookup radius
         @param self_included: if True, this Person itself is included in resulting PersonGroup
         @return: PersonGroup containing all Persons in distance
         @rtype: mosp.group.PersonGroup"""
+        stats = self.sim.stats
+        if stats is not None:
+            stats.get_near += 1
         current_coords = self.current_coords()
         re = group.PersonGroup()
         if current_coords is None:
             # Person does not have coordinates yet. This might happen with external devices as persons.
             return re
         x, y = current_coords
+        if self.sim.person_hash is not None:
+            return self.sim.person_hash.get_near(x, y, dist, None if self_included else self)
+        if self.sim.person_state is not None:
+            return self._get_near_stored(x, y, dist, self_included)
         for element in self.sim.geo.collide_circle(x, y, dist):
             if isinstance(element, Person):
+                if stats is not None:
+                    stats.candidates += 1
                 if element.collide_circle(x, y, dist):
                     if self_included or element != self:
                         re.add(element)
             else:
+                if stats is not None:
+                    stats.candidates += len(element.persons)
                 for person in element.persons:
                     if person.collide_circle(x, y, dist):
                         if self_included or person != self:
                             re.add(person)
         return re
 
+    def _get_near_stored(self, x, y, dist, self_included):
+        """get_near() implementation colliding all candidates in one vectorized call using the PersonStateStore."""
+        import numpy
+        candidates = []
+        for element in self.sim.geo.collide_circle(x, y, dist):
+            if isinstance(element, Person):
+                candidates.append(element)
+            else:
+                candidates.extend(element.persons)
+        if self.sim.stats is not None:
+            self.sim.stats.candidates += len(candidates)
+        store = self.sim.person_state
+        re = group.PersonGroup()
+        stored = []
+        for person in candidates:
+            if getattr(person, '_state_store', None) is store:
+                stored.append(person)
+            elif person.collide_circle(x, y, dist):
+                if self_included or person != self:
+                    re.add(person)
+        if stored:
+            coords = store.coords([p._state_slot for p in stored])
+            d = numpy.sqrt((coords[:, 0] - x)**2 + (coords[:, 1] - y)**2)
+            for i in numpy.flatnonzero(d <= dist):
+                person = stored[i]
+                if self_included or person != self:
+                    re.add(person)
+        return re
+
     def readd_actions(self):
         """Do things, when person is readded via Simulation.readd().
         
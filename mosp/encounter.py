@@ -0,0 +1,342 @@
+"""Event-driven encounter detection of moving Persons
+
+Between two rounds of go(), a Person walks on a straight line:
+current_coords() interpolates linearly between last_coord and target_coord
+from _start_time over _duration ticks. So the distance of two Persons is
+known for all ticks until one of them starts a new round. An
+EncounterEngine takes the movement of each Person at each round and
+calculates when two Persons come closer than radius and when they part
+again. It schedules a check of the pair at these ticks, instead of
+querying the neighborhood of Persons every tick. So it finds contacts at
+every tick, even fast passes between the rounds of an action, and does
+not cost anything for Persons walking alone.
+
+Pairs are only calculated for Persons whose paths until their next round
+may come close: the bounding box of the path of each Person, widened by
+radius / 2, is sorted into square cells of cell_size meters.
+
+Enable it by Simulation.enable_encounters(). Overwrite contact_begin() and
+contact_end() of a subclass to react to contacts:
+
+    >>> class Infection(EncounterEngine):
+    ...     def contact_begin(self, a, b, tick):
+    ...         if a.p_infected or b.p_infected:
+    ...             a.p_infected = b.p_infected = True
+    >>> s.enable_encounters(1.0, Infection)
+
+contacts holds the pairs in contact and the tick their contact began.
+A ContactTracker calls subscribers when a contact lasts threshold ticks,
+e.g. for infections after some time in range:
+
+    >>> def infect(a, b, tick):
+    ...     a.p_infected = b.p_infected = a.p_infected or b.p_infected
+    >>> s.enable_contact_tracker(15).subscribe(15, infect)
+
+The engine follows Persons moving by go() or LightPerson rounds. Persons
+changing their coordinates otherwise, e.g. external devices, are not
+supported."""
+
+from heapq import heappush, heappop
+from math import ceil, floor, sqrt
+
+__maintainer__ = "B. Henne"
+__contact__ = "henne@dcsec.uni-hannover.de"
+__copyright__ = "(c) 2012, DCSec, Leibniz Universitaet Hannover, Germany"
+__license__ = "GPLv3"
+
+TOLERANCE = 1e-6    #: pairs closer to radius than this are checked every tick, so rounding errors do not shift contacts
+
+
+class EncounterEngine(object):
+    """Detects contacts of Persons in distance radius by their paths, see module documentation.
+    @author: B. Henne"""
+
+    def __init__(self, sim, radius, cell_size=50):
+        """Inits the engine and adds all Persons of sim.
+        @param sim: the Simulation whose Persons are observed
+        @param radius: Persons in this distance or closer are in contact
+        @param cell_size: edge length of the cells sorting the paths in meters"""
+        self.sim = sim
+        self.radius = float(radius)
+        self.cell_size = float(cell_size)
+        self.cells = {}         #: maps cell (x, y) to set of Persons whose path box overlaps the cell
+        self.paths = {}         #: maps Person to (tick, x, y, vx, vy, cells, horizon, box) of its current path, see update()
+        self.versions = {}      #: maps Person to number of its path, checks scheduled for older paths are skipped
+        self.partners = {}      #: maps Person to set of Persons in contact with it
+        self.contacts = {}      #: maps pair (a, b) of Persons in contact, a.p_id < b.p_id, to tick their contact began
+        self.checks = []        #: heap of scheduled checks (tick, number, a, b, version of a, version of b)
+        self.next_run = None    #: tick the engine is scheduled for in the ActionScheduler
+        self.scheduled = 0      #: number of scheduled checks, also orders checks of the same tick
+        self.predictions = 0    #: number of calculated pairs
+        for person in sim.persons:
+            self.update(person)
+
+    def contact_begin(self, a, b, tick):
+        """Called when a and b come into contact at tick, a.p_id < b.p_id. To be overwritten with an implementation."""
+        pass
+
+    def contact_end(self, a, b, tick, begin):
+        """Called when a and b are not in contact anymore at tick, a.p_id < b.p_id. To be overwritten with an implementation.
+        @param begin: tick the contact began"""
+        pass
+
+    def update(self, person):
+        """Takes the new path of person, called at each round of the Person and when it is added.
+
+        The path starts at the current coordinates x, y at tick and goes on
+        by vx, vy per tick. The next round of the Person is at horizon at
+        the latest, None if the Person does not move. box is the bounding box
+        x_min, y_min, x_max, y_max of the path until horizon widened by
+        radius / 2. Calculates the pairs of person and all Persons whose
+        boxes overlap its box."""
+        now = self.sim.now()
+        coords = person.current_coords()
+        if coords is None:
+            # Person does not have coordinates yet, e.g. an external device
+            self.remove(person)
+            return
+        x, y = coords
+        duration = person._duration
+        if duration:
+            last = person.last_coord
+            target = person.target_coord
+            vx = (target[0] - last[0]) / float(duration)
+            vy = (target[1] - last[1]) / float(duration)
+            # the Person's next round is duration ticks away at most
+            horizon = now + max(duration, 1)
+            end_x = x + vx * (horizon - now)
+            end_y = y + vy * (horizon - now)
+        else:
+            vx = vy = 0.0
+            horizon = None
+            end_x, end_y = x, y
+        half = self.radius / 2
+        size = self.cell_size
+        box = x_min, y_min, x_max, y_max = min(x, end_x) - half, min(y, end_y) - half, max(x, end_x) + half, max(y, end_y) + half
+        cells = [(cx, cy)
+                 for cx in xrange(int(floor(x_min / size)), int(floor(x_max / size)) + 1)
+                 for cy in xrange(int(floor(y_min / size)), int(floor(y_max / size)) + 1)]
+        self._remove_path(person)
+        self.paths[person] = (now, x, y, vx, vy, cells, horizon, box)
+        self.versions[person] = self.versions.get(person, 0) + 1
+        partners = self.partners.get(person, ())
+        others = set(partners)
+        for cell in cells:
+            members = self.cells.get(cell)
+            if members is None:
+                self.cells[cell] = set([person])
+            else:
+                others.update(members)
+                members.add(person)
+        others.discard(person)
+        paths = self.paths
+        for other in others:
+            other_box = paths[other][7]
+            if (other in partners or (other_box[0] <= x_max and x_min <= other_box[2] and
+                                      other_box[1] <= y_max and y_min <= other_box[3])):
+                self.check(person, other)
+
+    def remove(self, person):
+        """Ends all contacts of person and forgets its path, called when the Person is removed."""
+        if person not in self.paths:
+            return
+        for other in list(self.partners.get(person, ())):
+            self._end(person, other)
+        self._remove_path(person)
+        del self.paths[person]
+        self.versions[person] = self.versions.get(person, 0) + 1
+
+    def _remove_path(self, person):
+        path = self.paths.get(person)
+        if path is None:
+            return
+        for cell in path[5]:
+            members = self.cells[cell]
+            members.discard(person)
+            if not members:
+                del self.cells[cell]
+
+    def check(self, a, b):
+        """Begins or ends the contact of a and b by their current coordinates and schedules the next check of the pair.
+
+        The distance d(t) of both Persons is linear in each coordinate, so
+        |d(t)| = radius is a quadratic equation. Its roots for radius
+        +/- TOLERANCE give the next tick to check. Checks after the next
+        round of a or b are not scheduled, the pair is checked at that round.
+        The current coordinates are only calculated for pairs in contact or
+        about radius close, the distance of other pairs is taken from their paths."""
+        self.predictions += 1
+        now = self.sim.now()
+        radius = self.radius
+        tick_a, ax, ay, avx, avy, cells, horizon_a, box = self.paths[a]
+        tick_b, bx, by, bvx, bvy, cells, horizon_b, box = self.paths[b]
+        dx = bx + bvx * (now - tick_b) - ax - avx * (now - tick_a)
+        dy = by + bvy * (now - tick_b) - ay - avy * (now - tick_a)
+        partners = self.partners.get(a)
+        inside = False
+        if (partners is not None and b in partners) or dx ** 2 + dy ** 2 <= (radius + TOLERANCE) ** 2:
+            # same calculation as Person.collide_circle
+            a_coords = a.current_coords()
+            b_coords = b.current_coords()
+            dx = b_coords[0] - a_coords[0]
+            dy = b_coords[1] - a_coords[1]
+            inside = sqrt(dx ** 2 + dy ** 2) <= radius
+            if inside and (partners is None or b not in partners):
+                self._begin(a, b)
+            elif not inside and partners is not None and b in partners:
+                self._end(a, b)
+
+        # d(now + s) = (dx + dvx * s, dy + dvy * s)
+        dvx = bvx - avx
+        dvy = bvy - avy
+        squared_speed = dvx ** 2 + dvy ** 2
+        if squared_speed == 0:
+            # distance does not change
+            return
+        p = (dx * dvx + dy * dvy) / squared_speed
+        if inside:
+            # first tick the pair may be farther than radius - TOLERANCE
+            q = (dx ** 2 + dy ** 2 - (radius - TOLERANCE) ** 2) / squared_speed
+            disc = p ** 2 - q
+            s = 1 if disc < 0 else max(int(floor(-p + sqrt(disc))) + 1, 1)
+        else:
+            # first tick the pair may be closer than radius + TOLERANCE
+            q = (dx ** 2 + dy ** 2 - (radius + TOLERANCE) ** 2) / squared_speed
+            disc = p ** 2 - q
+            if disc < 0:
+                return
+            root = sqrt(disc)
+            s = max(int(ceil(-p - root)), 1)
+            if s > -p + root:
+                return
+        tick = now + s
+        if (horizon_a is not None and tick > horizon_a) or (horizon_b is not None and tick > horizon_b):
+            return
+        self._schedule(tick, a, b)
+
+    def _schedule(self, tick, a, b):
+        """Schedules a check of a and b at tick, valid while both keep their current path."""
+        self.scheduled += 1
+        heappush(self.checks, (tick, self.scheduled, a, b, self.versions[a], self.versions[b]))
+        self._wake(tick)
+
+    def _wake(self, tick):
+        """Schedules the engine in the ActionScheduler at tick if it is not scheduled earlier."""
+        if self.next_run is None or tick < self.next_run:
+            self.next_run = tick
+            self.sim.action_scheduler.schedule(self, tick)
+
+    def execute(self, tick):
+        """Executes the checks due at tick, executed by the ActionScheduler."""
+        checks = self.checks
+        versions = self.versions
+        self.next_run = None
+        while checks and checks[0][0] <= tick:
+            t, number, a, b, version_a, version_b = heappop(checks)
+            if versions.get(a) == version_a and versions.get(b) == version_b:
+                self.check(a, b)
+        if checks:
+            self._wake(checks[0][0])
+
+    def _begin(self, a, b):
+        if a.p_id > b.p_id:
+            a, b = b, a
+        now = self.sim.now()
+        self.partners.setdefault(a, set()).add(b)
+        self.partners.setdefault(b, set()).add(a)
+        self.contacts[(a, b)] = now
+        self.contact_begin(a, b, now)
+
+    def _end(self, a, b):
+        if a.p_id > b.p_id:
+            a, b = b, a
+        self.partners[a].discard(b)
+        self.partners[b].discard(a)
+        begin = self.contacts.pop((a, b))
+        self.contact_end(a, b, self.sim.now(), begin)
+
+
+class ContactTracker(EncounterEngine):
+    """EncounterEngine calling subscribers when contacts last long enough, see module documentation.
+
+    The duration of a contact is the number of ticks the pair is in contact,
+    counted from the begin of the contact or from its last restart(). A
+    subscriber of threshold ticks is called once per contact at the tick the
+    duration reaches threshold. Subscribers must be picklable, e.g. module
+    level functions, if the Simulation is written to a checkpoint.
+    @author: B. Henne"""
+
+    def __init__(self, sim, radius, cell_size=50):
+        """Inits the tracker without subscribers, see EncounterEngine.__init__()."""
+        self.subscribers = []   #: list of (threshold, callback) called by callback(a, b, tick)
+        self.since = {}         #: maps pair (a, b) in contact, a.p_id < b.p_id, to tick its duration is counted from
+        self.timers = []        #: heap of (tick, number, a, b, since, callback) calls of subscribers
+        EncounterEngine.__init__(self, sim, radius, cell_size)
+
+    def subscribe(self, threshold, callback):
+        """Calls callback(a, b, tick) when a and b are threshold ticks in contact, a.p_id < b.p_id.
+
+        Contacts already lasting threshold ticks or longer are not reported."""
+        self.subscribers.append((threshold, callback))
+        now = self.sim.now()
+        for pair, since in self.since.iteritems():
+            if since + max(threshold, 1) - 1 > now:
+                self._timer(pair, since, threshold, callback)
+
+    def duration(self, a, b):
+        """Returns the number of ticks a and b are in contact until now, 0 if they are not in contact."""
+        pair = (a, b) if a.p_id < b.p_id else (b, a)
+        since = self.since.get(pair)
+        if since is None:
+            return 0
+        return self.sim.now() - since + 1
+
+    def restart(self, person):
+        """Counts the durations of all contacts of person from now on again.
+
+        E.g. called when person becomes infectious, so subscribers get the
+        contacts lasting threshold ticks from now on."""
+        now = self.sim.now()
+        for other in list(self.partners.get(person, ())):
+            pair = (person, other) if person.p_id < other.p_id else (other, person)
+            self._start(pair, now)
+
+    def _start(self, pair, since):
+        self.since[pair] = since
+        for threshold, callback in self.subscribers:
+            self._timer(pair, since, threshold, callback)
+
+    def _timer(self, pair, since, threshold, callback):
+        """Calls callback at the tick the contact pair counted from since lasts threshold ticks."""
+        tick = since + max(threshold, 1) - 1
+        if tick <= self.sim.now():
+            callback(pair[0], pair[1], self.sim.now())
+            return
+        self.scheduled += 1
+        heappush(self.timers, (tick, self.scheduled, pair[0], pair[1], since, callback))
+        self._wake(tick)
+
+    def execute(self, tick):
+        """Executes the checks and subscriber calls due at tick, executed by the ActionScheduler."""
+        EncounterEngine.execute(self, tick)
+        timers = self.timers
+        while timers and timers[0][0] <= tick:
+            t, number, a, b, since, callback = heappop(timers)
+            if self.since.get((a, b)) != since:
+                continue
+            # a check ending the contact may be due at tick, too
+            self.check(a, b)
+            if self.since.get((a, b)) == since:
+                callback(a, b, tick)
+        if timers:
+            self._wake(timers[0][0])
+
+    def _begin(self, a, b):
+        EncounterEngine._begin(self, a, b)
+        pair = (a, b) if a.p_id < b.p_id else (b, a)
+        self._start(pair, self.contacts[pair])
+
+    def _end(self, a, b):
+        EncounterEngine._end(self, a, b)
+        pair = (a, b) if a.p_id < b.p_id else (b, a)
+        self.since.pop(pair, None)
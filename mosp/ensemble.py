@@ -0,0 +1,113 @@
+"""Ensemble runs of Simulations sharing one preloaded geo model
+
+Loading a map (parsing, clipping, routing.calc, calculate_grid) often takes
+longer than simulating it. An Ensemble initializes the OSMModel once and
+forks one worker process per replication. Workers share the loaded model
+copy-on-write, run their Simulation and send back a result. Each worker
+starts from the untouched model, as Simulations modify it (e.g. persons
+on WaySegments). Requires fork(), i.e. a Unix-like OS.
+
+Example: infected persons of 100 seeds of a scenario
+
+    >>> def replicate(geo, seed):
+    ...     s = Simulation(geo=geo, seed=seed)
+    ...     s.add_persons(BTVirusWiggler, 90)
+    ...     s.run(until=3600, real_time=False, monitor=False)
+    ...     return len([p for p in s.persons if p.p_infected])
+    >>> e = Ensemble(osm.OSMModel('../data/hannover2.osm'))
+    >>> for seed, infected in e.run(replicate, xrange(100)):
+    ...     print seed, infected"""
+
+import multiprocessing
+import traceback
+import Queue
+
+from geo import osm
+
+__maintainer__ = "B. Henne"
+__contact__ = "henne@dcsec.uni-hannover.de"
+__copyright__ = "(c) 2012, DCSec, Leibniz Universitaet Hannover, Germany"
+__license__ = "GPLv3"
+
+
+class EnsembleWorkerException(Exception):
+    """Exception raised if a worker of an Ensemble failed.
+
+    value contains the parameter set of the worker and its traceback."""
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return str(self.value)
+
+
+class Ensemble(object):
+    """Runs replications of a Simulation in forked worker processes.
+
+    The geo model is initialized at construction time in the parent process."""
+
+    def __init__(self, geo, processes=None, enable_routing=True):
+        """Inits the Ensemble and loads the geo model.
+        @param geo: geo model for all Simulations, a mosp.geo.osm.OSMModel
+        @param processes: maximum number of concurrently running workers, default is number of CPUs
+        @param enable_routing: passed to geo.initialize()"""
+        self.geo = geo
+        self.processes = processes if processes else multiprocessing.cpu_count()
+        geo.initialize(None, enable_routing=enable_routing)
+
+    def run(self, func, params):
+        """Runs func(geo, param) for each param in a new worker process.
+
+        Yields (param, result) pairs in order of completion, so results can
+        be aggregated while other workers are still running. func must set
+        up and run a Simulation using geo and return a picklable result.
+        @param func: function(geo, param) returning the result of a replication
+        @param params: iterable of parameter sets, e.g. seeds
+        @raise EnsembleWorkerException: a worker raised an exception or died"""
+        for index, param, result in self._run(func, params):
+            yield param, result
+
+    def map(self, func, params):
+        """Runs func(geo, param) for each param like run() and returns the results in order of params."""
+        results = {}
+        for index, param, result in self._run(func, params):
+            results[index] = result
+        return [results[i] for i in xrange(len(results))]
+
+    def _run(self, func, params):
+        """Forks workers with at most self.processes running and yields (index, param, result)."""
+        pending = list(enumerate(params))
+        pending.reverse()
+        running = {}
+        results = multiprocessing.Queue()
+        try:
+            while pending or running:
+                while pending and len(running) < self.processes:
+                    index, param = pending.pop()
+                    worker = multiprocessing.Process(target=_work, args=(results, func, self.geo, index, param))
+                    worker.daemon = True
+                    worker.start()
+                    running[index] = (worker, param)
+                try:
+                    index, ok, result = results.get(timeout=1)
+                except Queue.Empty:
+                    for worker, param in running.itervalues():
+                        if worker.exitcode:
+                            raise EnsembleWorkerException('worker for %r died with exit code %s' % (param, worker.exitcode))
+                    continue
+                worker, param = running.pop(index)
+                worker.join()
+                if not ok:
+                    raise EnsembleWorkerException('worker for %r failed:\n%s' % (param, result))
+                yield index, param, result
+        finally:
+            for worker, param in running.itervalues():
+                worker.terminate()
+
+
+def _work(results, func, geo, index, param):
+    """Worker process: runs one replication and puts (index, ok, result) to results."""
+    osm.GLOBAL_SIM = None
+    try:
+        results.put((index, True, func(geo, param)))
+    except Exception:
+        results.put((index, False, traceback.format_exc()))
@@ -82,7 +82,7 @@ class ExternalPerson(Person):
         """Find out, what caused an interrupt and act accordingly.
 
         This method is called whenever a person is interrupted.
-        This is the place to implement own reactions to interrupts. Calling methods that were send via a send() call is done BEFORE this method is called. Handling pause, stop, removal and change of movement speed is done automatically AFTER this method is called. Removing the corresponding flag (setting it to False) in this method allows for handling these things on your own.
+        This is the place to implement own reactions to interrupts. Messages sent via send() are received BEFORE this method is called. Handling pause, stop, removal and change of movement speed is done automatically AFTER this method is called. Removing the corresponding flag (setting it to False) in this method allows for handling these things on your own.
         @note: This method does nothing per default. Implement it to react to interrupts. If you do not want or need to react to interrupts, ignore this method.
         """
         Person.handle_interrupts(self)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Nearest node and nearest way segment search
+
+A NodeIndex sorts nodes into square cells. A query searches the cells in
+rings around the cell of the query point, ring by ring, until the nearest
+nodes found are closer than the nearest unsearched cell. So a query tests
+the nodes near the query point only instead of all nodes.
+
+nearest_segment() does the same on the collision grid of a
+mosp.collide.World, which already holds the segments of each grid segment.
+
+OSMModel builds a NodeIndex of its way_nodes at initialize() and offers
+both by OSMModel.nearest_node() and OSMModel.nearest_segment():
+
+    >>> node, dist = s.geo.nearest_node(x, y)[0]
+    >>> segment, dist = s.geo.nearest_segment(x, y)
+    >>> snapped = s.geo.nearest_segments(gps_fixes)"""
+
+from __future__ import absolute_import
+
+from math import floor, sqrt
+
+from mosp import collide
+
+__maintainer__ = "B. Henne"
+__contact__ = "henne@dcsec.uni-hannover.de"
+__copyright__ = "(c) 2012, DCSec, Leibniz Universitaet Hannover, Germany"
+__license__ = "GPLv3"
+
+
+def ring_cells(col, row, ring, col_min, col_max, row_min, row_max):
+    """Yields the cells (column, row) in Chebyshev distance ring of cell col, row within the given bounds."""
+    if ring == 0:
+        if col_min <= col <= col_max and row_min <= row <= row_max:
+            yield col, row
+        return
+    first_col = max(col - ring, col_min)
+    last_col = min(col + ring, col_max)
+    for r in (row - ring, row + ring):
+        if row_min <= r <= row_max:
+            for c in xrange(first_col, last_col + 1):
+                yield c, r
+    for c in (col - ring, col + ring):
+        if col_min <= c <= col_max:
+            for r in xrange(max(row - ring + 1, row_min), min(row + ring - 1, row_max) + 1):
+                yield c, r
+
+
+def _ring_search(x, y, size, bounds, k, visit):
+    """Searches the cells of size around x, y ring by ring.
+
+    visit(col, row, found) appends (distance, key, item) of the items of a cell
+    to found. The search stops when k items are found which are not farther
+    away than the nearest unsearched cell, or when all cells within bounds
+    (col_min, col_max, row_min, row_max) are searched.
+    @return: the sorted list found"""
+    col_min, col_max, row_min, row_max = bounds
+    col = int(floor(x / size))
+    row = int(floor(y / size))
+    # rings closer than this do not contain cells within bounds
+    ring = max(col_min - col, col - col_max, row_min - row, row - row_max, 0)
+    last_ring = max(col - col_min, col_max - col, row - row_min, row_max - row)
+    found = []
+    while ring <= last_ring:
+        for c, r in ring_cells(col, row, ring, col_min, col_max, row_min, row_max):
+            visit(c, r, found)
+        if len(found) >= k:
+            # distance from x, y to the nearest cell outside of the searched rings
+            bound = min(x - (col - ring) * size, (col + ring + 1) * size - x,
+                        y - (row - ring) * size, (row + ring + 1) * size - y)
+            found.sort()
+            if found[k - 1][0] <= bound:
+                break
+        ring += 1
+    found.sort()
+    return found
+
+
+class NodeIndex(object):
+    """Uniform grid of nodes for nearest node queries, see module documentation.
+    @author: B. Henne"""
+
+    def __init__(self, nodes, cell_size=100):
+        """Sorts the nodes into the cells.
+        @param nodes: sequence of objects with coordinates x, y, e.g. OSMModel.way_nodes
+        @param cell_size: edge length of the cells in meters"""
+        self.cell_size = float(cell_size)   #: edge length of a cell
+        self.cells = {}                     #: maps cell (column, row) to list of (x, y, position in nodes, node)
+        for i, node in enumerate(nodes):
+            x, y = node.x, node.y
+            cell = int(floor(x / self.cell_size)), int(floor(y / self.cell_size))
+            self.cells.setdefault(cell, []).append((x, y, i, node))
+        cols = [c for c, r in self.cells]
+        rows = [r for c, r in self.cells]
+        self.bounds = (min(cols), max(cols), min(rows), max(rows)) if self.cells else None   #: (col_min, col_max, row_min, row_max) of all cells
+
+    def nearest(self, x, y, k=1):
+        """Finds the k nearest nodes of x, y.
+        @return: list of up to k (node, distance), sorted by distance and the order of nodes"""
+        if self.bounds is None:
+            return []
+        cells = self.cells
+
+        def visit(col, row, found):
+            for node_x, node_y, i, node in cells.get((col, row), ()):
+                found.append((sqrt((node_x - x) ** 2 + (node_y - y) ** 2), i, node))
+
+        return [(node, d) for d, i, node in _ring_search(x, y, self.cell_size, self.bounds, k, visit)[:k]]
+
+
+def nearest_segment(world, x, y, condition=None):
+    """Finds the Line or Point of world nearest to x, y using its collision grid.
+    @param world: a mosp.collide.World with calculated grid
+    @param condition: if given, only objects obj with condition(obj) are found
+    @return: (object, distance), (None, None) if there is no such object"""
+    grid = world.grid
+    grid_size = world.grid_size
+    start_x, start_y = world.start_x, world.start_y
+    bounds = (0, (world.end_x - start_x) / grid_size, 0, (world.end_y - start_y) / grid_size)
+    seen = set()
+
+    def visit(col, row, found):
+        for obj in grid[start_x + col * grid_size][start_y + row * grid_size]:
+            if obj in seen:
+                continue
+            seen.add(obj)
+            if condition is not None and not condition(obj):
+                continue
+            if isinstance(obj, collide.Line):
+                close_x, close_y = obj.closest_to_point(x, y)
+                key = (obj.x_start, obj.y_start, obj.x_end, obj.y_end)
+            elif isinstance(obj, collide.Point):
+                close_x, close_y = obj.x, obj.y
+                key = (obj.x, obj.y, obj.x, obj.y)
+            else:
+                continue
+            found.append((sqrt((close_x - x) ** 2 + (close_y - y) ** 2), key, obj))
+
+    # grid segments of world start at start_x, start_y, search relative to it
+    found = _ring_search(x - start_x, y - start_y, grid_size, bounds, 1, visit)
+    if not found:
+        return None, None
+    return found[0][2], found[0][0]
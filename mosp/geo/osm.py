@@ -15,6 +15,7 @@ import time
 import xml.sax
 import math
 
+from . import nearest
 from . import utm
 from mosp import routing
 from mosp import collide
@@ -277,6 +278,35 @@ def distance(node1, node2):
     return math.sqrt(x**2 + y**2)
 
 
+def read_poly(fname):
+    """Reads a polygon from an Osmosis polygon filter file (.poly), e.g. a district boundary.
+
+    The file holds a name line and sections of a name line, lines of
+    longitude and latitude and an END line, followed by a final END line.
+    Sections whose name starts with ! are holes. Corners are converted to
+    UTM coordinates like Nodes, so the polygon can be collided with
+    an OSMModel, see mosp.collide.World.collide_polygon().
+    @author: B. Henne
+    @return: a mosp.collide.Polygon with one ring per section"""
+    rings = []
+    with open(fname) as f:
+        lines = [line.strip() for line in f if line.strip()]
+    ring = None
+    for line in lines[1:]:
+        if ring is None:
+            if line == 'END':
+                break
+            ring = []
+        elif line == 'END':
+            rings.append(ring)
+            ring = None
+        else:
+            lon, lat = [float(v) for v in line.split()[:2]]
+            x, y = utm.latlong_to_utm(lon, lat, utm.long_to_zone(lon))
+            ring.append((round_utm_coord(x), round_utm_coord(y)))
+    return collide.Polygon(*rings)
+
+
 class OSMModel(collide.World):
     """A OSM-based geo-model. A simulation world with geo data.
     @author: F. Ludwig
@@ -291,6 +321,7 @@ class OSMModel(collide.World):
         self.path = fname
         self.nodes = {}
         self.ways = {}
+        self.initialized = False    #: initialize() was called, the model is ready to be shared by Simulations
 
     def out_of_bb(self, node):
         """Is node out of UTM bounding box?"""
@@ -305,8 +336,43 @@ class OSMModel(collide.World):
                 y < min_y or
                 y > max_y)
         
+    def nearest_node(self, x, y, k=1):
+        """Finds the k way_nodes nearest to x, y using node_index.
+        @return: list of up to k (node, distance), sorted by distance and position in way_nodes"""
+        return self.node_index.nearest(x, y, k)
+
+    def nearest_nodes(self, points, k=1):
+        """Finds the k way_nodes nearest to each of some points, see nearest_node().
+        @param points: sequence of (x, y), e.g. a NumPy array of shape (n, 2)
+        @return: list of lists of (node, distance), in the order of points"""
+        index = self.node_index
+        return [index.nearest(x, y, k) for x, y in points]
+
+    def nearest_segment(self, x, y):
+        """Finds the WaySegment nearest to x, y using the collision grid.
+
+        Use closest_to_point() of the WaySegment to snap x, y to it.
+        @return: (WaySegment, distance), (None, None) without WaySegments"""
+        return nearest.nearest_segment(self, x, y, lambda obj: isinstance(obj, WaySegment))
+
+    def nearest_segments(self, points):
+        """Finds the WaySegment nearest to each of some points, see nearest_segment().
+        @param points: sequence of (x, y), e.g. a NumPy array of shape (n, 2)
+        @return: list of (WaySegment, distance), in the order of points"""
+        is_segment = lambda obj: isinstance(obj, WaySegment)
+        return [nearest.nearest_segment(self, x, y, is_segment) for x, y in points]
+
     def initialize(self, sim, enable_routing=True):
-        """Initializes the model by parsing and manipulating OSM XML data."""
+        """Initializes the model by parsing and manipulating OSM XML data.
+
+        An already initialized model, e.g. a model preloaded by mosp.ensemble.Ensemble,
+        is not parsed again, but the Persons of the previous Simulation are
+        removed from its WaySegments."""
+        if self.initialized:
+            for obj in self.obj:
+                if isinstance(obj, WaySegment):
+                    obj.persons = []
+            return
         #parse osm file
         parser = xml.sax.make_parser()
         handler = OSMXMLFileParser(self)
@@ -484,6 +550,8 @@ class OSMModel(collide.World):
         self.way_nodes_by_id = {}
         for node in self.way_nodes:
             self.way_nodes_by_id[node.id] = node
+        self.start_nodes = [n for n in self.way_nodes if 'border' not in n.tags]   #: way_nodes without border nodes, see Person.get_random_way_node()
+        self.node_index = nearest.NodeIndex(self.way_nodes, self.grid_size)     #: index of way_nodes for nearest_node()
         
         # these maps are on and off needed
         # fixed new implementation
@@ -492,6 +560,7 @@ class OSMModel(collide.World):
         for n in self.way_nodes:
             self.map_nodeid_osmnodeid[n.id] = n.osm_id
             self.map_osmnodeid_nodeid[n.osm_id] = n.id
+        self.initialized = True
 
 
 class OSMXMLFileParser(xml.sax.ContentHandler):
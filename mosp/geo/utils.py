@@ -33,7 +33,10 @@ def inDistance(x1, y1, x2, y2, distance):
     return round(sqrt((x2-x1)**2 + (y2-y1)**2)) <= distance
 
 def pointInSector(pointX, pointY, originX, originY, radius, centralAngle, direction):
-    """Returns whether a point (x,y) is in a sector of a circle with given coordinates (x,y), radius, angle and direction"""
+    """Returns whether a point (x,y) is in a sector of a circle with given coordinates (x,y), radius, angle and direction
+
+    To find all objects or Persons in a sector, use mosp.collide.World.collide_sector() or
+    mosp.core.Simulation.get_in_sector() instead of testing point by point."""
 
     translatX = pointX - originX
     translatY = pointY - originY
@@ -29,8 +29,14 @@ class Message(object):
         self.args = args                        #: arguments for self.func
         self.kwargs = kwargs                    #: keyword arguments for self.func
         self.time = self.sim.now() + delay      #: execution time of self.func
+        self.seq = self.sim.messages_posted     #: orders Messages of the same time by creation
+        self.sim.messages_posted += 1
         heappush(self.sim.messages, self)       # schedule for execution
 
+    def __lt__(self, other):
+        """Messages are executed ordered by time, then by creation."""
+        return (self.time, self.seq) < (other.time, other.seq)
+
     def __call__(self):
         """If Message is finally called, execute self.func 
         with its arguments and keyword arguments"""
@@ -88,9 +94,31 @@ class PersonGroup(set):
     def filter(self, **kwargs):
         """Filter Persons in PersonGroup by instances' attributes
         
-        Can only filter on equality of key-value-pair."""
+        Can only filter on equality of key-value-pair. Returns the Persons
+        matching any of the pairs. Attributes indexed by the PersonRegistry
+        of the Simulation are looked up in its index instead of comparing
+        the attribute of each Person."""
         re = PersonGroup()
-        for pers in self:
+        if not self:
+            return re
+        registry = getattr(getattr(next(iter(self)), 'sim', None), 'persons', None)
+        if isinstance(registry, PersonRegistry) and registry.indexes:
+            # Persons not in the registry, e.g. removed ones, are compared one by one
+            rest = () if self is registry else set.difference(self, registry)
+            for key, value in kwargs.items():
+                index = registry.indexes.get(key)
+                try:
+                    matching = index.get(value) if index is not None else None
+                except TypeError:
+                    # unhashable value
+                    index = None
+                if index is None:
+                    rest = self
+                elif matching:
+                    re.update(matching.intersection(self))
+        else:
+            rest = self
+        for pers in rest:
             for key, value in kwargs.items():
                 if hasattr(pers, key) and getattr(pers, key) == value:
                     re.add(pers)
@@ -101,3 +129,233 @@ class PersonGroup(set):
         """Returns a CallGroup with group=self=this PersonGroup."""
         return CallGroup(self)
 
+
+
+class IndexedProperty(object):
+    """Descriptor of a Person attribute indexed by a PersonRegistry.
+
+    The value is stored in the Person's __dict__ like a usual attribute.
+    If the wrapped class attribute is a data descriptor, e.g. a __slots__
+    entry or a property like Person.p_speed, the value is got and set by
+    that descriptor instead. Setting it updates the index of the
+    PersonRegistry of the Person's Simulation.
+    @author: B. Henne"""
+
+    MISSING = object()  #: marks a missing attribute
+
+    def __init__(self, name, default):
+        """Inits the IndexedProperty.
+        @param name: the attribute name
+        @param default: the class attribute wrapped by the descriptor or IndexedProperty.MISSING"""
+        self.name = name
+        self.descriptor = None  #: wrapped data descriptor storing the value, if any
+        if hasattr(type(default), '__set__'):
+            self.descriptor = default
+            default = IndexedProperty.MISSING
+        self.default = default
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = self._get(obj)
+        if value is IndexedProperty.MISSING:
+            if self.default is IndexedProperty.MISSING:
+                raise AttributeError(self.name)
+            return self.default
+        return value
+
+    def __set__(self, obj, value):
+        self._update(obj, value)
+
+    def __delete__(self, obj):
+        if self._get(obj) is IndexedProperty.MISSING:
+            raise AttributeError(self.name)
+        self._update(obj, IndexedProperty.MISSING)
+
+    def _get(self, obj):
+        """Returns the stored value or MISSING."""
+        if self.descriptor is None:
+            return obj.__dict__.get(self.name, IndexedProperty.MISSING)
+        try:
+            return self.descriptor.__get__(obj, type(obj))
+        except AttributeError:
+            return IndexedProperty.MISSING
+
+    def _update(self, obj, value):
+        """Stores value (or deletes it, if MISSING) and updates the index."""
+        name = self.name
+        old = self._get(obj)
+        if old is IndexedProperty.MISSING:
+            old = self.default
+        if value is IndexedProperty.MISSING:
+            if self.descriptor is None:
+                del obj.__dict__[name]
+            else:
+                self.descriptor.__delete__(obj)
+            value = self.default
+        elif self.descriptor is None:
+            obj.__dict__[name] = value
+        else:
+            self.descriptor.__set__(obj, value)
+            # a property may store another value than it was given
+            value = self._get(obj)
+            if value is IndexedProperty.MISSING:
+                value = self.default
+        registry = getattr(getattr(obj, 'sim', None), 'persons', None)
+        if isinstance(registry, PersonRegistry) and obj in registry:
+            registry._unindex(obj, name, old)
+            registry._index(obj, name, value)
+
+
+def _indexed_new(cls, *args):
+    """Creates an instance of cls while unpickling, see _indexed_reduce_ex()."""
+    return cls.__new__(cls, *args)
+
+
+def _indexed_reduce_ex(self, protocol):
+    """__reduce_ex__ of classes generated by PersonRegistry.indexed_class(): pickles the original class."""
+    re = object.__reduce_ex__(self, max(protocol, 2))
+    return (_indexed_new, (type(self).__bases__[0],) + re[1][1:]) + re[2:]
+
+
+class PersonRegistry(PersonGroup):
+    """The PersonGroup of all Persons of a Simulation.
+
+    Maps p_id to Person and keeps indexes of attribute values used by
+    PersonGroup.filter(). An attribute is indexed if a Person class added
+    to the registry lists it in indexed_properties or if add_index() is
+    called. Added Persons become instances of a subclass of their class
+    generated by this registry (see indexed_class()), whose IndexedProperty
+    descriptors wrap properties and slots of the original class. The
+    original classes are not changed. Indexed values must be hashable.
+    Persons must be added and removed by add(), remove(), discard() and pop().
+    @author: B. Henne"""
+
+    def __init__(self):
+        """Inits an empty PersonRegistry."""
+        super(PersonRegistry, self).__init__()
+        self.by_id = {}         #: maps p_id to Person
+        self.indexes = {}       #: maps attribute name to dict of value to set of Persons
+        self.classes = {}       #: maps class of added Persons to its subclass generated by indexed_class()
+
+    def __reduce__(self):
+        """Pickles the registry with its Persons in its state, see __setstate__."""
+        state = self.__dict__.copy()
+        state['persons'] = list(self)
+        state['classes'] = list(self.classes)
+        return (self.__class__, (), state)
+
+    def __setstate__(self, state):
+        """Restores the registry and the generated classes of its Persons after unpickling."""
+        state = state.copy()
+        persons = state.pop('persons')
+        classes = state.pop('classes')
+        set.update(self, persons)
+        self.__dict__.update(state)
+        self.classes = {}
+        for cls in classes:
+            self.indexed_class(cls)
+        for person in persons:
+            person.__class__ = self.indexed_class(type(person))
+
+    def get(self, id):
+        """Returns the Person with p_id id or None."""
+        return self.by_id.get(id)
+
+    def add(self, person):
+        """Adds a Person."""
+        if person in self:
+            return
+        set.add(self, person)
+        self.by_id[person.p_id] = person
+        cls = type(person)
+        if getattr(cls, '_person_registry', None) is not self:
+            if cls not in self.classes:
+                for name in getattr(cls, 'indexed_properties', ()):
+                    self.add_index(name)
+            person.__class__ = self.indexed_class(cls)
+        for name in self.indexes:
+            self._index(person, name, getattr(person, name, IndexedProperty.MISSING))
+
+    def remove(self, person):
+        """Removes a Person, raises KeyError if it is not in the registry."""
+        set.remove(self, person)
+        self._forget(person)
+
+    def discard(self, person):
+        """Removes a Person if it is in the registry."""
+        if person in self:
+            self.remove(person)
+
+    def pop(self):
+        """Removes and returns an arbitrary Person."""
+        person = set.pop(self)
+        self._forget(person)
+        return person
+
+    def clear(self):
+        """Removes all Persons."""
+        set.clear(self)
+        self.by_id.clear()
+        for index in self.indexes.itervalues():
+            index.clear()
+
+    def add_index(self, name):
+        """Indexes the attribute name of all Persons for PersonGroup.filter()."""
+        if name in self.indexes:
+            return
+        self.indexes[name] = {}
+        for indexed in self.classes.itervalues():
+            self._prepare(indexed, (name,))
+        for person in self:
+            self._index(person, name, getattr(person, name, IndexedProperty.MISSING))
+
+    def indexed_class(self, cls):
+        """Returns the subclass of Person class cls whose instances are indexed by this registry.
+
+        The subclass adds no slots, so add() can change the class of a Person to it.
+        Its instances are pickled as instances of cls."""
+        indexed = self.classes.get(cls)
+        if indexed is None:
+            attrs = {
+                '__module__': cls.__module__,
+                '__doc__': cls.__doc__,
+                '__slots__': (),
+                '_person_registry': self,
+                '__reduce_ex__': _indexed_reduce_ex,
+                }
+            indexed = self.classes[cls] = type(cls.__name__, (cls,), attrs)
+            self._prepare(indexed, self.indexes)
+        return indexed
+
+    def _prepare(self, indexed, names):
+        """Adds IndexedProperty descriptors for the attributes names to the generated class indexed."""
+        for name in names:
+            if not isinstance(indexed.__dict__.get(name), IndexedProperty):
+                setattr(indexed, name, IndexedProperty(name, getattr(indexed, name, IndexedProperty.MISSING)))
+
+    def _forget(self, person):
+        """Removes person from by_id and the indexes."""
+        if self.by_id.get(person.p_id) is person:
+            del self.by_id[person.p_id]
+        for name in self.indexes:
+            self._unindex(person, name, getattr(person, name, IndexedProperty.MISSING))
+
+    def _index(self, person, name, value):
+        if value is IndexedProperty.MISSING:
+            return
+        index = self.indexes[name]
+        persons = index.get(value)
+        if persons is None:
+            persons = index[value] = set()
+        persons.add(person)
+
+    def _unindex(self, person, name, value):
+        if value is IndexedProperty.MISSING:
+            return
+        index = self.indexes[name]
+        persons = index.get(value)
+        if persons is not None:
+            persons.discard(person)
+            if not persons:
+                del index[value]
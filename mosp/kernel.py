@@ -0,0 +1,187 @@
+"""Calendar queue event kernel for MoSP Simulations
+
+SimPy keeps all event notices in one heap and executes them one at a time
+with step(). Ticks of MoSP are integers and many Persons are due at the
+same tick, so this kernel keeps one bucket (a deque) of event notices per
+tick and a heap of ticks only. step_tick() executes all events of a tick
+in one loop and handles the common 'yield hold' without SimPy's dispatch.
+
+Event order is the same as with SimPy: FIFO for normal events at a tick,
+prior events before all others and LIFO among each other. Usage:
+
+    >>> from mosp.kernel import CalendarSimulation
+    >>> s = CalendarSimulation(geo=osm.OSMModel('../data/hannover0.osm'))
+
+or mix CalendarQueueKernel into any subclass of mosp.core.Simulation."""
+
+from collections import deque
+from heapq import heappush, heappop
+
+from SimPy.Simulation import hold, infinity, FatalSimerror
+
+from core import Simulation
+
+__maintainer__ = "B. Henne"
+__contact__ = "henne@dcsec.uni-hannover.de"
+__copyright__ = "(c) 2012, DCSec, Leibniz Universitaet Hannover, Germany"
+__license__ = "GPLv3"
+
+
+class CalendarQueueKernel(object):
+    """Mixin for SimPy Simulations replacing the event heap by a calendar queue.
+
+    _timestamps is the heap of ticks with pending event notices, the
+    notices themselves ([at, sortpr, process, cancelled] like in SimPy)
+    are kept in _calendar[tick]. Must precede the Simulation class in the
+    bases of a class."""
+
+    def initialize(self):
+        """Initializes SimPy's Simulation and the calendar queue."""
+        super(CalendarQueueKernel, self).initialize()
+        self._calendar = {}     #: tick -> deque of event notices of this tick
+
+    def _post(self, what, at, prior=False):
+        """Posts an event notice for process what for time at."""
+        if at < self._t:
+            raise FatalSimerror('Attempt to schedule event in the past')
+        what._nextTime = at
+        self._sortpr -= 1
+        try:
+            bucket = self._calendar[at]
+        except KeyError:
+            bucket = self._calendar[at] = deque()
+            heappush(self._timestamps, at)
+        if prior:
+            what._rec = [at, self._sortpr, what, False]
+            bucket.appendleft(what._rec)
+        else:
+            what._rec = [at, -self._sortpr, what, False]
+            bucket.append(what._rec)
+
+    def allEventNotices(self):
+        """Returns string with eventlist like SimPy's allEventNotices() as
+                t1: processname, processname2
+                t2: processname4, processname5, . . ."""
+        lines = []
+        for tick in sorted(self._calendar):
+            names = [r[2].name for r in self._calendar[tick] if not r[3]]
+            if names:
+                lines.append('%s: %s' % (tick, ', '.join(names)))
+        return '\n'.join(lines) + '\n'
+
+    def allEventTimes(self):
+        """Returns list of all times for which events are scheduled."""
+        return sorted(t for t, bucket in self._calendar.iteritems() if any(not r[3] for r in bucket))
+
+    def peek(self):
+        """Returns the time of the next event or infinity, if no more events are scheduled."""
+        if not self._timestamps:
+            return infinity
+        return self._timestamps[0]
+
+    def _pop_tick(self, tick):
+        """Removes the empty bucket of tick."""
+        heappop(self._timestamps)
+        del self._calendar[tick]
+
+    def step(self):
+        """Executes the next uncancelled event in the event queue."""
+        while True:
+            if not self._timestamps:
+                return None
+            tick = self._timestamps[0]
+            bucket = self._calendar[tick]
+            rec = bucket.popleft()
+            if not bucket:
+                self._pop_tick(tick)
+            if not rec[3]:
+                break
+        self._t = tick
+        self._execute(rec[2])
+        return self._timestamps[0] if self._timestamps else None
+
+    def step_tick(self):
+        """Executes all events of the next tick.
+
+        Events posted for the current tick while executing it are executed, too.
+        @return: number of executed events"""
+        if not self._timestamps:
+            return 0
+        tick = self._timestamps[0]
+        bucket = self._calendar[tick]
+        popleft = bucket.popleft
+        self._t = tick
+        events = 0
+        while bucket and not self._stop:
+            at, _, proc, cancelled = popleft()
+            if cancelled:
+                continue
+            events += 1
+            proc._rec = None
+            try:
+                command = next(proc._nextpoint)
+            except StopIteration:
+                self._terminate(proc)
+                if self.condQ:
+                    self._test_conditions()
+            else:
+                if command[0] is hold and len(command) == 3 and command[2] >= 0 and not self.condQ:
+                    # inlined Process._hold() and _post() for the usual 'yield hold, self, delay'
+                    proc.interruptLeft = command[2]
+                    proc._inInterrupt = False
+                    proc.interruptCause = None
+                    at = tick + command[2]
+                    proc._nextTime = at
+                    self._sortpr -= 1
+                    proc._rec = [at, -self._sortpr, proc, False]
+                    if at == tick:
+                        bucket.append(proc._rec)
+                    else:
+                        try:
+                            self._calendar[at].append(proc._rec)
+                        except KeyError:
+                            self._calendar[at] = deque((proc._rec,))
+                            heappush(self._timestamps, at)
+                else:
+                    self._dispatch_command(command, proc)
+        if not bucket and self._calendar.get(tick) is bucket:
+            self._pop_tick(tick)
+        return events
+
+    def _execute(self, proc):
+        """Advances the process execution method of proc like SimPy's step()."""
+        proc._rec = None
+        try:
+            command = next(proc._nextpoint)
+        except StopIteration:
+            self._terminate(proc)
+            if self.condQ:
+                self._test_conditions()
+        else:
+            self._dispatch_command(command, proc)
+
+    def _dispatch_command(self, command, proc):
+        """Dispatches a command yielded by proc and tests waituntil conditions."""
+        code = command[0][0] if type(command[0]) == tuple else command[0]
+        func = self._dispatch.get(code)
+        if func is None:
+            raise FatalSimerror('Illegal command: yield %s' % code)
+        func((command, proc))
+        if self.condQ:
+            self._test_conditions()
+
+    def _test_conditions(self):
+        """Reactivates waiting processes whose waituntil condition is satisfied."""
+        i = 0
+        while i < len(self.condQ):
+            p = self.condQ[i]
+            if p.cond():
+                self.condQ.pop(i)
+                self.reactivate(p)
+            else:
+                i += 1
+
+
+class CalendarSimulation(CalendarQueueKernel, Simulation):
+    """A MOSP Simulation using the calendar queue event kernel."""
+    pass
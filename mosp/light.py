@@ -0,0 +1,236 @@
+"""Lightweight Persons for very large populations
+
+A LightPerson is no SimPy Process and has no __dict__. Its attributes are
+__slots__ and it is woken up by the Simulation's ActionScheduler like an
+action, so it needs neither a generator nor an own event notice. Its
+random generator is a counter-based mosp.rng.CounterRandom stream instead
+of a random.Random. A LightPerson needs less than a tenth of the memory
+of a Person.
+
+LightPersons implement the movement of Person.go() and its hooks think(),
+next_target(), next_target_coord() and act_at_node(). Actions, messages,
+interrupts, pause_movement() and Simulation.readd_person() are not supported.
+
+Subclasses adding attributes should define __slots__, too. Otherwise their
+instances get a __dict__ again:
+
+    >>> class LightWiggler(LightPerson):
+    ...     __slots__ = ('p_infected',)
+    ...     next_target = movement.person_next_target_random
+    >>> s.add_persons(LightWiggler, 1000000)"""
+
+import math
+
+import collide
+import group
+import rng
+
+__maintainer__ = "B. Henne"
+__contact__ = "henne@dcsec.uni-hannover.de"
+__copyright__ = "(c) 2012, DCSec, Leibniz Universitaet Hannover, Germany"
+__license__ = "GPLv3"
+
+
+class LightPerson(object):
+    """A simulated Person without SimPy Process, see module documentation.
+    @author: B. Henne"""
+
+    __slots__ = ('p_id', 'sim', 'p_speed', 'next_run',
+                 'last_node', 'next_node', 'start_node', 'dest_node', 'current_way',
+                 'last_coord', 'target_coord', '_start_time', '_duration', 'need_next_target', '_random')
+
+    indexed_properties = ()                 #: names of attributes indexed for PersonGroup.filter(), see mosp.group.PersonRegistry
+    p_color = 0                             #: property color id: marker color of Person - DEPRECATED, use color_rgba instead
+    p_color_rgba = (0.1, 0.1, 1.0, 0.9)     #: property color: marker color of Person as RGBA 4-tuple
+
+    def __init__(self, id, sim, speed=1.4, **kwargs):
+        """Initializes the LightPerson. It is started by start().
+        @param id: unique id of a person
+        @param sim: reference to superordinate mosp.core.Simulation
+        @param speed: basic walking speed of person in meter/tick
+        @param kwargs: additonal keyword arguments intended for inheriting classes"""
+        self.p_id = id                  #: property id: unique id of the Person
+        self.sim = sim
+        self.p_speed = speed            #: property speed: movement speed of the Person
+        self.next_run = None            #: tick of next round of think(), None if not started or removed
+        self._random = rng.CounterRandom(sim.seed, id)              #: random stream of the Person
+        self.last_node = self._random.choice(sim.geo.start_nodes)   #: node where current walking starts
+        self.next_node = self.last_node                             #: node where current walking stops
+        self.start_node = None                                      #: start node of current routed walk
+        self.dest_node = self.next_node                             #: final node of current routed walk
+        self.current_way = self._random.choice(self.next_node.ways.values())  #: current way the Person is assigned to, used for collision
+        self.current_way.persons.append(self)
+        self.last_coord = self.target_coord = (self.next_node.x, self.next_node.y)
+        self._start_time = sim.now()    #: the tick when this person started the current walk from last to target node
+        self._duration = 0              #: time to next round of think()
+        self.need_next_target = False   #: if True, self.next_target() will be called and this will be set to False
+
+    @property
+    def name(self):
+        """Name of the Person like the SimPy Process name of a Person."""
+        return 'p%s' % self.p_id
+
+    @property
+    def road_orthogonal_offset(self):
+        """Walking offset from midline of current_way, see Person.next_target_coord()."""
+        return self.current_way.width
+
+    @property
+    def p_agenttype(self):
+        """property agenttype: the class name."""
+        return self.__class__.__name__
+
+    def _get_removed(self):
+        return False
+
+    def _set_removed(self, removed):
+        """Removes the Person from its way and stops it at its current coordinates at once."""
+        if removed and self.next_run is not None:
+            self.last_coord = self.target_coord = tuple(self.current_coords())
+            self._duration = 0
+            self.next_run = None
+            self.current_way.persons.remove(self)
+            if self.sim.encounters is not None:
+                self.sim.encounters.remove(self)
+
+    remove_from_sim = property(_get_removed, _set_removed, doc="Setting True removes the Person, see Simulation.del_person().")
+
+    def start(self, at):
+        """Starts the movement. Like an activated Person, the LightPerson thinks first at tick at + 1."""
+        now = self.sim.now()
+        self._start_time = now
+        self.next_run = max(now, at) + 1
+        self.sim.action_scheduler.schedule(self, self.next_run)
+
+    def active(self):
+        """Is the LightPerson started and not removed?"""
+        return self.next_run is not None
+
+    def execute(self, tick):
+        """One round of Person.go(), executed by the ActionScheduler: thinks and schedules the next round."""
+        if self.sim.stats is not None:
+            self.sim.stats.wakeups += 1
+        sleep = self._next_sleep(self.think())
+        if self.next_run == tick:
+            # not removed by think()
+            self.next_run = tick + max(sleep, 1)
+            self.sim.action_scheduler.schedule(self, self.next_run)
+            if self.sim.encounters is not None:
+                self.sim.encounters.update(self)
+
+    def _next_sleep(self, sleep):
+        """Finds a new next_node if necessary and returns the time until next round, see Person._next_sleep()."""
+        if self.need_next_target:
+            self.next_target()
+            self.need_next_target = False
+            self.last_coord = self.target_coord
+            if self.next_node is not self.last_node:
+                self.current_way.persons.remove(self)
+                self.current_way = self.last_node.ways[self.next_node]
+                self.current_way.persons.append(self)
+            self.target_coord = self.next_target_coord()
+            self._start_time = self.sim.now()
+        self._duration = max(self.calculate_duration(), 1)
+        if sleep < 1:
+            return self._duration
+        return min(sleep, self._duration)
+
+    def calculate_duration(self):
+        """Calculate the time needed for walking to the next node."""
+        last = self.last_coord
+        target = self.target_coord
+        return int(math.ceil(math.sqrt((target[0] - last[0])**2 + (target[1] - last[1])**2) / self.p_speed))
+
+    def current_coords(self):
+        """Calculates the current position from remaining time using last_coord and target_coord."""
+        if self._duration == 0:
+            return self.target_coord
+        last = self.last_coord
+        target = self.target_coord
+        completed = float(self.sim.now() - self._start_time) / self._duration
+        return last[0] + (target[0] - last[0]) * completed, last[1] + (target[1] - last[1]) * completed
+
+    def collide_circle(self, x, y, radius):
+        """Checks if this person collides with the given circle."""
+        selfx, selfy = self.current_coords()
+        return math.sqrt((selfx - x)**2 + (selfy - y)**2) <= radius
+
+    def collide_rectangle(self, x_min, y_min, x_max, y_max):
+        """Checks if this person collides with the given rectangle."""
+        selfx, selfy = self.current_coords()
+        return (x_min <= selfx <= x_max and
+                y_min <= selfy <= y_max)
+
+    def collide_polygon(self, corners):
+        """Checks if this person collides with the given polygon."""
+        polygon = corners if isinstance(corners, collide.Polygon) else collide.Polygon(corners)
+        return polygon.contains_point(*self.current_coords())
+
+    def collide_sector(self, sector):
+        """Checks if this person collides with the given mosp.collide.Sector."""
+        return sector.contains_point(*self.current_coords())
+
+    def get_properties(self):
+        """Return all the person's properties (slots and properties p_*) as a dictionary."""
+        properties = {}
+        for cls in self.__class__.__mro__:
+            for name in cls.__dict__:
+                if name.startswith('p_') and name not in properties and hasattr(self, name):
+                    properties[name] = getattr(self, name)
+        return properties
+
+    def next_target(self):
+        """Finds a new target to move to. Sets next_node, maybe dest_node. Must be overwritten with an implementation."""
+        return
+
+    def next_target_coord(self):
+        """Calculates new target coordinates based on next_node coordinates
+        plus orthogonal to road offset, see Person.next_target_coord()."""
+        target = self.next_node
+        last = self.last_node
+        if target == last:
+            return (target.x, target.y)
+        r = self._random.uniform(*self.road_orthogonal_offset)
+        offset_angle = (last.ways[target].directions[target]-90)/180*math.pi
+        return (target.x-r*math.cos(offset_angle), target.y-r*math.sin(offset_angle))
+
+    def act_at_node(self, node):
+        """Actions of the person when arriving at a node. To be overwritten with an implementation.
+        @param node: is the next_node the Person arrives at"""
+        pass
+
+    def think(self):
+        """Think about what to do next, see Person.think().
+        @return: time until next round (int, ticks), returning a negative number or 0 will cause a time to be found"""
+        if self._start_time + self._duration <= self.sim.now():
+            # target node has been reached
+            self.next_node.on_visit(self)
+            self.act_at_node(self.next_node)
+            self.need_next_target = True
+        return -1
+
+    def stop_actions(self, removal=False):
+        """LightPersons have no actions, for Simulation.del_person()."""
+        pass
+
+    def get_near(self, dist, self_included=True):
+        """Returns Persons near this Person, see Person.get_near().
+        @rtype: mosp.group.PersonGroup"""
+        stats = self.sim.stats
+        if stats is not None:
+            stats.get_near += 1
+        x, y = self.current_coords()
+        if self.sim.person_hash is not None:
+            return self.sim.person_hash.get_near(x, y, dist, None if self_included else self)
+        re = group.PersonGroup()
+        for element in self.sim.geo.collide_circle(x, y, dist):
+            persons = getattr(element, 'persons', None)
+            if persons is None:
+                persons = (element,)
+            if stats is not None:
+                stats.candidates += len(persons)
+            for person in persons:
+                if person.collide_circle(x, y, dist):
+                    if self_included or person is not self:
+                        re.add(person)
+        return re
@@ -2,9 +2,11 @@
 
 to be used with RoutingNode.worldObject"""
 
-from SimPy.SimulationRT import Process, hold
+from SimPy.SimulationRT import Process, hold, passivate
 import sys
 import logging
+from collections import OrderedDict
+from heapq import heappush, heappop
 
 __author__ = "B. Henne, P. Tute"
 __contact__ = "henne@dcsec.uni-hannover.de"
@@ -27,50 +29,51 @@ class LocationClosedException(Exception):
 class Location(Process):
     """A real-world location a Person can visit/interact with.
     
+    Departures of visitors are kept in a heap ordered by leave time and
+    order of visit. serve() sleeps until the earliest departure and
+    releases all visitors due at a tick at once, in order of their visits.
     Inheritance base for complex Locations.
     @author: B. Henne"""
 
     def __init__(self, name, sim):
         """Inits the Location."""
         super(Location, self).__init__(name=name, sim=sim)
-        self.visitors = []
-        self.leavetimes = {}
-        self.nextleave = self.sleep = 1000000   #self.sim.duration would be optimal 
-        
+        self.visitors = OrderedDict()   #: maps visiting Person to its departure [leave tick, seq, person], in order of visit
+        self.departures = []            #: heap of departures, person None if cancelled by leave() or another visit()
+        self.visits = 0                 #: number of visits, orders departures of the same tick
+        self.wakeup = None              #: tick serve() is activated for, None if passive
+        self.running = False            #: True while serve() releases visitors
+
+    @property
+    def leavetimes(self):
+        """Dictionary of visiting Person to tick of leaving."""
+        return dict((person, entry[0]) for person, entry in self.visitors.iteritems())
+
     def interact(self, person, duration=600):
         """Interact method normally calls visit."""
         self.visit(person, duration)
 
     def visit(self, person, duration):
         """On visit a person becomes visitor for duration ticks. After visit person is reactivated."""
-        self.visitors.append(person)
-        # add user to cafe statistics somewhere here
-        timenow = self.sim.now()
+        leavetime = self.sim.now() + duration
         pass # replaces next logging statement
-        #logging.debug("t=%s person %s visites for %s ticks\n" % (timenow,person.p_id, duration))
-        self.leavetimes[person] = timenow + duration
-        pass # replaces next logging statement
-        #logging.debug("t=%s person will leave at %s\n" % (timenow, self.leavetimes[person]))
-        if self.nextleave < timenow:
-            self.nextleave = duration+timenow
-        else:
-            self.nextleave = min(self.nextleave, duration+timenow)
-        self.sleep = self.nextleave - timenow
-        if self.sleep == 0:
-            self.sleep = 1
-        assert self.sleep >= 0
-        self.interrupt(self)
+        #logging.debug("t=%s person %s visites for %s ticks\n" % (self.sim.now(), person.p_id, duration))
+        old = self.visitors.pop(person, None)
+        if old is not None:
+            old[2] = None
+        entry = [leavetime, self.visits, person]
+        self.visits += 1
+        self.visitors[person] = entry
+        heappush(self.departures, entry)
+        if not self.running and self._nextpoint is not None and (self.wakeup is None or leavetime < self.wakeup):
+            self.wakeup = leavetime
+            self.sim.reactivate(self, at=leavetime)
 
     def leave(self, person):
         """On leave person is removed from visitors and is reactivated."""
         pass # replaces next logging statement
         #logging.debug("t=%s person %s leaves\n" % (self.sim.now(),person.p_id))
-        del self.leavetimes[person]
-        if len(self.leavetimes) == 0:
-            self.nextleave = self.sleep = 1000000
-        else:
-            self.nextleave = min(self.leavetimes.values())
-        self.visitors.remove(person)
+        self.visitors.pop(person)[2] = None
         person.reactivate()
         # maybe modify person, e.g. set as infected, if not done in server()
         # remove user from cafe statistics
@@ -79,23 +82,28 @@ class Location(Process):
         """Manages visitors (what is done in location?) and triggers leaving."""
         pass # replaces next logging statement
         #logging.debug('Location (type %s) %s open\n' % (self.__class__.__name__, self.name))
+        departures = self.departures
         while True:
             now = self.sim.now()
-            # do something
-            pids = [p.p_id for p in self.visitors]
-            pass # replaces next logging statement
-            #logging.debug('t=%s STATS #p=%s, pid=%s\n' % (now, self.sleep, pids))
-            # do something
-            for person in self.leavetimes.keys():
-                if now >= self.leavetimes[person]:
-                    for p in self.visitors:
-                        if p.p_id == person.p_id:
-                            self.leave(p)
-            pass # replaces next logging statement
-            #logging.debug('t=%s now sleep for %s\n' % (now, self.sleep))
-            self.sleep = self.nextleave - now
-            yield hold, self, self.sleep
-            # or use events?
+            self.running = True
+            due = []
+            while departures and departures[0][0] <= now:
+                entry = heappop(departures)
+                if entry[2] is not None:
+                    due.append(entry)
+            for entry in due:
+                # a visitor released before may have changed later visits
+                if entry[2] is not None:
+                    self.leave(entry[2])
+            self.running = False
+            while departures and departures[0][2] is None:
+                heappop(departures)
+            if departures:
+                self.wakeup = departures[0][0]
+                yield hold, self, self.wakeup - now
+            else:
+                self.wakeup = None
+                yield passivate, self
 
 
 PersonWakeUp = Location
@@ -126,7 +134,7 @@ class Cafe(Location):
     def close(self):
         """Close the Cafe, kick all its visitors."""
         self.open = False
-        for p in self.visitors:
+        for p in list(self.visitors):
             self.leave(p)
 
 
@@ -116,8 +116,7 @@ class PipePlayerMonitor(EmptyMonitor):
         """Prints person ids and coordinates to stdout."""
         while 42:
             yield hold, self, self.tick
-            for pers in self:
-                pos = pers.current_coords()
+            for pers, pos in zip(self, self.sim.coords_of(self)):
                 sys.stdout.write('xxxx')
                 sys.stdout.write('\x00' +
                   struct.pack(self.FORMAT, pers.p_color, pers.p_id, pos[0], pos[1]))
@@ -215,8 +214,7 @@ class SocketPlayerMonitor(EmptyMonitor):
         """Send person coordinates and other data to draw them as points."""
         while 42:
             yield hold, self, self.tick
-            for pers in self:
-                pos = pers.current_coords()
+            for pers, pos in zip(self, self.sim.coords_of(self)):
                 if pos is None:
                     continue
                 lon, lat = utm.utm_to_latlong(pos[0], pos[1], self.sim.geo.zone)
@@ -549,8 +547,7 @@ class ChildprocessPlayerChamplainMonitor(EmptyMonitor):
         self.write('%d\n' % self.sim.geo.zone)
         self.flush()
         while 42:
-            for pers in self:
-                pos = pers.current_coords()
+            for pers, pos in zip(self, self.sim.coords_of(self)):
                 self.write('\x00' +
                   struct.pack(self.FORMAT, pers.p_color, pers.p_id, pos[0], pos[1]))
             self.write('\x01' + struct.pack('I', self.sim.now()))
@@ -602,8 +599,7 @@ class RecordFilePlayerMonitor(EmptyMonitor):
         self.write('%d\n' % self.sim.geo.zone)
         self.flush()
         while 42:
-            for pers in self:
-                pos = pers.current_coords()
+            for pers, pos in zip(self, self.sim.coords_of(self)):
                 self.write('\x00' +
                   struct.pack(self.FORMAT, pers.p_color, pers.p_id, pos[0], pos[1]))
             self.write('\x01' + struct.pack('I', self.sim.now()))
@@ -0,0 +1,467 @@
+"""Spatial partitioning of a Simulation across processes
+
+The geo model is split into vertical strips, each simulated by its own
+forked process running a normal Simulation on the shared, preloaded model.
+Every partition runs the same setup function with the same seed, but only
+keeps the Persons it owns: a Person is owned by the partition containing
+its next_node. Other Persons are dropped right after their creation, the
+partition only remembers their class, seed and arguments to create them
+when they enter it. Persons that left it are kept in removed_persons.
+
+Partitions are synchronized conservatively in windows of lookahead ticks.
+The lookahead is derived from the shortest WaySegment crossing a border
+and the highest p_speed of all Persons after setup: a Person departing
+towards another partition within a window cannot reach the border node
+before the window ends. Partitions raise a PartitionException if a
+Person gets faster later, e.g. by set_speed(). At the end of each window
+
+    - Persons heading into another partition are handed off with their
+      movement state and p_* properties (like SimulationControlled.send_person),
+      the receiving partition re-adds them with Simulation.readd_person,
+    - owned Persons within halo meters of a neighbouring partition are sent
+      there as read-only HaloPersons, so get_near() sees them,
+    - methods called on HaloPersons (e.g. by PersonGroup.call) are forwarded
+      to the owning partition and executed lookahead ticks later.
+
+Only p_* attributes, movement and random state survive a handoff. Monitors are
+not supported. Requires fork(), i.e. a Unix-like OS.
+
+Example:
+
+    >>> def setup(sim):
+    ...     sim.add_persons(ZombieWiggler, 10000)
+    >>> p = PartitionedSimulation(osm.OSMModel('../data/chicago1.osm'), partitions=4)
+    >>> print p.run(setup, until=3600)"""
+
+import bisect
+import math
+import multiprocessing
+import traceback
+
+import numpy
+
+import collide
+from core import Simulation, Person
+from ensemble import EnsembleWorkerException
+from geo import osm
+
+__maintainer__ = "B. Henne"
+__contact__ = "henne@dcsec.uni-hannover.de"
+__copyright__ = "(c) 2012, DCSec, Leibniz Universitaet Hannover, Germany"
+__license__ = "GPLv3"
+
+
+def segment_extents(geo):
+    """Returns (n, 3) array of min x, max x and length of all WaySegments of geo."""
+    return numpy.array([(min(s.x_start, s.x_end), max(s.x_start, s.x_end),
+                         math.hypot(s.x_end - s.x_start, s.y_end - s.y_start))
+                        for s in geo.obj if isinstance(s, collide.Line)])
+
+
+def crossing_length(segs, x):
+    """Returns the length of the shortest segment crossing the vertical line at x, infinity if there is none.
+    @param segs: (n, 3) array of segments' min x, max x and length"""
+    crossing = segs[(segs[:, 0] < x) & (segs[:, 1] > x), 2]
+    return crossing.min() if len(crossing) else float('inf')
+
+
+def partition_borders(geo, n, search=0.05, candidates=200):
+    """Calculates x coordinates of the borders of n vertical strips with about the same number of way nodes.
+
+    Each border is placed near its node quantile where the shortest crossing
+    WaySegment is as long as possible, to increase the lookahead.
+    @param geo: an initialized OSMModel
+    @param n: number of strips
+    @param search: fraction of way nodes left and right of the quantile searched for a border
+    @param candidates: maximum number of tested borders per quantile
+    @return: sorted list of n-1 x coordinates"""
+    xs = numpy.unique(numpy.array([node.x for node in geo.way_nodes], dtype=float))
+    segs = segment_extents(geo)
+    width = max(1, int(search * len(xs)))
+    borders = []
+    for k in xrange(1, n):
+        i = k * len(xs) / n
+        lo, hi = max(0, i - width), min(len(xs) - 1, i + width)
+        best = None
+        for j in numpy.unique(numpy.linspace(lo, hi - 1, candidates).astype(int)):
+            x = (xs[j] + xs[j + 1]) / 2.0
+            rank = (crossing_length(segs, x), -abs(j - i))
+            if best is None or rank > best[0]:
+                best = (rank, x)
+        borders.append(best[1])
+    return sorted(borders)
+
+
+def lookahead(geo, borders, max_speed):
+    """Returns the lookahead in ticks of partitions separated by borders.
+
+    A Person departing at tick t on a WaySegment crossing a border arrives
+    at the border node at t + ceil(length / speed) at the earliest.
+    @param max_speed: upper bound of the speed of all Persons in m/tick
+    @return: lookahead, None if no way crosses a border or no Person moves"""
+    segs = segment_extents(geo)
+    length = min([crossing_length(segs, x) for x in borders] or [float('inf')])
+    if length == float('inf') or max_speed <= 0:
+        return None
+    return max(1, int(math.ceil(length / max_speed)) - 1)
+
+
+class PartitionException(Exception):
+    """Exception raised if a Person is faster than the speed the lookahead of a PartitionedSimulation is derived from."""
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return str(self.value)
+
+
+class PersonRef(object):
+    """Picklable reference to a Person in messages between partitions."""
+    def __init__(self, p_id):
+        self.p_id = p_id
+
+
+class HaloPerson(collide.Point):
+    """Read-only copy of a Person owned by a neighbouring partition.
+
+    Attributes are looked up in the transferred p_* properties, then in the
+    class of the Person. Methods are forwarded to the owner."""
+
+    def __init__(self, partition, state):
+        """Inits the HaloPerson.
+        @param partition: the local Partition
+        @param state: state of the Person as returned by Partition.state()"""
+        self._partition = partition
+        self._class = partition.specs[state['p_id']][0]
+        self._properties = state['props']
+        self.p_id = state['p_id']
+        self.last_coord = state['last_coord']
+        self.target_coord = state['target_coord']
+        self._start_time = state['_start_time']
+        self._duration = state['_duration']
+        self.current_way = partition.node(state['last_node']).ways.get(partition.node(state['next_node']))
+
+    def current_coords(self):
+        """Interpolates the current coordinates like Person.current_coords_impl(), but stops at target."""
+        if self._duration == 0:
+            return self.target_coord
+        completed = min(1.0, float(self._partition.sim.now() - self._start_time) / self._duration)
+        return [self.last_coord[0] + (self.target_coord[0] - self.last_coord[0]) * completed,
+                self.last_coord[1] + (self.target_coord[1] - self.last_coord[1]) * completed]
+
+    x = property(lambda self: self.current_coords()[0])
+    y = property(lambda self: self.current_coords()[1])
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        properties = self.__dict__['_properties']
+        if name in properties:
+            return properties[name]
+        cls = self.__dict__['_class']
+        if callable(getattr(cls, name, None)):
+            partition, p_id = self.__dict__['_partition'], self.__dict__['p_id']
+            return lambda *args, **kwargs: partition.forward(p_id, name, args, kwargs)
+        return getattr(cls, name)
+
+
+class Partition(object):
+    """One partition of a PartitionedSimulation, living in a worker process."""
+
+    def __init__(self, index, borders, sim):
+        """Inits the Partition and sets itself as spawn_filter of sim, call it before adding Persons.
+        @param index: number of this partition, strips are numbered from west to east
+        @param borders: x coordinates of all borders
+        @param sim: the Simulation of this partition without Persons"""
+        self.index = index
+        self.borders = borders
+        self.sim = sim
+        self.specs = {}         #: maps p_id of all Persons, owned or not, to their (class, seed, args), see adopt()
+        self.halo = []          #: HaloPersons of the current window
+        self.calls = []         #: forwarded method calls of the current window
+        self.max_speed = None   #: speed the lookahead is derived from, see check_speed()
+        sim.spawn_filter = self.adopt
+
+    def adopt(self, person, pers_cls, seed, args):
+        """Spawn filter of the Simulation: keeps person if owned, else drops it and remembers how to create it.
+        @return: True if person is owned by this partition"""
+        self.specs[person.p_id] = (pers_cls, seed, args)
+        if self.owner(person.next_node) == self.index:
+            return True
+        person.stop_actions()
+        person.current_way.persons.remove(person)
+        store = self.sim.person_state
+        if store is not None and getattr(person, '_state_store', None) is store:
+            store.release(person)
+        return False
+
+    def create(self, p_id):
+        """Creates a Person entering this partition for the first time, detached like a handed off Person."""
+        pers_cls, seed, args = self.specs[p_id]
+        person = self.sim.create_person(pers_cls, p_id, seed, args)
+        person.stop_actions(True)
+        person.current_way.persons.remove(person)
+        self.sim.removed_persons[p_id] = person
+        return person
+
+    def person(self, p_id):
+        """Returns the owned Person, the HaloPerson or the local copy of a Person that left with p_id, or None."""
+        person = self.sim.get_person(p_id)
+        if person is None:
+            for ghost in self.halo:
+                if ghost.p_id == p_id:
+                    return ghost
+            person = self.sim.removed_persons.get(p_id)
+        return person
+
+    def speed(self):
+        """Returns the highest p_speed of all owned Persons, 0 if there is none."""
+        return max([getattr(person, 'p_speed', 0) for person in self.sim.persons] or [0])
+
+    def check_speed(self, persons=None):
+        """Raises a PartitionException if an owned Person (or one of persons) is faster than max_speed."""
+        for person in (self.sim.persons if persons is None else persons):
+            speed = getattr(person, 'p_speed', 0)
+            if speed > self.max_speed:
+                raise PartitionException('speed %s of person %s exceeds max_speed %s the lookahead is derived from'
+                                         % (speed, person.p_id, self.max_speed))
+
+    def owner(self, node):
+        """Returns the index of the partition owning node."""
+        return bisect.bisect(self.borders, node.x)
+
+    def node(self, id):
+        """Returns the way node with id or None."""
+        return self.sim.geo.way_nodes_by_id.get(id) if id is not None else None
+
+    def detach(self, person):
+        """Stops simulating person without running its go() again, see Simulation.del_person()."""
+        self.sim._unpost(person)
+        person.stop_actions(True)
+        person.current_way.persons.remove(person)
+        self.sim.persons.remove(person)
+        self.sim.removed_persons[person.p_id] = person
+
+    def state(self, person):
+        """Returns the movement state, random state and p_* properties of person as picklable dict."""
+        return {'p_id': person.p_id,
+                'props': person.get_properties(),
+                'last_node': person.last_node.id,
+                'next_node': person.next_node.id,
+                'start_node': getattr(person.start_node, 'id', None),
+                'dest_node': getattr(person.dest_node, 'id', None),
+                'last_coord': list(person.last_coord),
+                'target_coord': list(person.target_coord),
+                '_start_time': person._start_time,
+                '_duration': person._duration,
+                'road_orthogonal_offset': person.road_orthogonal_offset,
+                'random': person._random.getstate()}
+
+    def attach(self, state):
+        """Re-adds a Person handed off by another partition."""
+        person = self.sim.removed_persons.get(state['p_id'])
+        if person is None:
+            person = self.create(state['p_id'])
+        changes = {}
+        for name, value in state['props'].iteritems():
+            prop = getattr(type(person), name, None)
+            if isinstance(prop, property):
+                if prop.fset is not None:
+                    prop.fset(person, value)
+            else:
+                changes[name] = value
+        for name in ('last_node', 'next_node', 'start_node', 'dest_node'):
+            setattr(person, name, self.node(state[name]))
+        for name in ('last_coord', 'target_coord', '_start_time', '_duration', 'road_orthogonal_offset'):
+            setattr(person, name, state[name])
+        person._random.setstate(state['random'])
+        person.current_way = person.last_node.ways.get(person.next_node, person.current_way)
+        self.sim.readd_person(person.p_id, changes)
+        self.check_speed([person])
+        # first round of go() holds 1 tick, wake up when arriving at next_node as before the handoff
+        now = self.sim.now()
+        arrival = person._start_time + person._duration
+        self.sim.reactivate(person, at=max(now, arrival - 1))
+
+    def handoffs(self):
+        """Detaches all owned Persons heading into another partition and returns [(partition, state)]."""
+        re = []
+        for person in list(self.sim.persons):
+            if person.passivate or person.remove_from_sim:
+                continue
+            owner = self.owner(person.next_node)
+            if owner != self.index:
+                re.append((owner, self.state(person)))
+                self.detach(person)
+        return re
+
+    def halo_states(self, radius):
+        """Returns [(partition, state)] of owned Persons within radius of other partitions."""
+        re = []
+        bounds = [-float('inf')] + list(self.borders) + [float('inf')]
+        for person, coords in zip(self.sim.persons, self.sim.coords_of(list(self.sim.persons))):
+            if coords is None:
+                continue
+            state = None
+            for i in xrange(len(bounds) - 1):
+                if i != self.index and bounds[i] - radius <= coords[0] <= bounds[i + 1] + radius:
+                    if state is None:
+                        state = self.state(person)
+                    re.append((i, state))
+        return re
+
+    def set_halo(self, states):
+        """Replaces the HaloPersons by new ones."""
+        for ghost in self.halo:
+            if ghost.current_way is not None:
+                ghost.current_way.persons.remove(ghost)
+        self.halo = []
+        for state in states:
+            ghost = HaloPerson(self, state)
+            if ghost.current_way is not None:
+                ghost.current_way.persons.append(ghost)
+                self.halo.append(ghost)
+
+    def forward(self, p_id, name, args, kwargs):
+        """Records a method call on a HaloPerson for execution by its owner."""
+        ref = lambda a: PersonRef(a.p_id) if isinstance(a, (Person, HaloPerson)) else a
+        self.calls.append((p_id, self.sim.now(), name,
+                           tuple(ref(a) for a in args), dict((k, ref(v)) for k, v in kwargs.iteritems())))
+
+    def deliver(self, calls, delay):
+        """Schedules forwarded calls delay ticks after they were made, using group.Message."""
+        from group import Message
+        deref = lambda a: self.person(a.p_id) if isinstance(a, PersonRef) else a
+        now = self.sim.now()
+        for p_id, t, name, args, kwargs in calls:
+            person = self.sim.get_person(p_id)
+            Message(getattr(person, name), tuple(deref(a) for a in args),
+                    dict((k, deref(v)) for k, v in kwargs.iteritems()), max(0, t + delay - now))
+
+    def window(self, until, handoffs, halo, calls, lookahead, radius):
+        """Runs one synchronization window.
+        @return: (handoffs, halo, calls) to be sent to other partitions"""
+        for state in handoffs:
+            self.attach(state)
+        self.set_halo(halo)
+        self.deliver(calls, lookahead)
+        self.sim.run(until=until, real_time=False, monitor=False)
+        self.check_speed()
+        calls, self.calls = self.calls, []
+        return self.handoffs(), self.halo_states(radius), calls
+
+
+class PartitionedSimulation(object):
+    """Runs one Simulation split into spatial partitions in forked processes."""
+
+    def __init__(self, geo, partitions=None, halo=20, max_speed=None, sim_cls=Simulation, **sim_kwargs):
+        """Inits the PartitionedSimulation and loads the geo model.
+        @param geo: geo model, a mosp.geo.osm.OSMModel
+        @param partitions: number of partitions, default is number of CPUs
+        @param halo: distance in meters from a border in which Persons are mirrored to the neighbour
+        @param max_speed: upper bound of the speed of all Persons in m/tick, determines the lookahead,
+            default is the highest p_speed of all Persons after setup
+        @param sim_cls: Simulation class used by partitions
+        @param sim_kwargs: keyword arguments for sim_cls, e.g. seed"""
+        self.geo = geo
+        self.partitions = partitions if partitions else multiprocessing.cpu_count()
+        self.halo = halo
+        self.max_speed = max_speed
+        self.sim_cls = sim_cls
+        self.sim_kwargs = sim_kwargs
+        geo.initialize(None)
+        self.borders = partition_borders(geo, self.partitions)
+        self.lookahead = None   #: window length in ticks of the last run(), None if no way crosses a border
+
+    def run(self, setup, until, result=None):
+        """Runs the partitioned Simulation.
+        @param setup: function(sim) adding all Persons, called in every partition, which keeps its owned Persons only
+        @param until: simulation runs until this tick
+        @param result: function(sim) returning a picklable result of a partition, default is the number of owned Persons
+        @return: list of the results of all partitions
+        @raise EnsembleWorkerException: a partition raised an exception, e.g. a PartitionException
+        @raise PartitionException: a Person is faster than max_speed after setup"""
+        pipes = []
+        workers = []
+        for i in xrange(self.partitions):
+            parent, child = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=_partition_worker, args=(child, self, i, setup, result))
+            worker.daemon = True
+            worker.start()
+            pipes.append(parent)
+            workers.append(worker)
+        try:
+            speed = max(_receive(pipe) for pipe in pipes)
+            if self.max_speed is not None:
+                if speed > self.max_speed:
+                    raise PartitionException('speed %s of a person exceeds max_speed %s' % (speed, self.max_speed))
+                speed = self.max_speed
+            self.lookahead = lookahead(self.geo, self.borders, speed)
+            for pipe in pipes:
+                pipe.send(('start', self.lookahead, speed))
+            step = self.lookahead or until + 1
+            inbox = [([], [], []) for i in xrange(self.partitions)]
+            halo_owners = {}
+            start = 0
+            while start <= until:
+                end = min(start + step, until + 1)
+                for i, pipe in enumerate(pipes):
+                    pipe.send(('window', end - 1) + inbox[i])
+                inbox = [([], [], []) for i in xrange(self.partitions)]
+                replies = [_receive(pipe) for pipe in pipes]
+                owners = {}
+                for i, (handoffs, halo, calls) in enumerate(replies):
+                    for j, state in handoffs:
+                        inbox[j][0].append(state)
+                        owners[state['p_id']] = j
+                for i, (handoffs, halo, calls) in enumerate(replies):
+                    for call in calls:
+                        # HaloPersons of the last window were owned by the sender of their halo state
+                        j = owners.get(call[0], halo_owners.get((i, call[0])))
+                        if j is not None:
+                            inbox[j][2].append(call)
+                halo_owners = {}
+                for i, (handoffs, halo, calls) in enumerate(replies):
+                    for j, state in halo:
+                        inbox[j][1].append(state)
+                        halo_owners[(j, state['p_id'])] = i
+                start = end
+            for i, pipe in enumerate(pipes):
+                pipe.send(('end', inbox[i][0]))
+            return [_receive(pipe) for pipe in pipes]
+        finally:
+            for worker in workers:
+                worker.join(1)
+                if worker.is_alive():
+                    worker.terminate()
+
+
+def _receive(pipe):
+    """Receives a reply of a partition worker, raises its exception."""
+    ok, value = pipe.recv()
+    if not ok:
+        raise EnsembleWorkerException('partition failed:\n%s' % value)
+    return value
+
+
+def _partition_worker(pipe, partitioned, index, setup, result):
+    """Worker process simulating one partition."""
+    try:
+        osm.GLOBAL_SIM = None
+        sim = partitioned.sim_cls(geo=partitioned.geo, **partitioned.sim_kwargs)
+        partition = Partition(index, partitioned.borders, sim)
+        setup(sim)
+        pipe.send((True, partition.speed()))
+        message = pipe.recv()
+        lookahead, partition.max_speed = message[1:]
+        while True:
+            message = pipe.recv()
+            if message[0] == 'end':
+                for state in message[1]:
+                    partition.attach(state)
+                pipe.send((True, result(sim) if result else len(sim.persons)))
+                return
+            until, handoffs, halo, calls = message[1:]
+            pipe.send((True, partition.window(until, handoffs, halo, calls,
+                                               lookahead or 0, partitioned.halo)))
+    except Exception:
+        pipe.send((False, traceback.format_exc()))
@@ -0,0 +1,148 @@
+"""Counter-based random streams
+
+A CounterRandom derives the n-th random number of a stream from a stream
+key and n only, by hashing key + n with the SplitMix64 output function.
+The key is derived from the Simulation's seed and the Person's id. So each
+Person gets an independent, reproducible stream that does not depend on
+how many other Persons were added before, and the stream needs only the key
+and the draw counter as state instead of the 2.5 KB Mersenne Twister state
+of a random.Random.
+
+CounterRandom offers the methods of random.Random (choice, uniform,
+randint, shuffle, sample, ...) except gauss(). random_array() and
+random_batch() draw the next numbers of many streams in one vectorized
+NumPy call, e.g. for batch movement decisions. They return the same
+numbers as drawing from each stream one by one:
+
+    >>> streams = [CounterRandom(seed, id) for id in xrange(1000)]
+    >>> r = random_batch(streams)           # r[i] == next streams[i].random()
+    >>> i = choice_indexes(streams, lengths)   # like streams[i].choice(seq) with len(seq) == lengths[i]
+
+Vectorized draws require NumPy."""
+
+import random as _random
+
+__maintainer__ = "B. Henne"
+__contact__ = "henne@dcsec.uni-hannover.de"
+__copyright__ = "(c) 2012, DCSec, Leibniz Universitaet Hannover, Germany"
+__license__ = "GPLv3"
+
+MASK64 = 0xFFFFFFFFFFFFFFFF     #: 64 bit mask
+GAMMA = 0x9E3779B97F4A7C15      #: SplitMix64 counter increment
+_M1 = 0xBF58476D1CE4E5B9
+_M2 = 0x94D049BB133111EB
+_RECIP53 = 2.0 ** -53
+
+
+def mix64(z):
+    """SplitMix64 output function: returns a well mixed 64 bit hash of 64 bit int z."""
+    z = ((z ^ (z >> 30)) * _M1) & MASK64
+    z = ((z ^ (z >> 27)) * _M2) & MASK64
+    return z ^ (z >> 31)
+
+
+def stream_key(seed, stream):
+    """Returns the key of stream (e.g. a Person id) of a Simulation seeded with seed."""
+    if not isinstance(seed, (int, long)):
+        seed = hash(seed)
+    return mix64((mix64(seed & MASK64) + (stream + 1) * GAMMA) & MASK64)
+
+
+def bits64(key, counter):
+    """Returns the 64 random bits number counter of the stream with key."""
+    return mix64((key + (counter + 1) * GAMMA) & MASK64)
+
+
+class CounterRandom(object):
+    """Random stream number stream of a Simulation seeded with seed, a drop-in replacement for random.Random.
+    @author: B. Henne"""
+
+    __slots__ = ('key', 'counter')
+
+    def __init__(self, seed, stream):
+        """Inits the stream.
+        @param seed: seed of the Simulation
+        @param stream: int identifying the stream, e.g. the Person id"""
+        self.key = stream_key(seed, stream)     #: stream key
+        self.counter = 0                        #: number of drawn 64 bit numbers
+
+    def random(self):
+        """Returns the next random float in [0.0, 1.0)."""
+        counter = self.counter
+        self.counter = counter + 1
+        # bits64() inlined
+        z = (self.key + (counter + 1) * GAMMA) & MASK64
+        z = ((z ^ (z >> 30)) * _M1) & MASK64
+        z = ((z ^ (z >> 27)) * _M2) & MASK64
+        return ((z ^ (z >> 31)) >> 11) * _RECIP53
+
+    def getrandbits(self, k):
+        """Returns an int with k random bits."""
+        re = 0
+        for i in xrange(0, k, 64):
+            counter = self.counter
+            self.counter = counter + 1
+            re = (re << 64) | bits64(self.key, counter)
+        return re >> (-k % 64)
+
+    def getstate(self):
+        """Returns the state (key, counter) of the stream."""
+        return self.key, self.counter
+
+    def setstate(self, state):
+        """Restores a state returned by getstate()."""
+        self.key, self.counter = state
+
+    def __repr__(self):
+        return '<CounterRandom key=%x counter=%s>' % (self.key, self.counter)
+
+    # algorithms of random.Random using random(), getrandbits() and _randbelow() only
+    _randbelow = _random.Random.__dict__['_randbelow']
+    randrange = _random.Random.__dict__['randrange']
+    randint = _random.Random.__dict__['randint']
+    choice = _random.Random.__dict__['choice']
+    shuffle = _random.Random.__dict__['shuffle']
+    sample = _random.Random.__dict__['sample']
+    uniform = _random.Random.__dict__['uniform']
+    triangular = _random.Random.__dict__['triangular']
+    normalvariate = _random.Random.__dict__['normalvariate']
+    lognormvariate = _random.Random.__dict__['lognormvariate']
+    expovariate = _random.Random.__dict__['expovariate']
+    vonmisesvariate = _random.Random.__dict__['vonmisesvariate']
+    gammavariate = _random.Random.__dict__['gammavariate']
+    betavariate = _random.Random.__dict__['betavariate']
+    paretovariate = _random.Random.__dict__['paretovariate']
+    weibullvariate = _random.Random.__dict__['weibullvariate']
+
+
+def random_array(keys, counters):
+    """Returns random floats in [0.0, 1.0), number counters[i] of the stream with keys[i].
+    @param keys: sequence or uint64 array of stream keys
+    @param counters: sequence or array of draw counters
+    @return: float64 NumPy array"""
+    import numpy
+    keys = numpy.asarray(keys, dtype=numpy.uint64)
+    counters = numpy.asarray(counters, dtype=numpy.uint64)
+    # uint64 arithmetic wraps modulo 2**64 like the masks of the scalar functions
+    z = keys + (counters + numpy.uint64(1)) * numpy.uint64(GAMMA)
+    z = (z ^ (z >> numpy.uint64(30))) * numpy.uint64(_M1)
+    z = (z ^ (z >> numpy.uint64(27))) * numpy.uint64(_M2)
+    z ^= z >> numpy.uint64(31)
+    return (z >> numpy.uint64(11)).astype(numpy.float64) * _RECIP53
+
+
+def random_batch(streams):
+    """Draws the next random() of each CounterRandom of streams at once.
+    @return: float64 NumPy array, element i equals streams[i].random()"""
+    re = random_array([s.key for s in streams], [s.counter for s in streams])
+    for s in streams:
+        s.counter += 1
+    return re
+
+
+def choice_indexes(streams, lengths):
+    """Draws the index of a choice() of each CounterRandom of streams at once.
+    @param lengths: lengths of the sequences to choose from
+    @return: int NumPy array, element i equals the index of streams[i].choice(seq) with len(seq) == lengths[i]"""
+    import numpy
+    return (random_batch(streams) * numpy.asarray(lengths)).astype(int)
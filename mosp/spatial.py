@@ -0,0 +1,170 @@
+"""Spatial hash of Person positions
+
+A PersonHash sorts the current coordinates of all Persons of a Simulation
+into square cells of cell_size meters. It is built at the first query of
+a tick and again after Persons were added or removed, so it is built at
+most once per tick for an unchanged population. A radius query tests only
+the Persons in the cells overlapping the circle. It costs about the number
+of nearby Persons, while a query via the collision grid tests all Persons
+on all ways near the circle and calculates their coordinates every time.
+
+Enable it by Simulation.enable_person_hash(). Person.get_near() and
+Simulation.get_near_all() use it then:
+
+    >>> s.enable_person_hash(cell_size=20)
+    >>> near = s.get_near_all(s.persons.filter(p_infected=True), 10)
+
+With a PersonHash, get_near() finds all Persons in euclidean distance.
+Without, it finds the Persons in distance that walk on ways colliding the
+circle, which misses Persons walking beside a way that is farther away
+than dist. Enabling the hash can therefore change simulation results.
+Persons are found at their position at the build of the hash, so Persons
+jumping within a tick (e.g. external devices) are found at their old
+position until the next tick.
+
+The build costs one coordinate calculation per Person (one vectorized call
+with a PersonStateStore), so the hash pays off if there are many queries
+per tick.
+
+join() (Simulation.proximity_join()) finds all pairs of a source and a
+target group in distance at once, e.g. for infection and contact models
+that would query get_near() of every infected Person each tick:
+
+    >>> for zombie, victim, d in s.proximity_join(zombies, s.persons, 1):
+    ...     victim.infect()"""
+
+from math import floor, sqrt
+
+import group
+
+__maintainer__ = "B. Henne"
+__contact__ = "henne@dcsec.uni-hannover.de"
+__copyright__ = "(c) 2012, DCSec, Leibniz Universitaet Hannover, Germany"
+__license__ = "GPLv3"
+
+
+class PersonHash(object):
+    """Uniform grid of the current positions of all Persons of a Simulation, see module documentation.
+    @author: B. Henne"""
+
+    def __init__(self, sim, cell_size=20):
+        """Inits an empty hash, it is built at the first query.
+        @param sim: the Simulation whose Persons are hashed
+        @param cell_size: edge length of the cells in meters, best about the common query radius"""
+        self.sim = sim
+        self.cell_size = float(cell_size)   #: edge length of a cell
+        self.cells = {}         #: maps cell (x, y) to list of (x, y, Person) of Persons in cell
+        self.built = None       #: tick of the last build, None if outdated
+        self.builds = 0         #: number of builds
+
+    def __getstate__(self):
+        """Pickles the hash without its cells, it is rebuilt at the next query."""
+        state = self.__dict__.copy()
+        state['cells'] = {}
+        state['built'] = None
+        return state
+
+    def invalidate(self):
+        """Marks the hash outdated, e.g. after Persons were added or removed."""
+        self.built = None
+
+    def build(self):
+        """Sorts the current coordinates of all Persons into the cells."""
+        sim = self.sim
+        self.cells = cell_list(sim, list(sim.persons), self.cell_size)
+        self.built = sim.now()
+        self.builds += 1
+
+    def near(self, x, y, dist):
+        """Finds the Persons in distance dist of x, y.
+        @return: list of (Person, distance)"""
+        if self.built != self.sim.now():
+            self.build()
+        size = self.cell_size
+        cells = self.cells
+        re = []
+        tested = 0
+        for cell_x in xrange(int(floor((x - dist) / size)), int(floor((x + dist) / size)) + 1):
+            for cell_y in xrange(int(floor((y - dist) / size)), int(floor((y + dist) / size)) + 1):
+                entries = cells.get((cell_x, cell_y))
+                if entries is None:
+                    continue
+                tested += len(entries)
+                for person_x, person_y, person in entries:
+                    # same calculation as Person.collide_circle
+                    d = sqrt((person_x - x)**2 + (person_y - y)**2)
+                    if d <= dist:
+                        re.append((person, d))
+        stats = self.sim.stats
+        if stats is not None:
+            stats.candidates += tested
+        return re
+
+    def get_near(self, x, y, dist, exclude=None):
+        """Returns the Persons in distance dist of x, y except exclude.
+        @rtype: mosp.group.PersonGroup"""
+        re = group.PersonGroup()
+        for person, d in self.near(x, y, dist):
+            if person is not exclude:
+                re.add(person)
+        return re
+
+
+def cell_list(sim, persons, size):
+    """Sorts the current coordinates of persons into square cells of edge length size.
+    @return: dict mapping cell (x, y) to list of (x, y, Person), Persons without coordinates are left out"""
+    cells = {}
+    for person, coords in zip(persons, sim.coords_of(persons)):
+        if coords is None:
+            # Person does not have coordinates yet, e.g. an external device
+            continue
+        x, y = coords
+        cell = int(floor(x / size)), int(floor(y / size))
+        entries = cells.get(cell)
+        if entries is None:
+            cells[cell] = [(x, y, person)]
+        else:
+            entries.append((x, y, person))
+    return cells
+
+
+def join(sim, sources, targets, dist):
+    """Finds all pairs of a source and a target Person in distance dist.
+
+    Calculates the coordinates of all sources and targets at once and sorts
+    the targets into a cell list with cells of edge length dist, so each
+    source tests the targets in its and the 8 neighbouring cells only.
+    Persons without coordinates are ignored.
+    @param sim: the Simulation of the Persons
+    @param sources: sequence of Persons
+    @param targets: sequence of Persons
+    @param dist: maximum distance
+    @return: list of (source, target, distance) sorted by the p_ids of source and target,
+    a Person in both groups is not paired with itself"""
+    sources = list(sources)
+    targets = list(targets)
+    size = float(dist) if dist > 0 else 1.0
+    cells = cell_list(sim, targets, size)
+    re = []
+    tested = 0
+    for source, coords in zip(sources, sim.coords_of(sources)):
+        if coords is None:
+            continue
+        x, y = coords
+        cell_x, cell_y = int(floor(x / size)), int(floor(y / size))
+        for cell in ((cell_x - 1, cell_y - 1), (cell_x - 1, cell_y), (cell_x - 1, cell_y + 1),
+                     (cell_x, cell_y - 1), (cell_x, cell_y), (cell_x, cell_y + 1),
+                     (cell_x + 1, cell_y - 1), (cell_x + 1, cell_y), (cell_x + 1, cell_y + 1)):
+            entries = cells.get(cell)
+            if entries is None:
+                continue
+            tested += len(entries)
+            for target_x, target_y, target in entries:
+                d = sqrt((target_x - x)**2 + (target_y - y)**2)
+                if d <= dist and target is not source:
+                    re.append((source, target, d))
+    stats = sim.stats
+    if stats is not None:
+        stats.candidates += tested
+    re.sort(key=lambda pair: (pair[0].p_id, pair[1].p_id))
+    return re
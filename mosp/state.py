@@ -0,0 +1,253 @@
+"""Struct-of-arrays storage of Person movement state
+
+Stores the movement state of all Persons of a Simulation (last_coord,
+target_coord, _start_time, _duration) in contiguous NumPy arrays, so
+current coordinates of many Persons can be calculated in one vectorized
+call instead of one Person.current_coords_impl() call per Person."""
+
+import numpy
+
+__maintainer__ = "B. Henne"
+__contact__ = "henne@dcsec.uni-hannover.de"
+__copyright__ = "(c) 2012, DCSec, Leibniz Universitaet Hannover, Germany"
+__license__ = "GPLv3"
+
+
+class CoordField(object):
+    """Data descriptor mapping a coordinate attribute ([x, y]) of a Person to a row of a store array."""
+
+    def __init__(self, name):
+        """@param name: name of the (n, 2) array of PersonStateStore"""
+        self.name = name
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        slot = obj._state_slot
+        if slot is None:
+            return list(obj._state_saved[self.name])
+        return getattr(obj._state_store, self.name)[slot].tolist()
+
+    def __set__(self, obj, value):
+        slot = obj._state_slot
+        if slot is None:
+            obj._state_saved[self.name] = [float(value[0]), float(value[1])]
+        else:
+            getattr(obj._state_store, self.name)[slot] = value
+
+
+class ScalarField(object):
+    """Data descriptor mapping a tick attribute of a Person to a cell of a store array."""
+
+    def __init__(self, name):
+        """@param name: name of the (n,) array of PersonStateStore"""
+        self.name = name
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        slot = obj._state_slot
+        if slot is None:
+            value = obj._state_saved[self.name]
+        else:
+            value = getattr(obj._state_store, self.name)[slot]
+        if value == numpy.inf:
+            return float('inf')
+        return int(value)
+
+    def __set__(self, obj, value):
+        try:
+            value = float(value)
+        except TypeError:
+            # e.g. SimPy's infinity used by free moving external persons
+            value = numpy.inf
+        slot = obj._state_slot
+        if slot is None:
+            obj._state_saved[self.name] = value
+        else:
+            getattr(obj._state_store, self.name)[slot] = value
+
+
+class CoordsFunctionField(object):
+    """Data descriptor for Person.current_coords.
+
+    Persons replace current_coords by other functions, e.g. _stopped_coords()
+    while being passivated. Such Persons are marked as custom in the store and are
+    not interpolated by the store, but by calling their function."""
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        func = obj.__dict__.get('_current_coords_func')
+        if func is None:
+            return obj.current_coords_impl
+        return func
+
+    def __set__(self, obj, value):
+        store = obj._state_store
+        if getattr(value, 'im_self', None) is obj and value.im_func is store.interpolated_impl:
+            obj.__dict__.pop('_current_coords_func', None)
+            custom = obj._state_custom_impl
+        else:
+            obj.__dict__['_current_coords_func'] = value
+            custom = True
+        if obj._state_slot is None:
+            obj._state_saved['custom'] = custom
+        else:
+            store.custom[obj._state_slot] = custom
+
+
+class PersonStateStore(object):
+    """Stores movement state of Persons as contiguous NumPy arrays.
+
+    Each Person gets a slot. The Person's attributes last_coord, target_coord,
+    _start_time, _duration and current_coords are views into this store,
+    implemented as data descriptors of a generated subclass of the Person's
+    class (see person_class()). Existing Person subclasses keep working unchanged.
+
+    Simulation.del_person() releases the slot of a removed Person for reuse
+    by new Persons. The state of the removed Person is kept in its
+    _state_saved dict until readd_person() allocates a new slot for it."""
+
+    def __init__(self, sim, capacity=1024):
+        """Inits the store.
+        @param sim: the Simulation the stored Persons belong to
+        @param capacity: initial number of slots, the store grows when needed"""
+        from core import Person
+        self.sim = sim
+        self.interpolated_impl = Person.current_coords_impl.im_func  #: current_coords implementation that is vectorized by coords()
+        self.size = 0                   #: number of used and free slots
+        self.persons = []               #: Person of each slot, None for free slots
+        self.free = []                  #: released slots, reused by allocate()
+        self.last = numpy.zeros((capacity, 2))
+        self.target = numpy.zeros((capacity, 2))
+        self.start = numpy.zeros(capacity)
+        self.duration = numpy.zeros(capacity)
+        self.custom = numpy.zeros(capacity, dtype=bool)   #: slot is not interpolated, but its current_coords is called
+        self._classes = {}
+
+    def person_class(self, cls):
+        """Returns the subclass of Person class cls whose instances store their state in this store."""
+        if cls in self._classes:
+            return self._classes[cls]
+        if getattr(cls, '_state_store', None) is self:
+            return cls
+        attrs = {
+            '__module__': cls.__module__,
+            '__doc__': cls.__doc__,
+            '_state_store': self,
+            '_state_custom_impl': cls.current_coords_impl.im_func is not self.interpolated_impl,
+            'last_coord': CoordField('last'),
+            'target_coord': CoordField('target'),
+            '_start_time': ScalarField('start'),
+            '_duration': ScalarField('duration'),
+            'current_coords': CoordsFunctionField(),
+            '__new__': staticmethod(_stored_new),
+            '__getstate__': _stored_getstate,
+            }
+        # Person.__init__ looks up actions in the class' own __dict__
+        for name, obj in cls.__dict__.items():
+            if hasattr(obj, 'action'):
+                attrs[name] = obj
+        stored = type(cls.__name__, (cls,), attrs)
+        self._classes[cls] = stored
+        return stored
+
+    def allocate(self, person):
+        """Allocates a slot for person and returns its index.
+
+        Reuses a released slot if any. Restores the state of a released person."""
+        if self.free:
+            slot = self.free.pop()
+            self.persons[slot] = person
+        else:
+            if self.size == len(self.start):
+                self._grow()
+            slot = self.size
+            self.size += 1
+            self.persons.append(person)
+        saved = person.__dict__.pop('_state_saved', None)
+        if saved is None:
+            self.custom[slot] = person._state_custom_impl
+        else:
+            for name in ('last', 'target', 'start', 'duration', 'custom'):
+                getattr(self, name)[slot] = saved[name]
+        return slot
+
+    def release(self, person):
+        """Releases the slot of person and keeps its state in person._state_saved, see allocate()."""
+        slot = person._state_slot
+        if slot is None:
+            return
+        person._state_saved = {'last': self.last[slot].tolist(),
+                               'target': self.target[slot].tolist(),
+                               'start': float(self.start[slot]),
+                               'duration': float(self.duration[slot]),
+                               'custom': bool(self.custom[slot])}
+        person._state_slot = None
+        self.persons[slot] = None
+        self.custom[slot] = False
+        self.duration[slot] = 0
+        self.free.append(slot)
+
+    def acquire(self, person):
+        """Allocates a new slot for person if its slot was released."""
+        if person._state_slot is None:
+            person._state_slot = self.allocate(person)
+
+    def _grow(self):
+        """Doubles the capacity of all arrays."""
+        capacity = 2 * len(self.start)
+        for name in ('last', 'target', 'start', 'duration', 'custom'):
+            old = getattr(self, name)
+            new = numpy.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def coords(self, slots=None, now=None):
+        """Calculates current coordinates of Persons in one vectorized call.
+
+        Same calculation as Person.current_coords_impl(). Custom slots (e.g.
+        passivated Persons) are calculated by calling their current_coords().
+        @param slots: array of slot indices, default is all slots
+        @param now: tick to calculate coordinates for, default is sim.now()
+        @return: (n, 2) array of coordinates, rows of custom slots returning None and of free slots are NaN"""
+        if now is None:
+            now = self.sim.now()
+        if slots is None:
+            slots = slice(0, self.size)
+        last = self.last[slots]
+        target = self.target[slots]
+        duration = self.duration[slots]
+        moving = duration != 0
+        completed = numpy.zeros(len(duration))
+        completed[moving] = (now - self.start[slots][moving]) / duration[moving]
+        re = last + (target - last) * completed[:, numpy.newaxis]
+        re[~moving] = target[~moving]
+        custom = numpy.flatnonzero(self.custom[slots])
+        if len(custom):
+            persons = self.persons
+            indices = numpy.arange(self.size)[slots] if isinstance(slots, slice) else slots
+            for i in custom:
+                c = persons[indices[i]].current_coords()
+                re[i] = c if c is not None else (numpy.nan, numpy.nan)
+        if isinstance(slots, slice) and self.free:
+            re[self.free] = numpy.nan
+        return re
+
+
+def _stored_new(cls, *args, **kwargs):
+    """Creates a stored Person and allocates its slot before __init__ sets any state."""
+    obj = object.__new__(cls)
+    obj._state_slot = cls._state_store.allocate(obj)
+    return obj
+
+
+def _stored_getstate(self):
+    """Returns Person information for pickling, including state held in the PersonStateStore."""
+    state = self.__dict__.copy()
+    del state['sim']
+    state.pop('_state_saved', None)
+    for name in ('last_coord', 'target_coord', '_start_time', '_duration'):
+        state[name] = getattr(self, name)
+    return state
@@ -0,0 +1,90 @@
+"""Instrumentation of Simulation runs
+
+SimulationStats accumulates wall clock time spent in the phases of
+Simulation.run() and counts events, Person wakeups and get_near()
+lookups. It is disabled by default and costs one comparison per tick,
+Person wakeup and get_near() call then:
+
+    >>> stats = s.enable_stats(dump_interval=600)
+    >>> s.run(until=3600, real_time=False, monitor=False)
+    >>> print stats.report()
+
+Phases:
+    - step: execution of SimPy events (Persons, actions, Locations, monitors)
+    - messages: execution of group.Messages scheduled by PersonGroup.call
+    - monitors: monitor observe() processes, included in step
+    - sleep: waiting of real-time runs"""
+
+import sys
+import time
+
+__maintainer__ = "B. Henne"
+__contact__ = "henne@dcsec.uni-hannover.de"
+__copyright__ = "(c) 2012, DCSec, Leibniz Universitaet Hannover, Germany"
+__license__ = "GPLv3"
+
+PHASES = ('step', 'messages', 'monitors', 'sleep')   #: timed phases, attributes t_<phase>
+COUNTERS = ('ticks', 'events', 'messages', 'wakeups', 'get_near', 'candidates')   #: counters
+
+
+class SimulationStats(object):
+    """Cumulative phase timers and counters of a Simulation, see Simulation.enable_stats().
+    @author: B. Henne"""
+
+    def __init__(self, dump_interval=None, out=None):
+        """Inits the SimulationStats.
+        @param dump_interval: write a report line to out every dump_interval ticks, None for no dumps
+        @param out: file for dumps, default is sys.stderr"""
+        self.dump_interval = dump_interval
+        self.out = out
+        self.next_dump = dump_interval
+        self.reset()
+
+    def reset(self):
+        """Sets all timers and counters to zero."""
+        for phase in PHASES:
+            setattr(self, 't_' + phase, 0.0)
+        self.ticks = 0          #: number of executed event times
+        self.events = 0         #: number of executed SimPy events
+        self.messages = 0       #: number of executed group.Messages
+        self.wakeups = 0        #: number of rounds of Person.go()
+        self.get_near = 0       #: number of Person.get_near() calls
+        self.candidates = 0     #: number of Persons tested for distance by get_near()
+
+    def __getstate__(self):
+        """Returns stats information for pickling without the dump file."""
+        state = self.__dict__.copy()
+        state['out'] = None
+        return state
+
+    def as_dict(self):
+        """Returns all timers (t_<phase> in seconds) and counters as dict."""
+        re = dict(('t_' + phase, getattr(self, 't_' + phase)) for phase in PHASES)
+        for counter in COUNTERS:
+            re[counter] = getattr(self, counter)
+        return re
+
+    def report(self):
+        """Returns all timers and counters as one line."""
+        times = ' '.join('%s=%.3fs' % (phase, getattr(self, 't_' + phase)) for phase in PHASES)
+        counts = ' '.join('%s=%s' % (counter, getattr(self, counter)) for counter in COUNTERS)
+        return '%s %s' % (times, counts)
+
+    def dump(self, tick):
+        """Writes a report line for tick to the dump file and schedules the next dump."""
+        out = self.out if self.out is not None else sys.stderr
+        out.write('t=%s %s\n' % (tick, self.report()))
+        out.flush()
+        while self.next_dump <= tick:
+            self.next_dump += self.dump_interval
+
+    def timed(self, gen):
+        """Returns a generator passing the commands of the process execution method gen, adding its run time to t_monitors."""
+        clock = time.time
+        while True:
+            t = clock()
+            try:
+                command = gen.next()
+            finally:
+                self.t_monitors += clock() - t
+            yield command
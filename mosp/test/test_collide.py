@@ -5,6 +5,10 @@
 from sys import path
 path.extend(['.', '..','../..'])
 
+import os
+import random
+import shutil
+import tempfile
 import unittest
 from mosp import collide
 from math import sqrt
@@ -126,9 +130,15 @@ class CollideTest(unittest.TestCase):
         self.assertEqual(w.collide_circle_impl0(3,3,2), set([a, b, c, d]))
         self.assertEqual(w.collide_circle_impl1(3,3,2), set([a, b, c, d]))
         self.assertEqual(w.collide_circle_impl2(3,3,2), set([a, b, c, d]))
+        self.assertEqual(w.collide_circle_impl3(3,3,2), set([a, b, c, d]))
         self.assertEqual(w.collide_circle_impl0(-1,-2,4), set([e, f, i, h, g]))
         self.assertEqual(w.collide_circle_impl1(-1,-2,4), set([e, f, i, h, g]))
         self.assertEqual(w.collide_circle_impl2(-1,-2,4), set([e, f, i, h, g]))
+        self.assertEqual(w.collide_circle_impl3(-1,-2,4), set([e, f, i, h, g]))
+        # vectorized candidate collision
+        w.grid_vectorize_min = 0
+        self.assertEqual(w.collide_circle_impl3(3,3,2), set([a, b, c, d]))
+        self.assertEqual(w.collide_circle_impl3(-1,-2,4), set([e, f, i, h, g]))
 
     def test_wcollide_cirle_points(self):
         """Tests collision of cirle and points."""
@@ -146,6 +156,68 @@ class CollideTest(unittest.TestCase):
         self.assertEqual(w.collide_circle_impl0(3,3,2),  set([b, c, d, t, u]))
         self.assertEqual(w.collide_circle_impl1(3,3,2),  set([b, c, d, t, u]))
         self.assertEqual(w.collide_circle_impl2(3,3,2),  set([b, c, d, t, u]))
+        self.assertEqual(w.collide_circle_impl3(3,3,2),  set([b, c, d, t, u]))
+        w.grid_vectorize_min = 0
+        self.assertEqual(w.collide_circle_impl3(3,3,2),  set([b, c, d, t, u]))
+
+    def test_wcollide_circle_large_radius(self):
+        """Tests collision of circles larger than the grid size with lines and points."""
+        w = collide.World(grid_size=2)
+        objects = [collide.Line(x, 0, x + 3, 2 * x) for x in xrange(0, 40, 3)]
+        objects += [collide.Point(x, 40 - x) for x in xrange(0, 40, 2)]
+        w.update(objects)
+        w.calculate_grid()
+        for x, y, radius in ((5, 5, 1), (5, 5, 7), (20, 20, 15), (-10, 30, 25), (60, 60, 200)):
+            self.assertEqual(w.collide_circle_impl3(x, y, radius), w.collide_circle_impl0(x, y, radius))
+        self.assertTrue(len(w.grid_levels) > 1)
+
+    def test_calculate_grid(self):
+        """Tests the rasterized grid equals colliding each grid segment with all objects."""
+        r = random.Random(1)
+        w = collide.World(grid_size=5)
+        objects = [collide.Line(r.randint(0, 60), r.randint(0, 60), r.randint(0, 60), r.randint(0, 60)) for i in xrange(50)]
+        objects += [collide.Line(r.uniform(0, 60), r.uniform(0, 60), r.uniform(0, 60), r.uniform(0, 60)) for i in xrange(50)]
+        objects += [collide.Line(5, 0, 5, 60), collide.Line(0, 10, 60, 10), collide.Line(0, 0, 60, 60), collide.Line(3, 3, 3, 3)]
+        objects += [collide.Point(r.randint(0, 12) * 5, r.uniform(0, 60)) for i in xrange(20)]
+        w.update(objects)
+        w.calculate_grid()
+        for x in w.grid:
+            for y in w.grid[x]:
+                self.assertEqual(w.grid[x][y], w.collide_rectangle(x, y, x + 5, y + 5))
+
+    def test_grid_cache(self):
+        """Tests the grid cache file is loaded if valid and rebuilt if the objects changed."""
+        def world(shift):
+            w = collide.World(grid_size=5)
+            objects = [collide.Line(i, 0, 2 * i + shift, 30) for i in xrange(10)] + [collide.Point(i, 3) for i in xrange(0, 30, 5)]
+            for i, obj in enumerate(objects):
+                obj.id = i
+            w.update(objects)
+            return w
+        def grid_ids(w):
+            return dict(((x, y), set(o.id for o in w.grid[x][y])) for x in w.grid for y in w.grid[x])
+        directory = tempfile.mkdtemp()
+        base = os.path.join(directory, 'map')
+        try:
+            built = world(0)
+            built.calculate_grid(cache_base_path=base)
+            loaded = world(0)
+            loaded.calculate_grid(cache_base_path=base)
+            self.assertTrue(os.path.exists(base + '.grid5.v2'))
+            # list copies of the mapped arrays are built on first query only
+            self.assertEqual((loaded._grid_levels, loaded._grid_segment_list_cache), (None, None))
+            self.assertEqual(grid_ids(loaded), grid_ids(built))
+            self.assertEqual(set(o.id for o in loaded.collide_circle(7, 7, 4)), set(o.id for o in built.collide_circle(7, 7, 4)))
+            changed = world(0.5)
+            self.assertFalse(changed.load_grid_cache(base + '.grid5.v2'))
+            changed.calculate_grid(cache_base_path=base)
+            self.assertNotEqual(grid_ids(changed), grid_ids(built))
+            # the rewritten file replaces the file still mapped by loaded
+            self.assertEqual(os.listdir(directory), ['map.grid5.v2'])
+            self.assertEqual(set(o.id for o in loaded.collide_circle(12, 20, 4)), set(o.id for o in built.collide_circle(12, 20, 4)))
+            self.assertTrue(world(0.5).load_grid_cache(base + '.grid5.v2'))
+        finally:
+            shutil.rmtree(directory)
 
     def test_wcollide_rectangle_lines(self):
         """Tests collision of lines and a rectangle."""
@@ -176,5 +248,64 @@ class CollideTest(unittest.TestCase):
         self.assertEqual(w.collide_rectangle(0, 0, 2, 2), set([b,c,d,g]))
 
 
+    def test_wcollide_polygon(self):
+        """Tests collision of lines and points with a polygon with a hole."""
+        w = collide.World(grid_size=5)
+        outer = [(10, 10), (50, 10), (50, 50), (30, 60), (10, 50)]
+        hole = [(25, 25), (35, 25), (35, 35), (25, 35)]
+        poly = collide.Polygon(outer, hole)
+        a = collide.Line(15, 15, 20, 20)    # inside
+        b = collide.Line(0, 0, 5, 60)       # outside
+        c = collide.Line(0, 30, 12, 30)     # crossing boundary
+        d = collide.Line(27, 27, 33, 33)    # in hole
+        e = collide.Line(20, 30, 40, 30)    # crossing hole
+        f = collide.Point(50, 30)           # on boundary
+        g = collide.Point(30, 30)           # in hole
+        h = collide.Point(45, 45)           # inside
+        w.update([a, b, c, d, e, f, g, h])
+        w.calculate_grid()
+        self.assertEqual(w.collide_polygon(poly), set([a, c, e, f, h]))
+        r = random.Random(1)
+        objects = [collide.Line(r.uniform(0, 60), r.uniform(0, 60), r.uniform(0, 60), r.uniform(0, 60)) for i in xrange(200)]
+        objects += [collide.Point(r.uniform(0, 60), r.uniform(0, 60)) for i in xrange(200)]
+        w.update(objects)
+        w.calculate_grid()
+        inside, boundary = w.polygon_cells(poly)
+        self.assertTrue(inside and boundary)
+        self.assertEqual(w.collide_polygon(poly), set(o for o in w.obj if o.collide_polygon(poly)))
+        w.polygon_cells_cache_size = 2
+        squares = [collide.Polygon([(i, i), (i + 20, i), (i + 20, i + 20), (i, i + 20)]) for i in xrange(3)]
+        for square in squares + [poly]:
+            w.collide_polygon(square)
+        self.assertEqual([cached[0] for cached in w.polygon_cells_cache.values()], [squares[2], poly])
+        w.collide_polygon(squares[2])
+        self.assertEqual([cached[0] for cached in w.polygon_cells_cache.values()], [poly, squares[2]])
+
+    def test_wcollide_sector(self):
+        """Tests collision of lines and points with a sector, by grid and brute force."""
+        w = collide.World(grid_size=5)
+        a = collide.Point(5, 1)             # inside, east of center
+        b = collide.Point(1, 5)             # outside, north of center
+        c = collide.Line(2, -5, 2, 5)       # crossing
+        d = collide.Line(-5, -5, -1, -1)    # behind center
+        e = collide.Point(9, 0)             # too far
+        f = collide.Line(4, 6, 6, 3)        # crossing border
+        w.update([a, b, c, d, e, f])
+        w.calculate_grid()
+        self.assertEqual(w.collide_sector(0, 0, 8, 90, 0), set([a, c, f]))
+        self.assertEqual(w.collide_sector(0, 0, 8, 270, 180), set([b, c, d, f]))
+        r = random.Random(1)
+        w = collide.World(grid_size=5)
+        objects = [collide.Line(r.uniform(0, 60), r.uniform(0, 60), r.uniform(0, 60), r.uniform(0, 60)) for i in xrange(300)]
+        objects += [collide.Point(r.uniform(0, 60), r.uniform(0, 60)) for i in xrange(300)]
+        w.update(objects)
+        w.calculate_grid()
+        for i in xrange(50):
+            x, y, radius = r.uniform(0, 60), r.uniform(0, 60), r.uniform(1, 30)
+            angle, direction = r.choice([45, 180, 250, 360]), r.uniform(-180, 360)
+            sector = collide.Sector(x, y, radius, angle, direction)
+            self.assertEqual(w.collide_sector(x, y, radius, angle, direction),
+                             set(o for o in w.obj if o.collide_sector(sector)))
+
 if __name__ == "__main__": 
     unittest.main()
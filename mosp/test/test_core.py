@@ -0,0 +1,814 @@
+# -*- coding: utf-8 -*-
+"""Tests for simulation core"""
+
+from sys import path
+path.extend(['.', '..','../..'])
+
+import os
+import tempfile
+import time
+import unittest
+from mosp import checkpoint, collide, core, encounter, ensemble, group, kernel, light, locations, partition, rng
+from mosp.geo import osm
+from mosp.impl import movement
+
+__maintainer__ = "B. Henne"
+__contact__ = "henne@dcsec.uni-hannover.de"
+__copyright__ = "(c) 2012, DCSec, Leibniz Universitaet Hannover, Germany"
+__license__ = "GPLv3"
+
+MAP = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../data/minimap2.osm')
+
+
+class RandomWiggler(core.Person):
+    """Random movement person for tests."""
+    next_target = movement.person_next_target_random
+
+
+def simulation(**kwargs):
+    """Returns a Simulation on the test map."""
+    return core.Simulation(geo=osm.OSMModel(MAP), allow_dup=True, **kwargs)
+
+
+class PersonStateTest(unittest.TestCase):
+    """Tests mosp.state.PersonStateStore."""
+
+    def test_coords(self):
+        """Test vectorized coordinates equal Person.current_coords_impl."""
+        s = simulation(person_state=True)
+        s.add_persons(RandomWiggler, 20)
+        persons = sorted(s.persons, key=lambda p: p.p_id)
+        for until in (1, 7, 30):
+            s.run(until=until, real_time=False, monitor=False)
+            expected = [tuple(core.Person.current_coords_impl(p)) for p in persons]
+            self.assertEqual(s.coords_of(persons), expected)
+
+    def test_passivated(self):
+        """Test custom current_coords of passivated Persons are used."""
+        s = simulation(person_state=True)
+        s.add_persons(RandomWiggler, 3)
+        p = sorted(s.persons, key=lambda p: p.p_id)[0]
+        p.current_coords = lambda: (1.0, 2.0)
+        self.assertEqual(s.coords_of([p]), [(1.0, 2.0)])
+        p.current_coords = p.current_coords_impl
+        self.assertEqual(s.coords_of([p]), [tuple(p.current_coords_impl())])
+
+    def test_release(self):
+        """Test slots of removed Persons are reused and readded Persons keep their state."""
+        s = simulation(person_state=True)
+        s.add_persons(RandomWiggler, 10)
+        store = s.person_state
+        s.run(until=20, real_time=False, monitor=False)
+        for i in xrange(10):
+            s.del_person(s.get_person(i))
+            s.add_persons(RandomWiggler, 1)
+        self.assertEqual(store.size, 10)
+        s.run(until=40, real_time=False, monitor=False)
+        persons = sorted(s.persons, key=lambda p: p.p_id)
+        self.assertEqual(len(persons), 10)
+        self.assertEqual(s.coords_of(persons), [tuple(core.Person.current_coords_impl(p)) for p in persons])
+        removed = s.removed_persons[3]
+        coords = removed.current_coords()
+        s.readd_person(3)
+        self.assertEqual(removed.current_coords(), coords)
+        self.assertEqual(s.coords_of([removed]), [tuple(coords)])
+        self.assertEqual((store.size, store.free), (11, []))
+        s.del_person(removed)
+        x, y = store.coords()[store.free[0]]
+        self.assertTrue(x != x and y != y)
+
+
+class CalendarQueueKernelTest(unittest.TestCase):
+    """Tests mosp.kernel.CalendarQueueKernel."""
+
+    def trace(self, sim_cls):
+        s = sim_cls(geo=osm.OSMModel(MAP), allow_dup=True)
+        s.add_persons(RandomWiggler, 20)
+        re = []
+        for until in xrange(5, 200, 5):
+            s.run(until=until, real_time=False, monitor=False)
+            re.append(sorted((p.p_id, tuple(p.current_coords())) for p in s.persons))
+        return re
+
+    def test_same_as_simpy(self):
+        """Test calendar queue executes the same events as SimPy's event heap."""
+        self.assertEqual(self.trace(kernel.CalendarSimulation), self.trace(core.Simulation))
+
+    def test_event_lists(self):
+        """Test allEventNotices() and allEventTimes() equal SimPy's."""
+        sims = [sim_cls(geo=osm.OSMModel(MAP), allow_dup=True) for sim_cls in (kernel.CalendarSimulation, core.Simulation)]
+        for s in sims:
+            s.add_persons(RandomWiggler, 20)
+            s.get_person(3).pause_movement(50)
+            s.run(until=30, real_time=False, monitor=False)
+        calendar, simpy = sims
+        self.assertTrue(len(calendar.allEventTimes()) > 1)
+        self.assertEqual(calendar.allEventTimes(), simpy.allEventTimes())
+        self.assertEqual(calendar.allEventNotices(), simpy.allEventNotices())
+
+
+def add_wigglers(sim):
+    sim.add_persons(RandomWiggler, 20)
+
+
+def coords(sim):
+    return dict((p.p_id, tuple(p.current_coords())) for p in sim.persons)
+
+
+class SpeedUpWiggler(RandomWiggler):
+    """Person getting faster at tick 30."""
+    @core.action(1)
+    def speed_up(self):
+        if self.sim.now() == 30:
+            self.p_speed = 10.0
+
+
+class PartitionTest(unittest.TestCase):
+    """Tests mosp.partition.PartitionedSimulation."""
+
+    def test_same_as_single(self):
+        """Test Persons move like in a single Simulation when handed off between partitions."""
+        p = partition.PartitionedSimulation(osm.OSMModel(MAP), partitions=2)
+        partitioned = {}
+        for result in p.run(add_wigglers, until=200, result=coords):
+            partitioned.update(result)
+        s = simulation()
+        add_wigglers(s)
+        s.run(until=200, real_time=False, monitor=False)
+        self.assertEqual(partitioned, coords(s))
+
+    def test_owned_only(self):
+        """Test partitions keep only their own Persons and the lookahead is derived from the fastest Person."""
+        def setup(sim):
+            add_wigglers(sim)
+            sim.add_persons(RandomWiggler, 1, args={'speed': 2.4})
+        p = partition.PartitionedSimulation(osm.OSMModel(MAP), partitions=2)
+        results = p.run(setup, until=0, result=lambda sim: (len(sim.persons), len(sim.removed_persons)))
+        self.assertEqual(sum(n for n, removed in results), 21)
+        self.assertEqual([removed for n, removed in results], [0, 0])
+        self.assertEqual(p.lookahead, partition.lookahead(p.geo, p.borders, 2.4))
+        p = partition.PartitionedSimulation(p.geo, partitions=2, max_speed=2.0)
+        self.assertRaises(partition.PartitionException, p.run, setup, 10)
+
+    def test_speed_up(self):
+        """Test a Person getting faster than the lookahead allows stops the run."""
+        p = partition.PartitionedSimulation(osm.OSMModel(MAP), partitions=2)
+        self.assertRaises(ensemble.EnsembleWorkerException, p.run, lambda sim: sim.add_persons(SpeedUpWiggler, 20), 200)
+
+
+class SpawnTest(unittest.TestCase):
+    """Tests Simulation.add_persons with staggered and lazy activation."""
+
+    def trace(self, lazy):
+        s = simulation()
+        s.add_persons(RandomWiggler, 10, start=5, interval=3, lazy=lazy)
+        re = []
+        for until in (4, 10, 40, 100):
+            s.run(until=until, real_time=False, monitor=False)
+            re.append(coords(s))
+        return re
+
+    def test_lazy(self):
+        """Test lazily created Persons move like Persons created at once."""
+        eager = self.trace(False)
+        lazy = self.trace(True)
+        self.assertEqual([len(c) for c in lazy], [0, 2, 10, 10])
+        for l, e in zip(lazy, eager):
+            self.assertEqual(l, dict((id, e[id]) for id in l))
+
+
+class IndexedWiggler(RandomWiggler):
+    """Person with an indexed property."""
+    indexed_properties = ('p_infected',)
+    p_infected = False
+
+
+class SpeedWiggler(RandomWiggler):
+    """Person whose properties are indexed by the test."""
+    pass
+
+
+class PersonRegistryTest(unittest.TestCase):
+    """Tests mosp.group.PersonRegistry and PersonGroup.filter()."""
+
+    def test_filter(self):
+        """Test filter() on indexed properties equals comparing each Person."""
+        s = simulation()
+        s.add_persons(IndexedWiggler, 10)
+        s.add_persons(RandomWiggler, 2)
+        persons = sorted(s.persons, key=lambda p: p.p_id)
+        self.assertTrue(s.get_person(3) is persons[3])
+        self.assertEqual(s.get_person(12), None)
+        persons[1].p_infected = True
+        persons[2].p_infected = True
+        del persons[2].p_infected
+        persons[10].p_infected = True
+        s.del_person(persons[4])
+        persons[4].p_infected = True
+        s.persons.add_index('p_color')
+        persons[5].p_color = 5
+        expected = lambda g, **kw: set(p for p in g for k, v in kw.iteritems() if getattr(p, k, None) == v)
+        for g in (s.persons, group.PersonGroup(persons)):
+            for kw in ({'p_infected': True}, {'p_infected': False}, {'p_color': 5, 'p_infected': True}):
+                self.assertEqual(g.filter(**kw), expected(g, **kw))
+        self.assertEqual(s.persons.filter(p_infected=True), set([persons[1], persons[10]]))
+        self.assertEqual(s.get_person(4), None)
+        s.readd_person(4)
+        self.assertEqual(s.persons.filter(p_infected=True), set([persons[1], persons[4], persons[10]]))
+
+    def test_checkpoint(self):
+        """Test a restored registry keeps its indexes."""
+        s = simulation()
+        s.add_persons(IndexedWiggler, 3)
+        fd, path = tempfile.mkstemp(suffix='.ckpt')
+        os.close(fd)
+        try:
+            checkpoint.save(s, path)
+            r = checkpoint.restore(path)
+        finally:
+            os.remove(path)
+        self.assertEqual(sorted(r.persons.by_id), [0, 1, 2])
+        r.get_person(1).p_infected = True
+        self.assertEqual(r.persons.filter(p_infected=True), set([r.get_person(1)]))
+        self.assertEqual(len(r.persons.indexes['p_infected'][False]), 2)
+
+    def test_property(self):
+        """Test indexing the properties p_speed and p_agenttype keeps their getter and setter."""
+        s = simulation()
+        s.add_persons(SpeedWiggler, 4)
+        s.persons.add_index('p_speed')
+        s.persons.add_index('p_agenttype')
+        persons = sorted(s.persons, key=lambda p: p.p_id)
+        self.assertEqual(persons[0].p_speed, persons[0]._p_speed)
+        persons[1].p_speed = 2.5
+        self.assertEqual(persons[1]._p_speed, 2.5)
+        self.assertEqual(s.persons.filter(p_speed=2.5), set([persons[1]]))
+        self.assertEqual(s.persons.filter(p_agenttype='SpeedWiggler'), set(persons))
+        s.run(until=100, real_time=False, monitor=False)
+        self.assertEqual(s.persons.filter(p_speed=2.5), set([persons[1]]))
+
+    def test_classes(self):
+        """Test indexing does not change the Person classes."""
+        s = simulation()
+        s.add_persons(IndexedWiggler, 2)
+        s.persons.add_index('p_speed')
+        self.assertFalse(isinstance(IndexedWiggler.__dict__['p_infected'], group.IndexedProperty))
+        self.assertTrue(isinstance(core.Person.__dict__['p_speed'], property))
+        person = s.get_person(0)
+        self.assertTrue(isinstance(person, IndexedWiggler))
+        self.assertEqual(person.p_agenttype, 'IndexedWiggler')
+        self.assertEqual(person.get_properties()['p_speed'], person.p_speed)
+        person.p_infected = True
+        other = IndexedWiggler(99, s, random=s.random)
+        other.p_infected = True
+        self.assertEqual(s.persons.filter(p_infected=True), set([person]))
+
+
+class MailWiggler(RandomWiggler):
+    """Records received messages."""
+    def receive(self, message, sender):
+        kept = message == 'keep' and not any(m == 'keep' for t, m in self.received)
+        self.received.append((self.sim.now(), message))
+        return not kept
+
+
+class MailboxTest(unittest.TestCase):
+    """Tests Person.send() and Person.deliver_messages()."""
+
+    def test_order(self):
+        """Test messages are received in order of earliest_arrival and sending, not before."""
+        s = simulation()
+        s.add_persons(MailWiggler, 2)
+        sender, receiver = sorted(s.persons, key=lambda p: p.p_id)
+        receiver.received = []
+        sender.send(receiver, 'c', earliest_arrival=200)
+        sender.send(receiver, 'a', earliest_arrival=10)
+        sender.send(receiver, 'b', earliest_arrival=10)
+        sender.send(receiver, 'keep', earliest_arrival=10)
+        s.run(until=9, real_time=False, monitor=False)
+        self.assertEqual(receiver.received, [])
+        sender.send(receiver, 'now', earliest_arrival=s.now(), interrupt=True)
+        s.run(until=400, real_time=False, monitor=False)
+        messages = [m for t, m in receiver.received]
+        self.assertEqual(messages, ['now', 'a', 'b', 'keep', 'keep', 'c'])
+        self.assertEqual(receiver.received[0][0], 9)
+        self.assertTrue(all(t >= 10 for t, m in receiver.received[1:]))
+        self.assertTrue(receiver.received[-1][0] >= 200)
+        self.assertEqual(receiver.pending_messages(), 0)
+        self.assertEqual((s.person_messages_sent, s.person_messages_delivered, s.person_messages_kept), (5, 5, 1))
+
+
+class ActionWiggler(RandomWiggler):
+    """Records execution ticks of its actions."""
+    def __init__(self, *args, **kwargs):
+        self.ticks = []
+        self.slow_ticks = []
+        super(ActionWiggler, self).__init__(*args, **kwargs)
+
+    @core.action(3)
+    def record(self):
+        self.ticks.append(self.sim.now())
+
+    @core.action(2, start=False)
+    def slow(self):
+        self.slow_ticks.append(self.sim.now())
+        return 5
+
+
+class ActionSchedulerTest(unittest.TestCase):
+    """Tests mosp.core.ActionScheduler and actions."""
+
+    def test_schedule(self):
+        """Test actions are executed every every ticks and can be stopped and restarted."""
+        s = simulation()
+        s.add_persons(ActionWiggler, 2)
+        p, q = sorted(s.persons, key=lambda p: p.p_id)
+        self.assertFalse(p._actions[ActionWiggler.slow.im_func].active())
+        core.start_action(p.slow, delay=4)
+        s.run(until=10, real_time=False, monitor=False)
+        core.stop_action(q.record)
+        self.assertFalse(q._actions[ActionWiggler.record.im_func].active())
+        s.run(until=20, real_time=False, monitor=False)
+        core.start_action(q.record)
+        s.run(until=30, real_time=False, monitor=False)
+        self.assertEqual(p.ticks, range(3, 31, 3))
+        self.assertEqual(q.ticks, [3, 6, 9, 23, 26, 29])
+        self.assertEqual(p.slow_ticks, [6, 11, 16, 21, 26])
+        self.assertEqual(s.action_scheduler.executed, 21)
+
+
+class StatsTest(unittest.TestCase):
+    """Tests mosp.stats.SimulationStats."""
+
+    def test_counters(self):
+        """Test counters are equal for both kernels and do not change the run."""
+        results = []
+        for sim_cls in (core.Simulation, kernel.CalendarSimulation):
+            s = sim_cls(geo=osm.OSMModel(MAP), allow_dup=True)
+            stats = s.enable_stats()
+            add_wigglers(s)
+            s.run(until=100, real_time=False, monitor=False)
+            p = s.get_person(0)
+            p.get_near(50)
+            counters = stats.as_dict()
+            self.assertEqual(counters['get_near'], 1)
+            self.assertTrue(counters['candidates'] >= 1)
+            self.assertTrue(counters['events'] >= counters['wakeups'] > 0)
+            self.assertTrue(counters['t_step'] > 0)
+            results.append((coords(s), [counters[k] for k in ('ticks', 'events', 'wakeups', 'candidates')]))
+        s = simulation()
+        add_wigglers(s)
+        s.run(until=100, real_time=False, monitor=False)
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0][0], coords(s))
+
+
+def next_target_first(self):
+    """Deterministic next_target: the first neighbor that is not the last node."""
+    targets = sorted(self.next_node.neighbors.keys())
+    if len(targets) > 1 and self.last_node in targets:
+        targets.remove(self.last_node)
+    self.last_node = self.next_node
+    self.next_node = targets[0]
+
+
+def next_target_coord_node(self):
+    """Deterministic next_target_coord: coordinates of next_node."""
+    return (self.next_node.x, self.next_node.y)
+
+
+class FirstWiggler(core.Person):
+    next_target = next_target_first
+    next_target_coord = next_target_coord_node
+
+
+class LightWiggler(light.LightPerson):
+    __slots__ = ('p_infected',)
+    indexed_properties = ('p_infected',)
+    next_target = next_target_first
+    next_target_coord = next_target_coord_node
+
+
+class LightPersonTest(unittest.TestCase):
+    """Tests mosp.light.LightPerson."""
+
+    def test_same_as_person(self):
+        """Test a LightPerson moves like a Person starting at the same node."""
+        s = simulation()
+        s.add_persons(FirstWiggler, 1)
+        s.add_persons(LightWiggler, 1)
+        p, l = s.get_person(0), s.get_person(1)
+        self.assertFalse(hasattr(l, '__dict__'))
+        l.current_way.persons.remove(l)
+        l.last_node = l.next_node = p.last_node
+        l.current_way = p.current_way
+        l.current_way.persons.append(l)
+        l.last_coord = l.target_coord = tuple(p.target_coord)
+        for until in xrange(1, 300, 7):
+            s.run(until=until, real_time=False, monitor=False)
+            self.assertEqual(tuple(l.current_coords()), tuple(p.current_coords()))
+        self.assertTrue(l in p.get_near(1))
+        self.assertTrue(p in l.get_near(1, self_included=False))
+
+    def test_registry(self):
+        """Test indexed slots, filter() and removal of LightPersons."""
+        s = simulation()
+        s.add_persons(LightWiggler, 5, args={'speed': 2})
+        persons = sorted(s.persons, key=lambda p: p.p_id)
+        persons[1].p_infected = True
+        persons[2].p_infected = False
+        self.assertEqual(s.persons.filter(p_infected=True), set([persons[1]]))
+        self.assertEqual(s.persons.filter(p_infected=False), set([persons[2]]))
+        del persons[1].p_infected
+        self.assertEqual(s.persons.filter(p_infected=True), set())
+        s.run(until=50, real_time=False, monitor=False)
+        s.del_person(persons[3])
+        coords = persons[3].current_coords()
+        s.run(until=100, real_time=False, monitor=False)
+        self.assertEqual(persons[3].current_coords(), coords)
+        self.assertFalse(persons[3] in persons[3].current_way.persons)
+        self.assertEqual(len(s.persons), 4)
+
+
+class CounterRandomTest(unittest.TestCase):
+    """Tests mosp.rng."""
+
+    def test_batch(self):
+        """Test vectorized draws equal draws one by one."""
+        streams = [rng.CounterRandom(7, i) for i in xrange(100)]
+        single = [rng.CounterRandom(7, i) for i in xrange(100)]
+        single[3].random()
+        streams[3].counter += 1
+        self.assertEqual(rng.random_batch(streams).tolist(), [r.random() for r in single])
+        lengths = [i % 5 + 1 for i in xrange(100)]
+        self.assertEqual(rng.choice_indexes(streams, lengths).tolist(),
+                         [r.choice(range(n)) for r, n in zip(single, lengths)])
+        self.assertNotEqual(rng.CounterRandom(7, 0).random(), rng.CounterRandom(8, 0).random())
+
+    def test_simulation(self):
+        """Test Persons with counter-based streams are reproducible."""
+        results = []
+        for i in xrange(2):
+            s = simulation(seed=3, counter_random=True)
+            s.add_persons(RandomWiggler, 10)
+            s.run(until=200, real_time=False, monitor=False)
+            results.append(coords(s))
+        self.assertEqual(results[0], results[1])
+        self.assertTrue(isinstance(s.get_person(0)._random, rng.CounterRandom))
+
+
+class PauseWiggler(RandomWiggler):
+    """Pauses at every node and records its pauses and reactivations."""
+    def __init__(self, *args, **kwargs):
+        super(PauseWiggler, self).__init__(*args, **kwargs)
+        self.pauses = []
+        self.resumes = []
+
+    def reactivate(self, *args, **kwargs):
+        self.resumes.append(self.sim.now())
+        super(PauseWiggler, self).reactivate(*args, **kwargs)
+
+    def act_at_node(self, node):
+        duration = 1 + (self.p_id * 7 + len(self.pauses)) % 13
+        self.pauses.append((self.sim.now(), duration))
+        self.pause_movement(duration)
+
+
+class LocationTest(unittest.TestCase):
+    """Tests mosp.locations.Location."""
+
+    def test_pause(self):
+        """Test paused Persons are reactivated duration - 1 ticks after pause_movement()."""
+        s = simulation()
+        s.add_persons(PauseWiggler, 20)
+        s.run(until=300, real_time=False, monitor=False)
+        for p in s.persons:
+            self.assertTrue(len(p.pauses) > 2)
+            expected = [tick + duration - 1 for tick, duration in p.pauses if tick + duration - 1 <= 300]
+            self.assertEqual(p.resumes, expected)
+        alarm = s.person_alarm_clock
+        self.assertEqual(len(alarm.visitors), len([p for p in s.persons if p.passivate]))
+        self.assertEqual(len([e for e in alarm.departures if e[2] is not None]), len(alarm.visitors))
+
+    def test_cafe(self):
+        """Test closing a Cafe releases all its visitors."""
+        s = simulation()
+        s.add_persons(RandomWiggler, 3)
+        cafe = locations.Cafe('cafe', s)
+        s.activate(cafe, cafe.serve(), 0)
+        persons = sorted(s.persons, key=lambda p: p.p_id)
+        s.run(until=10, real_time=False, monitor=False)
+        for i, p in enumerate(persons):
+            p.passivate = True
+            cafe.visit(p, 100 * (i + 1))
+        s.run(until=150, real_time=False, monitor=False)
+        self.assertEqual(list(cafe.visitors), persons[1:])
+        self.assertEqual(cafe.wakeup, 210)
+        cafe.close()
+        self.assertEqual(len(cafe.visitors), 0)
+        s.run(until=300, real_time=False, monitor=False)
+        self.assertEqual(cafe.wakeup, None)
+
+
+class PersonHashTest(unittest.TestCase):
+    """Tests mosp.spatial.PersonHash."""
+
+    def near(self, sim, person, dist):
+        """get_near() by testing the distance of all Persons."""
+        x, y = person.current_coords()
+        return set(p for p in sim.persons if p.collide_circle(x, y, dist))
+
+    def test_get_near(self):
+        """Test get_near() and get_near_all() find all Persons in distance with one build per tick."""
+        s = simulation()
+        add_wigglers(s)
+        s.add_persons(LightWiggler, 5)
+        person_hash = s.enable_person_hash(cell_size=10)
+        for until in (50, 51, 120):
+            s.run(until=until, real_time=False, monitor=False)
+            builds = person_hash.builds
+            for p in s.persons:
+                self.assertEqual(p.get_near(25), self.near(s, p, 25))
+            self.assertEqual(person_hash.builds, builds + 1)
+            near = s.get_near_all(s.persons, 25, self_included=False)
+            for p in s.persons:
+                self.assertEqual(near[p], self.near(s, p, 25) - set([p]))
+        p = s.get_person(0)
+        q = iter(p.get_near(500) - set([p])).next()
+        s.del_person(q)
+        self.assertFalse(q in p.get_near(500))
+        self.assertEqual(person_hash.builds, builds + 2)
+
+    def test_proximity_join(self):
+        """Test proximity_join() finds the pairs get_near() of each source finds."""
+        s = simulation()
+        add_wigglers(s)
+        s.add_persons(LightWiggler, 5)
+        s.run(until=80, real_time=False, monitor=False)
+        sources = [p for p in s.persons if p.p_id % 3 == 0]
+        pairs = s.proximity_join(sources, s.persons, 30)
+        self.assertEqual(pairs, sorted(pairs, key=lambda pair: (pair[0].p_id, pair[1].p_id)))
+        expected = set((p, q) for p in sources for q in self.near(s, p, 30) if q is not p)
+        self.assertEqual(set((p, q) for p, q, d in pairs), expected)
+        for p, q, d in pairs:
+            self.assertTrue(d <= 30)
+
+
+class ContactLog(encounter.EncounterEngine):
+    """Logs begin and end of contacts."""
+
+    def __init__(self, *args):
+        self.log = []
+        encounter.EncounterEngine.__init__(self, *args)
+
+    def contact_begin(self, a, b, tick):
+        self.log.append(('begin', a.p_id, b.p_id, tick))
+
+    def contact_end(self, a, b, tick, begin):
+        self.log.append(('end', a.p_id, b.p_id, tick))
+
+
+class EncounterTest(unittest.TestCase):
+    """Tests mosp.encounter.EncounterEngine."""
+
+    def test_contacts(self):
+        """Test the contacts are the pairs in distance at every tick, also after removal of Persons."""
+        s = simulation()
+        add_wigglers(s)
+        s.add_persons(LightWiggler, 10)
+        engine = s.enable_encounters(10, ContactLog)
+        open_contacts = {}
+        for tick in xrange(1, 250):
+            s.run(until=tick, real_time=False, monitor=False)
+            if tick == 60:
+                s.del_person(s.get_person(2))
+                s.del_person(s.get_person(25))
+            persons = sorted(s.persons, key=lambda p: p.p_id)
+            expected = set((a, b) for i, a in enumerate(persons) for b in persons[i + 1:]
+                           if a.collide_circle(b.current_coords()[0], b.current_coords()[1], 10))
+            self.assertEqual(set(engine.contacts), expected)
+        for event, a, b, tick in engine.log:
+            if event == 'begin':
+                self.assertFalse((a, b) in open_contacts)
+                open_contacts[(a, b)] = tick
+            else:
+                self.assertTrue(open_contacts.pop((a, b)) < tick)
+        self.assertEqual(set(open_contacts), set((a.p_id, b.p_id) for a, b in engine.contacts))
+
+    def test_contact_durations(self):
+        """Test subscribers are called when pairs are threshold ticks in distance, also after restart() and when subscribed later."""
+        s = simulation()
+        add_wigglers(s)
+        s.add_persons(LightWiggler, 10)
+        tracker = s.enable_contact_tracker(10)
+        calls = []
+        tracker.subscribe(5, lambda a, b, tick: calls.append((a.p_id, b.p_id, tick)))
+        later_calls = []
+        expected = []
+        later_expected = []
+        durations = {}
+        for tick in xrange(0, 250):
+            s.run(until=tick, real_time=False, monitor=False)
+            if tick == 100:
+                # contacts lasting 3 ticks or longer now are not reported
+                tracker.subscribe(3, lambda a, b, tick: later_calls.append((a.p_id, b.p_id, tick)))
+                tracker.restart(s.get_person(21))
+                for pair in durations:
+                    if 21 in pair:
+                        durations[pair] = 0
+            persons = sorted(s.persons, key=lambda p: p.p_id)
+            close = set((a.p_id, b.p_id) for i, a in enumerate(persons) for b in persons[i + 1:]
+                        if a.collide_circle(b.current_coords()[0], b.current_coords()[1], 10))
+            durations = dict((pair, durations.get(pair, 0) + 1) for pair in close)
+            expected.extend((a, b, tick) for (a, b), d in durations.iteritems() if d == 5)
+            if tick > 100:
+                later_expected.extend((a, b, tick) for (a, b), d in durations.iteritems() if d == 3)
+            for a, b in tracker.contacts:
+                self.assertEqual(tracker.duration(a, b), durations[(a.p_id, b.p_id)])
+        self.assertTrue(expected and later_expected)
+        self.assertEqual(sorted(calls), sorted(expected))
+        self.assertEqual(sorted(later_calls), sorted(later_expected))
+
+
+def replicate(geo, seed):
+    """Ensemble replication: later seeds finish first, returns seed, moved Persons and ids of the model's data."""
+    if seed == 'fail':
+        raise ValueError(seed)
+    time.sleep((4 - seed) * 0.1)
+    s = core.Simulation(geo=geo, seed=seed, allow_dup=True)
+    s.add_persons(RandomWiggler, 3)
+    s.run(until=50, real_time=False, monitor=False)
+    return seed, len(s.persons), id(geo.node_index), id(geo.way_nodes), len(geo.way_nodes)
+
+
+class EnsembleTest(unittest.TestCase):
+    """Tests mosp.ensemble.Ensemble."""
+
+    def test_run(self):
+        """Test results are returned in order of params, failures raise and the preloaded model is reused."""
+        geo = osm.OSMModel(MAP)
+        e = ensemble.Ensemble(geo, processes=2)
+        loaded = (id(geo.node_index), id(geo.way_nodes), len(geo.way_nodes))
+        results = e.map(replicate, [0, 1, 2, 3])
+        self.assertEqual([r[:2] for r in results], [(0, 3), (1, 3), (2, 3), (3, 3)])
+        for r in results:
+            self.assertEqual(r[2:], loaded)
+        self.assertEqual(sorted(param for param, result in e.run(replicate, [3, 1])), [1, 3])
+        self.assertRaises(ensemble.EnsembleWorkerException, e.map, replicate, [1, 'fail'])
+
+    def test_shared_model(self):
+        """Test a Simulation on an initialized model does not see the Persons of the previous one."""
+        geo = osm.OSMModel(MAP)
+        first = core.Simulation(geo=geo, allow_dup=True)
+        first.add_persons(RandomWiggler, 5)
+        first.run(until=20, real_time=False, monitor=False)
+        ways = [o for o in geo.obj if isinstance(o, osm.WaySegment)]
+        self.assertTrue(any(way.persons for way in ways))
+        second = core.Simulation(geo=geo, allow_dup=True)
+        self.assertFalse(any(way.persons for way in ways))
+        second.add_persons(RandomWiggler, 5)
+        second.run(until=20, real_time=False, monitor=False)
+        self.assertTrue(all(p.sim is second for way in ways for p in way.persons))
+
+
+class NearestTest(unittest.TestCase):
+    """Tests the nearest node and segment search of OSMModel."""
+
+    def test_nearest(self):
+        """Test nearest_nodes() and nearest_segments() find what a linear scan finds."""
+        s = simulation()
+        geo = s.geo
+        r = rng.CounterRandom(1, 0)
+        points = [(r.uniform(geo.start_x - 200, geo.end_x + 200), r.uniform(geo.start_y - 200, geo.end_y + 200)) for i in xrange(50)]
+        segments = [obj for obj in geo.obj if isinstance(obj, osm.WaySegment)]
+        for (x, y), nodes, (segment, dist) in zip(points, geo.nearest_nodes(points, 3), geo.nearest_segments(points)):
+            scan = sorted((((n.x - x) ** 2 + (n.y - y) ** 2) ** 0.5, i) for i, n in enumerate(geo.way_nodes))
+            self.assertEqual([geo.way_nodes.index(n) for n, d in nodes], [i for d, i in scan[:3]])
+            closest = [seg.closest_to_point(x, y) for seg in segments]
+            self.assertAlmostEqual(dist, min(((cx - x) ** 2 + (cy - y) ** 2) ** 0.5 for cx, cy in closest))
+            self.assertTrue(segment in segments)
+
+
+class PolygonTest(unittest.TestCase):
+    """Tests polygon region queries of Simulation and reading .poly files."""
+
+    def test_get_in_polygon(self):
+        """Test get_in_polygon() finds the Persons whose coordinates are inside the polygon."""
+        s = simulation()
+        s.add_persons(RandomWiggler, 40)
+        geo = s.geo
+        x0, y0 = geo.start_x, geo.start_y
+        w, h = geo.end_x - x0, geo.end_y - y0
+        # concave outer ring with a notch from the north and a square hole
+        outer = [(x0 + 0.1 * w, y0 + 0.1 * h), (x0 + 0.9 * w, y0 + 0.1 * h), (x0 + 0.9 * w, y0 + 0.9 * h),
+                 (x0 + 0.6 * w, y0 + 0.9 * h), (x0 + 0.5 * w, y0 + 0.4 * h), (x0 + 0.4 * w, y0 + 0.9 * h),
+                 (x0 + 0.1 * w, y0 + 0.9 * h)]
+        hole = [(x0 + 0.2 * w, y0 + 0.2 * h), (x0 + 0.35 * w, y0 + 0.2 * h), (x0 + 0.35 * w, y0 + 0.35 * h), (x0 + 0.2 * w, y0 + 0.35 * h)]
+        polygon = collide.Polygon(outer, hole)
+        found = 0
+        for until in (1, 50, 200, 400):
+            s.run(until=until, real_time=False, monitor=False)
+            expected = set(p for p in s.persons if polygon.contains_point(*p.current_coords()))
+            self.assertEqual(s.get_in_polygon(polygon), expected)
+            found += len(expected)
+        self.assertTrue(0 < found < 4 * 40)
+
+    def test_read_poly(self):
+        """Test read_poly() reads the bundled .poly files and holes."""
+        data = os.path.dirname(MAP)
+        for name in ('chicago1', 'hannover4', 'hannover7', 'hannover8'):
+            fname = os.path.join(data, name + '.poly')
+            polygon = osm.read_poly(fname)
+            # lines after the name line: section name and corners
+            corners = [line for line in open(fname).read().splitlines()[1:] if line.strip() and line.strip() != 'END']
+            self.assertEqual(len(polygon.rings), 1)
+            self.assertEqual(len(polygon.rings[0]), len(corners) - 1)
+        fd, path = tempfile.mkstemp(suffix='.poly')
+        os.write(fd, 'test\nouter\n9.70 52.37\n9.74 52.37\n9.74 52.39\n9.70 52.39\nEND\n'
+                     '!hole\n9.71 52.375\n9.72 52.375\n9.72 52.38\nEND\nEND\n')
+        os.close(fd)
+        try:
+            polygon = osm.read_poly(path)
+        finally:
+            os.remove(path)
+        self.assertEqual([len(ring) for ring in polygon.rings], [4, 3])
+        x, y = [sum(c) / 3.0 for c in zip(*polygon.rings[1])]
+        self.assertFalse(polygon.contains_point(x, y))
+        x, y = polygon.rings[0][0]
+        self.assertTrue(polygon.contains_point(x + 10, y + 10))
+
+
+class SectorTest(unittest.TestCase):
+    """Tests sector region queries of Simulation."""
+
+    def test_get_in_sector(self):
+        """Test get_in_sector() finds the Persons whose coordinates are inside the sector, with and without PersonHash."""
+        for person_hash in (False, True):
+            s = simulation()
+            s.add_persons(RandomWiggler, 40)
+            if person_hash:
+                s.enable_person_hash()
+            geo = s.geo
+            x = (geo.start_x + geo.end_x) / 2.0
+            y = (geo.start_y + geo.end_y) / 2.0
+            radius = max(geo.end_x - geo.start_x, geo.end_y - geo.start_y) / 2.0
+            found = 0
+            for until in (1, 50, 200):
+                s.run(until=until, real_time=False, monitor=False)
+                for angle, direction in ((90, 0), (60, 200), (270, 45)):
+                    sector = collide.Sector(x, y, radius, angle, direction)
+                    expected = set(p for p in s.persons if sector.contains_point(*p.current_coords()))
+                    self.assertEqual(s.get_in_sector(x, y, radius, angle, direction), expected)
+                    found += len(expected)
+            self.assertTrue(found > 0)
+
+
+class CheckpointTest(unittest.TestCase):
+    """Tests mosp.checkpoint."""
+
+    def test_restore_continues(self):
+        """Test a restored Simulation continues like the checkpointed one."""
+        s = simulation()
+        add_wigglers(s)
+        s.run(until=100, real_time=False, monitor=False)
+        fd, path = tempfile.mkstemp(suffix='.ckpt')
+        os.close(fd)
+        try:
+            checkpoint.save(s, path)
+            r = checkpoint.restore(path)
+        finally:
+            os.remove(path)
+        self.assertEqual(coords(r), coords(s))
+        s.run(until=300, real_time=False, monitor=False)
+        r.run(until=300, real_time=False, monitor=False)
+        self.assertEqual(coords(r), coords(s))
+
+    def test_restore_passivated(self):
+        """Test Persons paused at the checkpoint stay at their coordinates and continue after the pause."""
+        s = simulation()
+        add_wigglers(s)
+        s.run(until=100, real_time=False, monitor=False)
+        paused = [s.get_person(i) for i in (1, 2, 9)]
+        for person in paused:
+            person.pause_movement(200)
+        s.run(until=150, real_time=False, monitor=False)
+        self.assertTrue(all(person._passivated for person in paused))
+        fd, path = tempfile.mkstemp(suffix='.ckpt')
+        os.close(fd)
+        try:
+            checkpoint.save(s, path)
+            r = checkpoint.restore(path)
+        finally:
+            os.remove(path)
+        self.assertEqual(coords(r), coords(s))
+        for person in paused:
+            restored = r.get_person(person.p_id)
+            self.assertEqual(restored.current_coords, restored._stopped_coords)
+        s.run(until=400, real_time=False, monitor=False)
+        r.run(until=400, real_time=False, monitor=False)
+        self.assertFalse(any(r.get_person(person.p_id)._passivated for person in paused))
+        self.assertEqual(coords(r), coords(s))
+
+
+if __name__ == "__main__":
+    unittest.main()
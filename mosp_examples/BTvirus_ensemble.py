@@ -0,0 +1,44 @@
+#!/bin/env python
+
+"""Ensemble example: BT-Virus infection for many seeds
+    - BT-Virus scenario of BTvirus_wiggler.py without output
+    - map is loaded once, every seed is simulated in a forked process
+    - prints infected persons per seed and their mean
+"""
+
+import sys
+sys.path.append("..") 
+
+from mosp.core import Simulation
+from mosp.ensemble import Ensemble
+from mosp.geo import osm
+from BTvirus_wiggler import BTVirusWiggler, enable_infection
+
+__author__ = "B. Henne"
+__contact__ = "henne@dcsec.uni-hannover.de"
+__copyright__ = "(c) 2012, DCSec, Leibniz Universitaet Hannover, Germany"
+__license__ = "GPLv3"
+
+
+def replicate(geo, seed):
+    """Simulates one hour of the BT-Virus scenario, returns number of infected persons."""
+    s = Simulation(geo=geo, seed=seed)
+    enable_infection(s)
+    s.add_persons(BTVirusWiggler, 1, args={"infected":True, "infectionTime":-301})
+    s.add_persons(BTVirusWiggler, 89)
+    s.run(until=3600, real_time=False, monitor=False)
+    return len([p for p in s.persons if p.p_infected])
+
+
+def main():
+    """Runs the BT-Virus scenario for 100 seeds on hannover2.osm."""
+    e = Ensemble(osm.OSMModel('../data/hannover2.osm'))
+    infected = []
+    for seed, result in e.run(replicate, xrange(100)):
+        print seed, result
+        infected.append(result)
+    print 'mean', float(sum(infected)) / len(infected)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,8 @@
 """Infect action example with infection duration and action delay: BT-Virus example
     - random movement
     - BT infection
-        - infection range <= 10 up to 20m
-        - infection duration == after being 15s in infection range 
+        - infection range <= 15m
+        - infection duration == after being 15s in infection range, tracked by a ContactTracker
         - 1 initial infected and 89 healthy devices
     - output to visual player, which is executed as child process
 """
@@ -12,7 +12,7 @@
 import sys
 sys.path.append("..") 
 
-from mosp.core import Simulation, Person, action, start_action
+from mosp.core import Simulation, Person, action, start_action, stop_action
 from mosp.geo import osm
 from mosp.impl import movement
 from mosp.monitors import ChildprocessPlayerChamplainMonitor, SocketPlayerMonitor, EmptyMonitor
@@ -23,17 +23,37 @@ __copyright__ = "(c) 2011, DCSec, Leibniz Universitaet Hannover, Germany"
 __license__ = "GPLv3"
 
 
+INFECTION_RANGE = 15        #: devices in this distance or closer are in infection range
+INFECTION_DURATION = 15     #: device gets infected after being this number of ticks in infection range
+
+
+def infect(a, b, tick):
+    """Subscriber of the ContactTracker: a and b were INFECTION_DURATION ticks in infection range."""
+    for infecting_one, other in ((a, b), (b, a)):
+        if infecting_one.p_infectious and not other.p_infected:
+            other.get_infected(infecting_one)
+
+
+def enable_infection(sim):
+    """Enables the ContactTracker of sim and subscribes infect(), call once before the Simulation runs."""
+    tracker = sim.enable_contact_tracker(INFECTION_RANGE)
+    tracker.subscribe(INFECTION_DURATION, infect)
+    return tracker
+
+
 class BTVirusWiggler(Person):
     """Models a random movement BT-virus infection
     
-    Mobile device gets infected if compatible device is in range of 10 to 20m for 15 seconds.
+    Mobile device gets infected if compatible device is in range of 15m for 15 seconds.
+    The durations of contacts are tracked by the Simulation's ContactTracker, which
+    must be enabled by enable_infection().
     @author: B. Henne"""
     
     def __init__(self, *args, **kwargs):
         """Init the BT-Infect-Wiggler."""
         super(BTVirusWiggler, self).__init__(*args, **kwargs)
         self.p_infected = False                               #: infected?
-        self.pplInRange = {}                                  #: stores infecting people in range
+        self.p_infectious = False                             #: infecting others?
         self.p_infecttime = None                              #: time if infection
         if 'infected' in kwargs:
             self.p_color = 1                                  #: color for playerChamplain
@@ -48,45 +68,32 @@ class BTVirusWiggler(Person):
             
     next_target = movement.person_next_target_random
     
-    def tryinfect(self, infecting_one):
-        """The infection routine itself.
-        
-        If not infected, person gets infected if bad one is in range of 10 to 20m for 15 seconds."""
+    def get_infected(self, infecting_one):
+        """The infection routine itself, called when infecting_one was in range for 15 seconds."""
         now = self.sim.now()
-        if infecting_one not in self.pplInRange:                        # was not in range till now?
-            new = { infecting_one : [1, now]}                           # remember duration, last time
-            self.pplInRange.update(new)                                 # and store
-        else:                                                           # was in range before?
-            old = self.pplInRange[infecting_one]                        # get old
-            if old[1] < self.sim.now()-1:                               # if last time was not last tick
-                new = { infecting_one : [1, now] }                      # reset: remember duration, last time
-                self.pplInRange.update(new)                             # and store
-            else:                                                       # last time was last tick or newer
-                new = { infecting_one : [old[0]+1, now] }               # increase duration, update last time
-                self.pplInRange.update(new)                             # and store
-            if self.pplInRange[infecting_one][0] >= 15:                 # if infection time is reached
-                self.p_color = 3
-                self.p_color_rgba = (0.5,0.0,0.5,1.0)
-                self.p_infected = True                                    # I'm infected, infectious in 300s
-                self.p_infectionTime = now                                # I was infected when
-                self.p_infectionPlace = self.current_coords()             # I was infected where
-                print self.p_infectionTime, self.p_infectionPlace[0], self.p_infectionPlace[1], self.name, infecting_one.name
-                start_action(self.infect_other, delay=300)              # start being infectious after 300s
+        self.p_color = 3
+        self.p_color_rgba = (0.5,0.0,0.5,1.0)
+        self.p_infected = True                                    # I'm infected, infectious in 300s
+        self.p_infectionTime = now                                # I was infected when
+        self.p_infectionPlace = self.current_coords()             # I was infected where
+        print self.p_infectionTime, self.p_infectionPlace[0], self.p_infectionPlace[1], self.name, infecting_one.name
+        start_action(self.infect_other, delay=300)              # start being infectious after 300s
 
     @action(1, start=False)
     def infect_other(self):
         """The BT infect action.
         
-        Every tick this action is called (using the mosp action decorator).
-        This action looks for people in range of random(10,20) meters, and calls
-        their tryinfect() routine (300s start delay is done by start_action(this, delay=300).
-        Action is not active at beginning. It is activated by self.infect_other.start()
-        and then is called every tick."""
-        if self.p_infected == True:
-            if self.p_color == 3: 
-                self.p_color = 1  # used to viz difference of being only infected and also infecting after 300s
-                self.p_color_rgba = (0.9,0.1,0.1,1.0)
-            self.get_near(self._random.randint(10,20), self_included=False).filter(p_infected=False).call(delay=0).tryinfect(self)
+        This action makes the device infectious and is executed once. Action is
+        not active at beginning. It is activated by start_action(self.infect_other)
+        (300s start delay is done by start_action(this, delay=300)). Contacts of
+        the device already in range are counted from now on, other devices get
+        infected by infect() when in range for 15 seconds."""
+        if self.p_color == 3: 
+            self.p_color = 1  # used to viz difference of being only infected and also infecting after 300s
+            self.p_color_rgba = (0.9,0.1,0.1,1.0)
+        self.p_infectious = True
+        self.sim.encounters.restart(self)
+        stop_action(self.infect_other)
 
 
 def main():
@@ -95,6 +102,7 @@ def main():
     map: hannover2.osm, output to socketPlayer or champlain child process player, 
     89 healthy people, 1 infected, infection using action decorator."""
     s = Simulation(geo=osm.OSMModel('../data/hannover2.osm'), rel_speed=120)
+    enable_infection(s)
     #m = s.add_monitor(ChildprocessPlayerChamplainMonitor, 10)
     m = s.add_monitor(SocketPlayerMonitor, 2)
     s.add_persons(BTVirusWiggler, 1, monitor=m, args={"infected":True, "infectionTime":-301})
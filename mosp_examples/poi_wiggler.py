@@ -19,7 +19,7 @@ import random
 
 from mosp.core import Simulation, Person
 from mosp.locations import Exit
-from mosp.geo import osm, utils
+from mosp.geo import osm
 from mosp.monitors import PipePlayerMonitor, SocketPlayerMonitor
 
 __author__ = "B. Henne"
@@ -52,7 +52,7 @@ class PoiWiggler(Person):
         self.p_state = GO_SOMEWHERE
         self.p_cafe = None
         self.p_color = self.p_id
-        self.p_color_rgba = COLOR[self.p_id]
+        self.p_color_rgba = COLOR[self.p_id % len(COLOR)]
         self.next_target = self.next_target_routed
 
     def think(self):
@@ -105,21 +105,16 @@ class PoiWiggler(Person):
             self.next_node = next
 
 
-def main():
-    """Defines the simulation, map, monitors, persons. Connects POI with road network."""
-    s = Simulation(geo=osm.OSMModel('../data/hannover2.osm'), rel_speed=30)
+def connect_cafes(s):
+    """Connects bars, cafes and pubs of the map with the road network.
+    @param s: the mosp.core.Simulation
+    @return: list of connected POI nodes"""
     # cafes are buildings and located in non_way_nodes --> filter that by tags
     cafes = [node for node in s.geo.non_way_nodes if "amenity" in node.tags and node.tags["amenity"] in ("bar","cafe","pub")]
     for cafe in cafes:
-        # find nearest node to cafe
-        dist = float('inf')
-        nearest = None
         if not cafe.neighbors:
-            for node in s.geo.way_nodes:
-                d = utils.distance(cafe, node)
-                if d < dist and node.neighbors:
-                    dist = d
-                    nearest = node
+            # find nearest node to cafe
+            nearest, dist = s.geo.nearest_node(cafe.x, cafe.y)[0]
             # update neighbors
             cafe.neighbors[nearest] = int(dist)
             nearest.neighbors[cafe] = int(dist)
@@ -130,6 +125,13 @@ def main():
             nearest.ways[cafe] = way
             s.geo.add(way)
             # add exit to cafe
+    return cafes
+
+
+def main():
+    """Defines the simulation, map, monitors, persons. Connects POI with road network."""
+    s = Simulation(geo=osm.OSMModel('../data/hannover2.osm'), rel_speed=30)
+    cafes = connect_cafes(s)
     m = s.add_monitor(SocketPlayerMonitor, 2)
     s.add_persons(PoiWiggler, 2, monitor=m, args={"cafes": cafes})
     s.run(until=10000, real_time=True, monitor=True)
@@ -41,7 +41,7 @@ class RoutingShowcaseWiggler(Person):
         """Init the RoutingShowcaseWiggler person."""
         Person.__init__(self, *args)
         self.dest_node = self.next_node
-        self.p_color_rgba = COLOR[self.p_id]
+        self.p_color_rgba = list(COLOR[self.p_id % len(COLOR)])
         self.routed = True
         self.next_target = self.next_target_routed
 
@@ -49,7 +49,7 @@ class RoutingShowcaseWiggler(Person):
         """Find next destination, change movement and/or check if next_node was reached."""
         if self.next_node == self.dest_node and self.routed:
             self.start_node = self.dest_node
-            self.dest_node = self._random.choice([n for n in self.sim.geo.way_nodes if "border" not in n.tags])
+            self.dest_node = self._random.choice(self.sim.geo.start_nodes)
             color = self.p_color_rgba[:-1] + [0.5]
             self.sim.monitors[0].draw_point(self.p_id + 100, self.dest_node.lat, self.dest_node.lon, 5, self.p_color_rgba, ttl=0)
             if self._random.random() < 0.5:
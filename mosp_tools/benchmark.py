@@ -0,0 +1,236 @@
+#!/bin/env python
+"""Benchmark of canonical MOSP scenarios
+    - runs a matrix of scenarios from mosp_examples, maps and population sizes
+    - every run is executed in a new process, so peak RSS and caches are not shared
+    - records ticks/s, events/s, peak RSS, map load, setup and run time,
+      and the phase timers and counters of mosp.stats
+    - writes the results to a JSON file
+    - compares the results to a stored baseline results file,
+      exit status is 1 if a run got slower or needs more memory than allowed
+
+Examples:
+    python benchmark.py -o baseline.json
+    python benchmark.py -o new.json -b baseline.json -t 0.1
+    python benchmark.py -s zombie,btvirus -n 100,1000,10000 -r 3
+
+Map load times include routing calculation and grid creation if their
+cache files in data/ do not exist yet, e.g. about 2 minutes for kl0.
+"""
+
+import json
+import multiprocessing
+import optparse
+import os
+import platform
+import resource
+import sys
+import time
+import traceback
+
+BASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(BASE)
+
+from mosp.core import Simulation
+from mosp.geo import osm
+from mosp.monitors import EmptyMonitor
+
+__author__ = "B. Henne"
+__contact__ = "henne@dcsec.uni-hannover.de"
+__copyright__ = "(c) 2012, DCSec, Leibniz Universitaet Hannover, Germany"
+__license__ = "GPLv3"
+
+VERSION = 1     #: version of the results file format
+
+
+def setup_zombie(s, n):
+    """ZombieWiggler with one infected zombie per 50 Persons."""
+    from mosp_examples.zombie_wiggler import ZombieWiggler
+    infected = max(n / 50, 1)
+    s.add_persons(ZombieWiggler, n - infected)
+    s.add_persons(ZombieWiggler, infected, args={"infected": True, "speed": 0.7})
+
+
+def setup_btvirus(s, n):
+    """BTVirusWiggler with one infectious device per 50 Persons."""
+    from mosp_examples.BTvirus_wiggler import BTVirusWiggler, enable_infection
+    enable_infection(s)
+    infected = max(n / 50, 1)
+    s.add_persons(BTVirusWiggler, n - infected)
+    s.add_persons(BTVirusWiggler, infected, args={"infected": True, "infectionTime": -301})
+
+
+def setup_routing(s, n):
+    """RoutingShowcaseWiggler switching between routed and random movement."""
+    from mosp_examples.routing_wiggler import RoutingShowcaseWiggler
+    s.add_persons(RoutingShowcaseWiggler, n)
+
+
+def setup_statemachine(s, n):
+    """WorkWigglers and DrunkWigglers with working day state machines, requires map kl0."""
+    from mosp_examples.statemachine_wiggler import WorkWiggler, DrunkWiggler
+    s.add_persons(WorkWiggler, n - n / 2)
+    s.add_persons(DrunkWiggler, n / 2)
+
+
+def setup_poi(s, n):
+    """PoiWiggler walking to bars, cafes and pubs alternately."""
+    from mosp_examples.poi_wiggler import PoiWiggler, connect_cafes
+    s.add_persons(PoiWiggler, n, args={"cafes": connect_cafes(s)})
+
+
+SCENARIOS = {
+    # name: (setup function, default maps, default ticks)
+    'zombie': (setup_zombie, ('hannover0', 'hannover2'), 900),
+    'btvirus': (setup_btvirus, ('hannover2',), 1800),
+    'routing': (setup_routing, ('hannover2',), 1800),
+    'statemachine': (setup_statemachine, ('kl0',), 12000),
+    'poi': (setup_poi, ('hannover2',), 1800),
+    }
+SIZES = (100, 1000)     #: default population sizes
+
+
+def run_case(scenario, map_name, persons, ticks, seed):
+    """Runs one scenario and returns its measurements as dict."""
+    setup = SCENARIOS[scenario][0]
+    t = time.time()
+    s = Simulation(geo=osm.OSMModel(os.path.join(BASE, 'data', map_name + '.osm')), seed=seed)
+    load = time.time() - t
+    # examples draw to the first monitor
+    s.add_monitor(EmptyMonitor)
+    t = time.time()
+    setup(s, persons)
+    setup_time = time.time() - t
+    stats = s.enable_stats()
+    t = time.time()
+    s.run(until=ticks, real_time=False, monitor=False)
+    run = time.time() - t
+    counters = stats.as_dict()
+    return {'scenario': scenario,
+            'map': map_name,
+            'persons': persons,
+            'ticks': ticks,
+            'seed': seed,
+            'load_s': load,
+            'setup_s': setup_time,
+            'run_s': run,
+            'ticks_per_s': ticks / run if run else None,
+            'events_per_s': counters['events'] / run if run else None,
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'stats': counters}
+
+
+def _work(conn, case):
+    """Worker process: runs case with output of the examples discarded and sends (ok, result)."""
+    sys.stdout = sys.stderr = open(os.devnull, 'w')
+    try:
+        conn.send((True, run_case(*case)))
+    except Exception:
+        conn.send((False, traceback.format_exc()))
+    conn.close()
+
+
+def run_isolated(case):
+    """Runs case in a new process.
+    @return: (ok, result dict or traceback)"""
+    receiver, sender = multiprocessing.Pipe(False)
+    worker = multiprocessing.Process(target=_work, args=(sender, case))
+    worker.start()
+    sender.close()
+    try:
+        re = receiver.recv()
+    except EOFError:
+        re = False, 'worker died with exit code %s' % worker.exitcode
+    worker.join()
+    return re
+
+
+def key(result):
+    """Identifies comparable results."""
+    return result['scenario'], result['map'], result['persons'], result['ticks']
+
+
+def compare(results, baseline, threshold):
+    """Prints results relative to baseline.
+    @param threshold: allowed relative loss of ticks/s and gain of peak RSS
+    @return: number of regressions"""
+    base = dict((key(r), r) for r in baseline['results'])
+    regressions = 0
+    print '%-12s %-10s %7s %7s %12s %8s %10s %8s' % ('scenario', 'map', 'persons', 'ticks', 'ticks/s', 'ratio', 'rss MB', 'ratio')
+    for r in results:
+        b = base.get(key(r))
+        if b is None or not b['ticks_per_s'] or not r['ticks_per_s']:
+            print '%-12s %-10s %7s %7s %12.1f %8s %10.1f %8s' % (key(r) + (r['ticks_per_s'] or 0, '-', r['peak_rss_kb'] / 1024.0, '-'))
+            continue
+        speed = r['ticks_per_s'] / b['ticks_per_s']
+        rss = float(r['peak_rss_kb']) / b['peak_rss_kb']
+        slower = speed < 1 - threshold
+        bigger = rss > 1 + threshold
+        regressions += slower or bigger
+        print '%-12s %-10s %7s %7s %12.1f %7.2f%s %10.1f %7.2f%s' % (key(r) + (r['ticks_per_s'], speed, '!' if slower else ' ',
+                                                                      r['peak_rss_kb'] / 1024.0, rss, '!' if bigger else ' '))
+    return regressions
+
+
+def main():
+    """Parses the command line, runs the benchmark matrix and writes/compares results."""
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-s', '--scenarios', default=','.join(sorted(SCENARIOS)),
+                      help='comma separated scenarios of %s [default: all]' % ', '.join(sorted(SCENARIOS)))
+    parser.add_option('-m', '--maps', help='comma separated maps in data/ for all scenarios [default: maps of scenario]')
+    parser.add_option('-n', '--persons', default=','.join(str(n) for n in SIZES),
+                      help='comma separated population sizes [default: %default]')
+    parser.add_option('-u', '--ticks', type='int', help='simulated ticks [default: ticks of scenario]')
+    parser.add_option('-r', '--repeat', type='int', default=1, help='runs per case, the fastest is recorded [default: %default]')
+    parser.add_option('--seed', type='int', default=1, help='Simulation seed [default: %default]')
+    parser.add_option('-o', '--output', help='write results to JSON file')
+    parser.add_option('-b', '--baseline', help='compare results to JSON file written by -o')
+    parser.add_option('-t', '--threshold', type='float', default=0.1,
+                      help='relative ticks/s loss and peak RSS gain reported as regression [default: %default]')
+    options, args = parser.parse_args()
+
+    cases = []
+    for scenario in options.scenarios.split(','):
+        if scenario not in SCENARIOS:
+            parser.error('unknown scenario %s' % scenario)
+        setup, maps, ticks = SCENARIOS[scenario]
+        if options.maps:
+            maps = options.maps.split(',')
+        for map_name in maps:
+            for persons in options.persons.split(','):
+                cases.append((scenario, map_name, int(persons), options.ticks or ticks, options.seed))
+
+    results = []
+    failed = 0
+    for case in cases:
+        best = None
+        for i in xrange(options.repeat):
+            ok, result = run_isolated(case)
+            if not ok:
+                sys.stderr.write('%s %s %s persons failed:\n%s\n' % (case[0], case[1], case[2], result))
+                failed += 1
+                break
+            if best is None or result['run_s'] < best['run_s']:
+                best = result
+        else:
+            results.append(best)
+            sys.stderr.write('%(scenario)s %(map)s %(persons)s persons: %(ticks_per_s).1f ticks/s, %(peak_rss_kb)s KB, load %(load_s).2fs\n' % best)
+
+    if options.output:
+        f = open(options.output, 'w')
+        json.dump({'version': VERSION,
+                   'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                   'python': sys.version,
+                   'platform': platform.platform(),
+                   'results': results}, f, indent=1, sort_keys=True)
+        f.close()
+    regressions = 0
+    if options.baseline:
+        f = open(options.baseline)
+        baseline = json.load(f)
+        f.close()
+        regressions = compare(results, baseline, options.threshold)
+    sys.exit(1 if failed or regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -17,7 +17,7 @@ import sys
 sys.path.append("..")
 
 from mosp.geo.utm import utm_to_latlong, latlong_to_utm
-from mosp.geo import osm, utils
+from mosp.geo import osm
 
 __author__ = "F. Ludwig"
 __copyright__ = "(c) 2010-2011, DCSec, Leibniz Universitaet Hannover, Germany"
@@ -115,15 +115,7 @@ class Finder(object):
         mouse-pointer."""
         coords = self.actor.get_coords_from_event(event)
         coords_utm = latlong_to_utm(coords[1], coords[0])
-        class Node:
-            x = coords_utm[0]
-            y = coords_utm[1]
-        nearest = self.data.way_nodes[0]
-        nearest_dist = utils.distance(Node, nearest)
-        for node in self.data.way_nodes:
-            if utils.distance(Node, node) < nearest_dist:
-                nearest = node
-                nearest_dist = utils.distance(Node, node)
+        nearest, nearest_dist = self.data.nearest_node(coords_utm[0], coords_utm[1])[0]
 
         print
         print "==========KLICK=========="